@@ -0,0 +1,533 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+See 'printUsage()' function.
+"""
+
+import sys
+import os
+import os.path
+import time
+import random
+import resource
+import subprocess
+import tempfile
+import shutil
+import cPickle
+import traceback
+import json
+import socket
+import argparse
+import xlrd
+
+import params as p
+import rwfiles as rw
+import htcount
+import samples
+import synthetic
+import fastqqc
+try:
+    import p_makefilelists as mfl       # installed next to this script (from r0_prepareInput)
+except ImportError:
+    mfl = None
+
+
+def measure(func, *args): # Run func(*args) in a child process {{{
+    """Run 'func(*args)' in a forked child process, so that measurements do not depend on
+    memory allocated by previous benchmarks.
+    Returns (seconds, peak_rss_kb, result); 'result' must be picklable.
+    Peak RSS is the maximum over the child and its own (waited for) children.
+    An exception in the child is raised in the parent with the child's traceback.
+    """
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid==0:
+        # The child never returns to the caller: an exception would run its 'finally' blocks
+        # (like removal of directories used by the parent); it is passed to the parent instead
+        try:
+            os.close(rfd)
+            try:
+                t0 = time.time()
+                result = func(*args)
+                seconds = time.time() - t0
+                peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+                outcome = (None, (seconds, peak_rss, result))
+            except BaseException:
+                outcome = (traceback.format_exc(), None)
+            with os.fdopen(wfd, 'wb') as f:
+                cPickle.dump(outcome, f, 2)
+        finally:
+            os._exit(0)
+    os.close(wfd)
+    with os.fdopen(rfd, 'rb') as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    if data=="":
+        raise Exception("Benchmark process of %s ended without result." % func.__name__)
+    (error, measurement) = cPickle.loads(data)
+    if error is not None:
+        raise Exception("Benchmark %s failed:\n%s" % (func.__name__, error))
+    return measurement
+#}}}
+
+def printResult(name, seconds, peak_rss_kb): #{{{
+    p.vprint(0, "  %-40s %10.3f s %10.1f MB" % (name, seconds, peak_rss_kb/1024.0))
+#}}}
+
+# Fasta {{{
+def randomRegions(fasta_path, nr_regions, region_length): #{{{
+    fa = rw.FastaFile(fasta_path)
+    regions = []
+    names = [ _n for _n in fa.names if fa.length(_n) > 0 ]
+    for i in range(nr_regions):
+        name = random.choice(names)
+        start = random.randint(0, max(fa.length(name)-region_length, 0))
+        regions.append( (name, start, start+region_length) )
+    return regions
+#}}}
+def fetchParsed(fasta_path, regions): #{{{
+    seqs = dict([ (_f.header.split(None,1)[0],_f.sequence) for _f in rw.iterFasta(fasta_path) ])
+    return [ seqs[_n][_s:_e] for (_n,_s,_e) in regions ]
+#}}}
+def fetchIndexed(fasta_path, regions): #{{{
+    fa = rw.FastaFile(fasta_path)
+    return [ fa.fetch(_n,_s,_e) for (_n,_s,_e) in regions ]
+#}}}
+def benchFasta(args): #{{{
+    fasta_path = rw.resolvePath(args[0])
+    nr_regions = int(args[1]) if len(args)>1 else 1000
+    region_length = int(args[2]) if len(args)>2 else 1000
+    p.vprint(0, "Fasta: %s, %d regions of %d bases" % (fasta_path, nr_regions, region_length))
+    (seconds, peak_rss, _) = measure(rw.buildFastaIndex, fasta_path)
+    printResult("buildFastaIndex", seconds, peak_rss)
+    regions = randomRegions(fasta_path, nr_regions, region_length)
+    (seconds, peak_rss, parsed) = measure(fetchParsed, fasta_path, regions)
+    printResult("iterFasta + slicing", seconds, peak_rss)
+    (seconds, peak_rss, fetched) = measure(fetchIndexed, fasta_path, regions)
+    printResult("FastaFile.fetch", seconds, peak_rss)
+    if parsed!=fetched:
+        p.vprint(0, "ERROR: fetched regions differ from parsed ones.")
+#}}}
+#}}}
+
+# HTSeq {{{
+def runHtseqCount(gtf_path, sam_paths, out_dir): #{{{
+    procs = []
+    for (i, sam_path) in enumerate(sam_paths):
+        with open(os.path.join(out_dir, "%d_htseq.count" % i), 'w') as f:
+            procs.append( subprocess.Popen(["htseq-count", "-s", "no", "-t", "exon",
+                                            "-i", "gene_id", sam_path, gtf_path],
+                                           stdout=f, stderr=open(os.devnull, 'w')) )
+    return [ _p.wait() for _p in procs ]
+#}}}
+def runHtcount(gtf_path, sam_paths, out_dir, nr_workers): #{{{
+    count_paths = [ os.path.join(out_dir, "%d_htseq.count" % _i) for _i in range(len(sam_paths)) ]
+    htcount.countSamples(gtf_path, sam_paths, count_paths, "no", nr_workers=nr_workers)
+#}}}
+def benchHtseq(args): #{{{
+    gtf_path = rw.resolvePath(args[0])
+    sam_paths = [ rw.resolvePath(_a) for _a in args[1:] if not _a.startswith("-j") ]
+    nr_workers = ([ int(_a[2:]) for _a in args if _a.startswith("-j") ] + [None])[0]
+    p.vprint(0, "HTSeq: %s, %d SAM files" % (gtf_path, len(sam_paths)))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        (htseq_dir, htcount_dir) = (os.path.join(tmp_dir,"htseq"), os.path.join(tmp_dir,"htcount"))
+        os.mkdir(htseq_dir)
+        os.mkdir(htcount_dir)
+        # The first run builds the annotation index, the second one reuses it
+        (seconds, peak_rss, _) = measure(runHtcount, gtf_path, sam_paths, htcount_dir, nr_workers)
+        printResult("p_htseqcount (building index)", seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(runHtcount, gtf_path, sam_paths, htcount_dir, nr_workers)
+        printResult("p_htseqcount (cached index)", seconds, peak_rss)
+        (seconds, peak_rss, rcs) = measure(runHtseqCount, gtf_path, sam_paths, htseq_dir)
+        if max(rcs)!=0:
+            p.vprint(0, "  htseq-count failed (is it in PATH?)")
+        else:
+            printResult("htseq-count (one process per file)", seconds, peak_rss)
+            for i in range(len(sam_paths)):
+                fn = "%d_htseq.count" % i
+                if ( rw.loadLines(os.path.join(htseq_dir,fn)) !=
+                     rw.loadLines(os.path.join(htcount_dir,fn)) ):
+                    p.vprint(0, "ERROR: counts differ for %s" % sam_paths[i])
+    finally:
+        shutil.rmtree(tmp_dir)
+#}}}
+#}}}
+
+# Excel {{{
+def loadExcelCellwise(filename): #{{{
+    """loadExcel as it was before: eager workbook, a call of cell_value() per cell."""
+    wb = xlrd.open_workbook(filename)
+    ws = wb.sheet_by_index(0)
+    colnames = [ ws.cell_value(0,_j) for _j in range(ws.ncols) ]
+    rows = []
+    for i in range(1, ws.nrows):
+        row = dict()
+        for j in range(len(colnames)):
+            row[colnames[j]] = ws.cell_value(i,j)
+        rows.append(row)
+    return (rows, colnames)
+#}}}
+def nrRows(func, *args, **kwargs): #{{{
+    """Number of rows loaded by 'func', so that large results are not sent between processes."""
+    result = func(*args, **kwargs)
+    return len(result[0]) if isinstance(result, tuple) else len(result)
+#}}}
+def saveWorkbook(filename, nr_rows): #{{{
+    colnames = [ "col%d" % _j for _j in range(10) ]
+    rw.saveExcel(filename, ( dict([ (_cn, "s%d" % _i if _j%2 else _i*0.5)
+                                    for (_j, _cn) in enumerate(colnames) ])
+                             for _i in xrange(nr_rows) ), colnames)
+#}}}
+def benchExcel(args): #{{{
+    nr_rows = int(args[0]) if len(args)>0 else 60000
+    nr_files = int(args[1]) if len(args)>1 else 8
+    p.vprint(0, "Excel: %d rows x 10 columns (.xls: at most 65000 rows), %d workbooks" %
+                (nr_rows, nr_files))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        (xls_path, xlsx_path) = (os.path.join(tmp_dir, "t.xls"), os.path.join(tmp_dir, "t.xlsx"))
+        p.changeVL(0)
+        measure(saveWorkbook, xls_path, min(nr_rows, 65000))
+        (seconds, peak_rss, _) = measure(saveWorkbook, xlsx_path, nr_rows)
+        p.restoreVL()
+        printResult("saveExcel .xlsx (streaming)", seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(nrRows, loadExcelCellwise, xls_path)
+        printResult("xlrd cell by cell .xls (before)", seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(nrRows, rw.loadExcel, xls_path)
+        printResult("loadExcel .xls", seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(lambda: nrRows(rw.loadExcel, xls_path, as_table=True))
+        printResult("loadExcel .xls as Table", seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(nrRows, rw.loadExcel, xlsx_path)
+        printResult("loadExcel .xlsx", seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(lambda: len(xlrd.open_workbook(xls_path).sheet_names()))
+        printResult("sheet names .xls (before)", seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(lambda: nrRows(rw.loadExcel, xls_path, worksheet=None))
+        printResult("loadExcel .xls, worksheet=None", seconds, peak_rss)
+        if rw.loadExcel(xls_path) != loadExcelCellwise(xls_path):
+            p.vprint(0, "ERROR: loadExcel differs from cell by cell reading.")
+        paths = []
+        for i in range(nr_files):
+            paths.append(os.path.join(tmp_dir, "t%d.xls" % i))
+            shutil.copy(xls_path, paths[-1])
+        (seconds, peak_rss, _) = measure(lambda: [ nrRows(rw.loadExcel, _fn) for _fn in paths ])
+        printResult("loadExcel x %d .xls, one by one" % nr_files, seconds, peak_rss)
+        (seconds, peak_rss, _) = measure(nrRows, rw.loadExcelFiles, paths)
+        printResult("loadExcelFiles x %d .xls" % nr_files, seconds, peak_rss)
+    finally:
+        shutil.rmtree(tmp_dir)
+#}}}
+#}}}
+
+# File list {{{
+def fileListQuadratic(rows, parnames): #{{{
+    """Sample names, base filenames, files of base filenames and sample rows, computed as
+    p_makefilelists did before (list membership tests and a scan of all rows per base filename)."""
+    unique_samplenames = []
+    unique_filenames = []
+    base_parnames = [ _p for _p in parnames if _p not in samples.special_parnames ]
+    file_parnames = base_parnames + (["Read"] if "Read" in parnames else [])
+    for row in rows:
+        samplename = '_'.join([ row[_p] for _p in base_parnames ])
+        filename = '_'.join([ row[_p] for _p in file_parnames ])
+        row["SampleName"] = samplename
+        row["Basefilename"] = filename
+        if samplename not in unique_samplenames:  unique_samplenames.append(samplename)
+        if filename not in unique_filenames:  unique_filenames.append(filename)
+    files = [ [ _r["file"] for _r in rows if _r["Basefilename"]==_bfn ] for _bfn in unique_filenames ]
+    sl_parnames = ["SampleName"] + [ _p for _p in parnames if _p not in samples.nosl_parnames ]
+    sl_rows = []
+    for row in rows:
+        sl_row = dict([ (_p,row[_p]) for _p in sl_parnames ])
+        if sl_row not in sl_rows:  sl_rows.append(sl_row)
+    return (unique_samplenames, unique_filenames, files, sl_rows)
+#}}}
+def fileListRegistry(rows, parnames): #{{{
+    """The same as 'fileListQuadratic' by samples.SampleRegistry."""
+    registry = samples.SampleRegistry(rows, parnames)
+    registry.addBasenames(".fastq.gz")
+    sl_parnames = ["SampleName"] + [ _p for _p in parnames if _p not in samples.nosl_parnames ]
+    return (registry.samplenames, registry.basenames,
+            [ registry.files(_bfn) for _bfn in registry.basenames ], registry.sampleRows(sl_parnames))
+#}}}
+def benchFileList(args): #{{{
+    nr_files = int(args[0]) if len(args)>0 else 100000
+    nr_samples = int(args[1]) if len(args)>1 else 1000
+    (rows, parnames) = synthetic.fileListRows(nr_files, nr_samples)
+    p.vprint(0, "File list: %d files, %d samples" % (len(rows), nr_samples))
+    p.changeVL(0)
+    (seconds, peak_rss, new) = measure(fileListRegistry, rows, parnames)
+    printResult("SampleRegistry", seconds, peak_rss)
+    if "-q" not in args:
+        (seconds, peak_rss, old) = measure(fileListQuadratic, rows, parnames)
+        printResult("list scans (before)", seconds, peak_rss)
+        if old!=new:
+            p.vprint(0, "ERROR: results differ.")
+    p.restoreVL()
+#}}}
+#}}}
+
+# Suite {{{
+# Operations timed on a data set written by 'synthetic.generate'.  Each operation is a function
+# (data_dir) ==> (number of items, unit, bytes read or written, seconds of the timed part or None
+# for the whole call); it runs in a child process (see 'measure'), with the parse cache disabled.
+def timed(func, *args): #{{{
+    """(result of func(*args), seconds)."""
+    t0 = time.time()
+    result = func(*args)
+    return (result, time.time() - t0)
+#}}}
+def opLoad(loader, filename, unit="rows"): #{{{
+    def op(data_dir):
+        path = os.path.join(data_dir, filename)
+        (rows, _) = loader(path)
+        return (len(rows), unit, os.path.getsize(path), None)
+    return op
+#}}}
+def opSaveCSV(data_dir): #{{{
+    (rows, parnames) = synthetic.fileListRows(*fileListSize(data_dir))
+    path = os.path.join(data_dir, "processedData", "bench.csv")
+    (_, seconds) = timed(rw.saveCSV, path, rows, parnames)
+    return (len(rows), "rows", os.path.getsize(path), seconds)
+#}}}
+def opAddWorksheet(xlsx): #{{{
+    def op(data_dir):
+        (rows, parnames) = synthetic.fileListRows(*fileListSize(data_dir))
+        if not xlsx:
+            rows = rows[:synthetic.xls_max_rows]
+        path = os.path.join(data_dir, "processedData", "bench.xlsx" if xlsx else "bench.xls")
+        t0 = time.time()
+        wb = rw.createExcelWorkbook(xlsx)
+        rw.addExcelWorksheet(wb, "files", rows, parnames)
+        rw.saveExcelWorkbook(path, wb)
+        return (len(rows), "rows", os.path.getsize(path), time.time() - t0)
+    return op
+#}}}
+def opParseFasta(data_dir): #{{{
+    path = os.path.join(data_dir, "genome.fa")
+    entries = rw.parseFasta(path)
+    return (sum([ len(_e.sequence) for _e in entries ]), "bases", os.path.getsize(path), None)
+#}}}
+def opParseGff(data_dir): #{{{
+    path = os.path.join(data_dir, "genes.gff3")
+    return (len(rw.parseGffGenes(path)), "genes", os.path.getsize(path), None)
+#}}}
+def opSamBatches(data_dir): #{{{
+    path = os.path.join(data_dir, "reads_pe.sam")
+    return (sum([ len(_b) for _b in rw.iterSamBatches(path) ]), "records", os.path.getsize(path), None)
+#}}}
+def opFastqStats(data_dir): #{{{
+    path = os.path.join(data_dir, "reads.fq")
+    return (fastqqc.fastqStats(path).nr_reads, "reads", os.path.getsize(path), None)
+#}}}
+def opFileListWriter(writer_name, output): #{{{
+    """p_makefilelists writer, after parsing scripts/a_files.txt and assigning base filenames
+    as its main() does (not timed)."""
+    def op(data_dir):
+        mfl.input_path = os.path.join(data_dir, "scripts", "a_files.txt")
+        (mfl.filelist, mfl.parnames) = mfl.loadTxt(mfl.input_path)
+        mfl.checkAndFillOmissions()
+        mfl.getExtensions()
+        mfl.addBasenames()
+        (_, seconds) = timed(getattr(mfl, writer_name))
+        return (len(mfl.filelist), "files", os.path.getsize(os.path.join(data_dir, output)), seconds)
+    return op
+#}}}
+def fileListSize(data_dir): #{{{
+    with open(os.path.join(data_dir, "sizes.json")) as f:
+        sizes = json.load(f)
+    return (sizes["nr_files"], sizes["nr_samples"])
+#}}}
+
+suite_ops = [ ("loadCSV .csv", opLoad(rw.loadCSV, "scripts/a_files.csv")),
+              ("loadExcel .xls", opLoad(rw.loadExcel, "scripts/a_files.xls")),
+              ("loadExcel .xlsx", opLoad(rw.loadExcel, "scripts/a_files.xlsx")),
+              ("saveCSV", opSaveCSV),
+              ("addExcelWorksheet .xls", opAddWorksheet(False)),
+              ("addExcelWorksheet .xlsx", opAddWorksheet(True)),
+              ("parseFasta", opParseFasta),
+              ("parseGffGenes", opParseGff),
+              ("iterSamBatches", opSamBatches),
+              ("fastqStats", opFastqStats) ]
+if mfl is not None:
+    suite_ops[:0] = [ ("loadTxt .txt", opLoad(mfl.loadTxt, "scripts/a_files.txt")) ]
+    suite_ops += [ ("p_makefilelists write_FL_SH", opFileListWriter("write_FL_SH",
+                                                                    "scripts/g_filelist.sh")),
+                   ("p_makefilelists write_SD", opFileListWriter("write_SD",
+                                                                 "processedData/SampleDescription.csv")),
+                   ("p_makefilelists write_AffySD", opFileListWriter("write_AffySD",
+                                                     "processedData/AffySampleDescription.csv")) ]
+
+def gitCommit(): #{{{
+    """(short hash of HEAD, True if the tree has changes) of the repository of this script, or
+    ("unknown", False)."""
+    scriptdir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                             cwd=scriptdir, stderr=devnull).strip()
+            dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"],
+                                    cwd=scriptdir, stderr=devnull)!=0
+        return (commit, dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return ("unknown", False)
+#}}}
+def benchGenerate(args): #{{{
+    if len(args)<1:
+        printUsage()
+        exit()
+    data_dir = rw.resolvePath(args[0])
+    scale = float(args[1]) if len(args)>1 else 1.0
+    p.vprint(0, "Generating data set of scale %g in %s" % (scale, data_dir))
+    (seconds, peak_rss, sizes) = measure(synthetic.generate, data_dir, scale)
+    printResult("synthetic.generate", seconds, peak_rss)
+    p.vprint(0, "  " + ", ".join([ "%s=%s" % (_k, sizes[_k]) for _k in sorted(sizes) ]))
+#}}}
+def benchSuite(args): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-n", dest="repeats", default=1, type=int)
+    parser.add_argument("-l", dest="label", default=None)
+    parser.add_argument("data_dir")
+    parser.add_argument("results_file")
+    args = parser.parse_args(args)
+    data_dir = rw.resolvePath(args.data_dir)
+    results_path = rw.resolvePath(args.results_file)
+    if not os.path.isfile(os.path.join(data_dir, "sizes.json")):
+        p.vprint(0, "ERROR: no data set in %s (see 'generate')." % data_dir)
+        exit(1)
+    with open(os.path.join(data_dir, "sizes.json")) as f:
+        scale = json.load(f)["scale"]
+    (commit, dirty) = gitCommit()
+    label = args.label or (commit + ("+" if dirty else ""))
+    if mfl is None:
+        p.vprint(0, "WARNING: p_makefilelists.py not found next to this script; skipped.")
+    p.vprint(0, "Suite: %s (scale %g), version %s" % (data_dir, scale, label))
+    # Operations use paths relative to the data set, which is the project directory
+    p.projdir = data_dir
+    rw.cache_enabled = False
+    p.changeVL(0)
+    records = []
+    for i in range(args.repeats):
+        for (name, op) in suite_ops:
+            (seconds, peak_rss, (items, unit, nr_bytes, op_seconds)) = measure(op, data_dir)
+            seconds = max(op_seconds if op_seconds is not None else seconds, 1e-6)
+            printResult(name, seconds, peak_rss)
+            records.append(dict(version=label, commit=commit, dirty=dirty, host=socket.gethostname(),
+                                date=time.strftime("%Y-%m-%d %H:%M:%S"), scale=scale, name=name,
+                                seconds=round(seconds, 4), peak_rss_mb=round(peak_rss/1024.0, 1),
+                                items=items, unit=unit, items_per_s=round(items/seconds, 1),
+                                mb_per_s=round(nr_bytes/1048576.0/seconds, 2)))
+    p.restoreVL()
+    with open(results_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+    p.vprint(0, "%d results appended to %s." % (len(records), results_path))
+#}}}
+def benchCompare(args): #{{{
+    if len(args)<1:
+        printUsage()
+        exit()
+    records = []
+    with open(rw.resolvePath(args[0])) as f:
+        for line in f:
+            records.append(json.loads(line))
+    versions = []
+    for record in records:
+        if record["version"] not in versions:
+            versions.append(record["version"])
+    (old, new) = (args[1], args[2]) if len(args)>2 else \
+                 (versions[-2], versions[-1]) if len(versions)>1 else (None, None)
+    if old is None or old not in versions or new not in versions:
+        p.vprint(0, "ERROR: two versions are needed (found: %s)." % ", ".join(versions))
+        exit(1)
+    # The best (shortest) of repeated measurements, its throughput and the largest peak memory
+    best = dict()
+    for record in records:
+        key = (record["version"], record["name"])
+        if key not in best:
+            best[key] = dict(record)
+        else:
+            b = best[key]
+            if record["seconds"] < b["seconds"]:
+                (b["seconds"], b["items_per_s"], b["mb_per_s"]) = \
+                    (record["seconds"], record["items_per_s"], record["mb_per_s"])
+            b["peak_rss_mb"] = max(b["peak_rss_mb"], record["peak_rss_mb"])
+    names = []
+    for record in records:
+        if record["version"] in (old, new) and record["name"] not in names:
+            names.append(record["name"])
+    p.vprint(0, "Comparison of %s (old) and %s (new):" % (old, new))
+    p.vprint(0, "  %-30s %10s %10s %7s %14s %10s %10s" %
+                ("", "old s", "new s", "ratio", "new items/s", "old MB", "new MB"))
+    for name in names:
+        (a, b) = (best.get((old, name)), best.get((new, name)))
+        if a is None or b is None:
+            p.vprint(0, "  %-30s %s" % (name, "only in %s" % (old if b is None else new)))
+            continue
+        ratio = b["seconds"] / max(a["seconds"], 1e-6)
+        mark = "  SLOWER" if ratio > 1.1 else "  faster" if ratio < 0.9 else ""
+        if b["peak_rss_mb"] > a["peak_rss_mb"]*1.1:
+            mark += "  MORE MEMORY"
+        p.vprint(0, "  %-30s %10.3f %10.3f %7.2f %14.1f %10.1f %10.1f%s" %
+                    (name, a["seconds"], b["seconds"], ratio, b["items_per_s"],
+                     a["peak_rss_mb"], b["peak_rss_mb"], mark))
+#}}}
+#}}}
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_benchmark.py  benchmark  [arguments...]
+Benchmarks:
+    fasta  fasta-file  [nr-regions [region-length]]
+        -- time of building Fasta index, and of fetching random regions through
+           iterFasta (parsing the whole file) and through FastaFile (indexed access)
+    htseq  gtf-file  sam-file...  [-jN]
+        -- time of counting reads by p_htseqcount.py (N worker processes) and by htseq-count
+           (one process per file, as in r4_HTSeq before); results are compared
+    excel  [nr-rows [nr-workbooks]]
+        -- time of loading generated workbooks (10 columns, default 60000 rows) by xlrd cell by
+           cell (as loadExcel did before), by loadExcel (.xls and streamed .xlsx), and of loading
+           nr-workbooks (default 8) copies one by one and by loadExcelFiles (pool of processes)
+    filelist  [nr-files [nr-samples]]  [-q]
+        -- time of assigning sample names and base filenames, grouping files and making sample
+           rows for p_makefilelists.py, on a synthetic file list (default: 100000 files of
+           1000 samples, 4 lanes, paired reads), by SampleRegistry and by list scans as
+           before (skipped with -q); results are compared
+    generate  data-dir  [scale]
+        -- write a synthetic data set to data-dir (see 'synthetic' module); scale 1 (default):
+           file descriptions of 10000 files of 100 samples (txt, csv, xls, xlsx), a genome of
+           10 Mb in 8 chromosomes, 5000 genes (GFF3, GTF), 200000 reads (Fastq, single-end
+           SAM) and 100000 pairs (paired-end SAM); all sizes are multiplied by scale
+    suite  [-n repeats]  [-l label]  data-dir  results-file
+        -- time loadTxt, loadCSV, loadExcel (.xls, .xlsx), saveCSV, addExcelWorksheet (.xls,
+           .xlsx), parseFasta, parseGffGenes, iterSamBatches, fastqStats and the writers of
+           p_makefilelists.py on the data set (parse cache disabled), and append a JSON line
+           per operation to results-file: version (label, default: git commit, "+" if the tree
+           has changes), seconds, items and MB per second, peak memory
+    compare  results-file  [old-version  new-version]
+        -- compare the best times, throughput and peak memory of two versions in results-file
+           (default: the last two); ratios above 1.1 are marked
+Each benchmark runs in a separate process; time and peak memory (RSS) are printed.
+""")
+#}}}
+
+benchmarks = dict([ ("fasta", benchFasta),
+                    ("excel", benchExcel),
+                    ("filelist", benchFileList),
+                    ("htseq", benchHtseq),
+                    ("generate", benchGenerate),
+                    ("suite", benchSuite),
+                    ("compare", benchCompare) ])
+def main(): #{{{
+    if len(sys.argv)<2 or sys.argv[1] not in benchmarks:
+        printUsage()
+        exit()
+    benchmarks[sys.argv[1]](sys.argv[2:])
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
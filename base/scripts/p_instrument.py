@@ -0,0 +1,122 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Run commands with measurement of resources, and report on the run log.
+See 'instrument' module for details and 'printUsage()' function for usage.
+"""
+
+import sys
+import os
+import os.path
+import argparse
+
+import params as p
+import rwfiles as rw
+import instrument
+
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_instrument.py  run  [options]  --  command...
+        scripts/xvpy [-v] scripts/p_instrument.py  report  [options]
+Command 'run' runs 'command' and appends its wall time, user and system CPU time, peak RSS,
+bytes read and written and exit status to the run log; exits with the exit status of the command.
+A single argument is run by bash, several arguments are executed as they are.
+    --stage name        -- stage name (default: name of the command)
+    --name name         -- name of the record, like sample name (default: stage name)
+    --log file          -- write output of the command to 'file'
+Command 'report' prints, from the run log:
+    stages of their latest runs (number of jobs, failed, total and longest wall time,
+    CPU time, peak RSS, bytes read and written), the slowest jobs of the latest runs, and
+    regressions: jobs (same stage and name) whose last successful run was slower, or used more
+    memory, than the previous one.
+    --stage name        -- only this stage
+    --top N             -- number of the slowest jobs (default: 10)
+    --threshold R       -- ratio of regression (default: 1.25) ...
+    --min-seconds S     -- ... and wall time longer at least by S seconds (default: 5)
+Both commands:
+    --runlog file       -- run log (default: %s, or environment variable RUNLOG)
+Python scripts run by 'xvpy' are measured by 'run' if environment variable INSTRUMENT is set to
+the stage name.  Jobs run by p_runjobs.py and p_starjobs.py are recorded by them.
+""" % instrument.runlog_filename)
+#}}}
+
+def commandRun(argv): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--stage", default=None)
+    parser.add_argument("--name", default=None)
+    parser.add_argument("--log", default=None)
+    parser.add_argument("--runlog", default=None)
+    parser.add_argument("command", nargs='+')
+    args = parser.parse_args(argv)
+    command = args.command[0] if len(args.command)==1 else args.command
+    stage = args.stage or os.path.basename(args.command[0].split()[0])
+    log_path = rw.resolvePath(args.log) if args.log is not None else None
+    record = instrument.runCommand(command, stage, args.name, log_path, args.runlog)
+    p.vprint(1, "%s: exit status %d, %.1f s, %.1f s CPU, %.1f MB." %
+                (record["name"], record["rc"], record["wall_s"], record["user_s"]+record["sys_s"],
+                 record["max_rss_mb"]))
+    exit(record["rc"] if record["rc"] >= 0 else 128-record["rc"])
+#}}}
+
+def megabytes(nr_bytes): #{{{
+    return "%10.1f" % (nr_bytes/1048576.0) if nr_bytes is not None else "%10s" % "-"
+#}}}
+
+def commandReport(argv): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--stage", default=None)
+    parser.add_argument("--top", default=10, type=int)
+    parser.add_argument("--threshold", default=1.25, type=float)
+    parser.add_argument("--min-seconds", dest="min_seconds", default=5.0, type=float)
+    parser.add_argument("--runlog", default=None)
+    args = parser.parse_args(argv)
+    records = instrument.loadRunLog(args.runlog)
+    if args.stage is not None:
+        records = [ _r for _r in records if _r["stage"]==args.stage ]
+    if len(records)==0:
+        p.vprint(0, "No records in the run log.")
+        return
+    latest = instrument.latestRuns(records)
+
+    p.vprint(0, "Stages (latest runs):")
+    p.vprint(0, "  %-16s %-19s %5s %6s %10s %10s %10s %10s %10s %10s" %
+                ("stage", "started", "jobs", "failed", "wall s", "max wall s", "CPU s",
+                 "max RSS MB", "read MB", "written MB"))
+    for s in instrument.stageSummary(latest):
+        p.vprint(0, "  %-16s %-19s %5d %6d %10.1f %10.1f %10.1f %10.1f %s %s" %
+                    (s["stage"], s["start"], s["n"], s["failed"], s["wall_s"], s["max_wall_s"],
+                     s["cpu_s"], s["max_rss_mb"], megabytes(s["read_bytes"]),
+                     megabytes(s["write_bytes"])))
+
+    p.vprint(0, "\nSlowest jobs (latest runs):")
+    p.vprint(0, "  %-16s %-24s %4s %10s %10s %10s %10s %10s" %
+                ("stage", "name", "rc", "wall s", "CPU s", "max RSS MB", "read MB", "written MB"))
+    for r in instrument.slowest(latest, args.top):
+        p.vprint(0, "  %-16s %-24s %4d %10.1f %10.1f %10.1f %s %s" %
+                    (r["stage"], r["name"], r["rc"], r["wall_s"], r["user_s"]+r["sys_s"],
+                     r["max_rss_mb"], megabytes(r["read_bytes"]), megabytes(r["write_bytes"])))
+
+    pairs = instrument.regressions(records, args.threshold, args.min_seconds)
+    p.vprint(0, "\nRegressions (last successful run against the previous one): %d" % len(pairs))
+    for (prev, last) in pairs:
+        p.vprint(0, "  %-16s %-24s wall %8.1f --> %8.1f s (x%.2f)   RSS %8.1f --> %8.1f MB   %s --> %s" %
+                    (last["stage"], last["name"], prev["wall_s"], last["wall_s"],
+                     last["wall_s"]/max(prev["wall_s"], 0.001), prev["max_rss_mb"],
+                     last["max_rss_mb"], prev["start"], last["start"]))
+#}}}
+
+commands = { "run": commandRun, "report": commandReport }
+
+def main(): #{{{
+    if len(sys.argv)<2 or sys.argv[1] not in commands:
+        printUsage()
+        exit()
+    commands[sys.argv[1]](sys.argv[2:])
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
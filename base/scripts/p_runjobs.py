@@ -0,0 +1,130 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Run a command for each sample within budgets of cores, threads and memory.
+See 'jobs' module for details and 'printUsage()' function for usage.
+"""
+
+import sys
+import os
+import os.path
+import glob
+import argparse
+
+import params as p
+import rwfiles as rw
+import jobs
+import manifest as mf
+
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_runjobs.py  [options]  --  command...
+Runs 'command' (by bash) once for each sample; "{sn}" in the command is replaced by the sample
+name.  Samples are taken from SAMPLENAMES in scripts/g_filelist.sh.
+Options:
+    --name name         -- name of the stage, used for the log directory (default: jobs)
+    --cores N           -- cores available to all jobs (default: number of CPUs)
+    --threads N         -- threads available to all jobs (default: unlimited)
+    --mem GB            -- memory available to all jobs (default: memory of the node)
+    --job-cores N       -- cores used by one job (default: 1)
+    --job-threads N     -- threads used by one job (default: the same as --job-cores)
+    --job-mem GB        -- memory used by one job (default: 0)
+    --size pattern      -- glob pattern of input files of a sample (with "{sn}"); samples with
+                           larger inputs are started first
+    --logs dir          -- directory of log files, one per sample: "dir/sample-name.log"
+                           (default: processedData/logs/name)
+    --samples "sn..."   -- samples to process instead of SAMPLENAMES
+Incremental execution (see 'manifest' module):
+    --out-dir dir       -- stage directory; "{tmp}" in the command is replaced by an empty
+                           temporary directory, whose contents are moved to 'dir' only if the job
+                           succeeds.  Samples already computed from the same inputs, with the same
+                           command and versions of tools, are skipped.
+    --inputs pattern    -- glob pattern of input files of a sample (with "{sn}"), may be repeated;
+                           used also as --size if that is not given
+    --hash              -- compare checksums of inputs, not only sizes and modification times
+    --force             -- run all samples, even if up to date
+Prints exit status of each job (of failed jobs even without -v); exits with 1 if any failed.
+Wall and CPU time, peak memory and I/O of each job are appended to the run log
+(processedData/runlog.jsonl, see p_instrument.py) with the stage name.
+Example:
+    scripts/xvpy -v scripts/p_runjobs.py --name bam --job-threads 2 --job-mem 2 \\
+        --size "processedData/star/{sn}_Aligned.out.sam" -- \\
+        "samtools view -S -b {sn}.sam | samtools sort - {sn}_sorted"
+    scripts/xvpy -v scripts/p_runjobs.py --name bam --out-dir processedData/bam \\
+        --inputs "processedData/star/{sn}_Aligned.out.sam" -- \\
+        "samtools view -S -b {sn}.sam | samtools sort - {tmp}/{sn}_sorted"
+""")
+#}}}
+
+def main(): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--name", default="jobs")
+    parser.add_argument("--cores", default=None, type=int)
+    parser.add_argument("--threads", default=None, type=int)
+    parser.add_argument("--mem", default=None, type=float)
+    parser.add_argument("--job-cores", dest="job_cores", default=1, type=int)
+    parser.add_argument("--job-threads", dest="job_threads", default=None, type=int)
+    parser.add_argument("--job-mem", dest="job_mem", default=0, type=float)
+    parser.add_argument("--size", default=None)
+    parser.add_argument("--logs", default=None)
+    parser.add_argument("--samples", default=None)
+    parser.add_argument("--out-dir", dest="out_dir", default=None)
+    parser.add_argument("--inputs", action="append", default=[])
+    parser.add_argument("--hash", action="store_true")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("command", nargs='+')
+    if len(sys.argv)<2:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+
+    if args.samples is None:
+        fl = rw.loadShellVars(os.path.join(p.projdir, "scripts", "g_filelist.sh"))
+        args.samples = fl["SAMPLENAMES"]
+    max_mem = int(args.mem*1024) if args.mem is not None else jobs.totalMemory()
+    log_dir = rw.makePath(args.logs or os.path.join("processedData", "logs", args.name))
+    command = " ".join(args.command)
+
+    manifest = None
+    if args.out_dir is not None:
+        manifest = mf.Manifest(rw.makePath(args.out_dir), args.hash)
+    elif "{tmp}" in command:
+        raise Exception("Command contains {tmp}, but --out-dir is not given.")
+    size_patterns = [ args.size ] if args.size else args.inputs
+
+    (job_list, signatures, skipped) = ([], dict(), [])
+    for sn in args.samples.split():
+        cmd = command.replace("{sn}", sn)
+        if manifest is not None:
+            input_paths = sorted([ _ip for _pt in args.inputs
+                                   for _ip in glob.glob(rw.resolvePath(_pt.replace("{sn}", sn))) ])
+            signatures[sn] = manifest.signature(input_paths, cmd)
+            if not args.force and manifest.isUpToDate(sn, signatures[sn]):
+                skipped.append(sn)
+                continue
+            cmd = cmd.replace("{tmp}", manifest.tmpDir(sn))
+        size = sum([ jobs.inputSize(rw.resolvePath(_pt.replace("{sn}", sn))) for _pt in size_patterns ])
+        job_list.append( jobs.Job(sn, cmd, size,
+                                  cores=args.job_cores,
+                                  threads=args.job_threads or args.job_cores,
+                                  mem=int(args.job_mem*1024),
+                                  log_path=os.path.join(log_dir, sn+".log")) )
+    if len(skipped) > 0:
+        p.printList(1, "Skipping %d samples which are up to date", skipped)
+
+    def commitJob(job):
+        if manifest is not None and job.rc==0:
+            manifest.record(job.name, signatures[job.name], manifest.commitOutputs(job.name))
+    runner = jobs.JobRunner(args.cores, args.threads, max_mem, stage=args.name)
+    runner.run(job_list, commitJob)
+    jobs.printReport(0, job_list)
+    if len([ _j for _j in job_list if _j.rc!=0 ]) > 0:
+        exit(1)
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
@@ -32,6 +32,10 @@ else
     export VERBOSITY_LEVEL=0
 fi
 
+# Records of the run log (see p_instrument.py) written by this script and all scripts it runs
+# belong to one run
+export RUN_ID=${RUN_ID:-$(date +%Y%m%d-%H%M%S)-$$}
+
 if [ $VERBOSITY_LEVEL != "0" ]; then
     echo "Versbosity: $VERBOSITY_LEVEL.  Project directory: $PROJDIR"
 fi
@@ -0,0 +1,248 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module collects alignment statistics of samples into one sample x metric table:
+    - metrics of STAR's "Log.final.out" files ('parseStarLog'), with mapping times in seconds
+      computed from time stamps of the log;
+    - optionally, statistics of SAM files computed in one pass ('samStats'): flags (primary,
+      secondary, supplementary, unmapped, duplicate records), mapping quality classes, spliced
+      alignments and junctions, mates (proper pairs, mate unmapped, mates on different references)
+      and insert sizes.
+SAM files are split into byte ranges ('rwfiles.samChunks'); all ranges of all samples are
+processed by one pool of worker processes, and each range is read in batches of NumPy arrays
+('rwfiles.iterSamBatches').  Per-range results are plain counters and histograms, which are summed.
+Each sample also gets timing metrics: duration of the SAM pass (summed over its ranges).
+"""
+
+import os
+import os.path
+import time
+import datetime
+import json
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+import params as p
+import rwfiles as rw
+
+
+star_time_names = [ "Started job on", "Started mapping on", "Finished on" ]
+star_time_format = "%b %d %H:%M:%S"
+default_chunk_size = 64*1024*1024
+
+# SAM counters, in the order of output; all but "records" and "reads" count primary records
+# (flags 0x100 and 0x800 not set), reads are counted once (first mates of pairs)
+sam_counters = [ "records", "secondary", "supplementary", "duplicate", "qc_fail",
+                 "reads", "mapped_reads", "unmapped_reads",
+                 "spliced", "junctions",
+                 "paired", "proper_pairs", "mate_unmapped", "mate_other_ref" ]
+(RECORDS, SECONDARY, SUPPLEMENTARY, DUPLICATE, QC_FAIL, READS, MAPPED, UNMAPPED,
+ SPLICED, JUNCTIONS, PAIRED, PROPER_PAIRS, MATE_UNMAPPED, MATE_OTHER_REF) = range(len(sam_counters))
+sam_metric_names = [ "SAM records", "SAM secondary alignments", "SAM supplementary alignments",
+                     "SAM duplicates", "SAM QC failed",
+                     "SAM reads", "SAM mapped reads", "SAM unmapped reads",
+                     "SAM spliced alignments", "SAM splice junctions",
+                     "SAM paired alignments", "SAM proper pairs", "SAM mate unmapped",
+                     "SAM mates on other reference" ]
+# Classes of mapping quality of mapped reads: [ low, high ) bounds; STAR uses 255 (unique),
+# 3 (2 loci), 1 (3-4 loci), 0 (more loci)
+mapq_bounds = [ 0, 1, 3, 4, 255, 256 ]
+mapq_metric_names = [ "SAM MAPQ 0", "SAM MAPQ 1-2", "SAM MAPQ 3", "SAM MAPQ 4-254", "SAM MAPQ 255" ]
+max_insert_size = 100000        # larger insert sizes are counted in the last bin
+
+def parseStarLog(filename): #{{{
+    """Metrics of STAR log "sample_Log.final.out" as an OrderedDict(name --> value).
+    Numbers are converted to int or float ("%" is removed from percentages, the name keeps it),
+    section titles ("UNIQUE READS:") are skipped.  Time stamps are kept as strings, and metrics
+    "STAR total time (s)" (start of job to finish) and "STAR mapping time (s)" are added.
+    """
+    metrics = OrderedDict()
+    for line in rw.loadLines(filename):
+        if '|' not in line:
+            continue
+        (name, value) = [ _s.strip() for _s in line.split('|', 1) ]
+        if name in star_time_names:
+            metrics[name] = value
+            continue
+        try:
+            metrics[name] = int(value)
+        except ValueError:
+            try:
+                metrics[name] = float(value.rstrip('%'))
+            except ValueError:
+                metrics[name] = value
+    if all([ _n in metrics for _n in star_time_names ]):
+        # Time stamps have no year; a leap year is assumed, so that "Feb 29" is valid
+        (started, mapping, finished) = [ datetime.datetime.strptime("2000 " + metrics[_n],
+                                                                    "%Y " + star_time_format)
+                                         for _n in star_time_names ]
+        metrics["STAR total time (s)"] = starSeconds(started, finished)
+        metrics["STAR mapping time (s)"] = starSeconds(mapping, finished)
+    return metrics
+#}}}
+
+def starSeconds(start, end): #{{{
+    """Seconds between time stamps of STAR log (without year: a run may pass new year)."""
+    seconds = (end - start).total_seconds()
+    if seconds < 0:
+        seconds += 365*24*3600
+    return int(seconds)
+#}}}
+
+def samStats(task): #{{{
+    """Statistics of one byte range of SAM file.
+    'task' is (sample_idx, sam_path, start, end).
+    Returns (sample_idx, counters, mapq histogram, insert size histogram, seconds), where
+    'counters' is an int64 array in the order of 'sam_counters', the mapq histogram has 256 bins
+    and the insert size histogram max_insert_size+1 bins (absolute TLEN of proper pairs, counted
+    once per pair).
+    """
+    (sample_idx, sam_path, start, end) = task
+    started = time.time()
+    counters = np.zeros(len(sam_counters), dtype=np.int64)
+    mapq_hist = np.zeros(256, dtype=np.int64)
+    insert_hist = np.zeros(max_insert_size+1, dtype=np.int64)
+    for batch in rw.iterSamBatches(sam_path, start, end):
+        flags = batch.flags
+        counters[RECORDS] += len(batch)
+        counters[SECONDARY] += np.count_nonzero(flags & 0x100)
+        counters[SUPPLEMENTARY] += np.count_nonzero(flags & 0x800)
+        primary = (flags & 0x900)==0
+        counters[DUPLICATE] += np.count_nonzero(primary & ((flags & 0x400)!=0))
+        counters[QC_FAIL] += np.count_nonzero(primary & ((flags & 0x200)!=0))
+        # A read is counted by its single-end record, or by the first mate of a pair
+        paired = (flags & 0x1)!=0
+        read = primary & (~paired | ((flags & 0x40)!=0))
+        mapped = (flags & 0x4)==0
+        counters[READS] += np.count_nonzero(read)
+        counters[MAPPED] += np.count_nonzero(read & mapped)
+        counters[UNMAPPED] += np.count_nonzero(read & ~mapped)
+        mapq_hist += np.bincount(np.minimum(batch.mapq[read & mapped], 255), minlength=256)
+        # Junctions: CIGAR operations N of mapped primary records
+        aligned = primary & mapped
+        nr_junctions = np.array([ _c.count('N') for _c in batch.cigars ], dtype=np.int64)[aligned]
+        counters[SPLICED] += np.count_nonzero(nr_junctions)
+        counters[JUNCTIONS] += nr_junctions.sum()
+        # Mates: primary records of pairs; pairs counted by first mates
+        counters[PAIRED] += np.count_nonzero(aligned & paired)
+        first = aligned & paired & ((flags & 0x40)!=0)
+        proper = first & ((flags & 0x2)!=0) & ((flags & 0x8)==0)
+        counters[PROPER_PAIRS] += np.count_nonzero(proper)
+        counters[MATE_UNMAPPED] += np.count_nonzero(aligned & paired & ((flags & 0x8)!=0))
+        counters[MATE_OTHER_REF] += np.count_nonzero(first & ((flags & 0x8)==0) &
+                                                     (batch.mate_refids!=batch.refids))
+        insert_hist += np.bincount(np.minimum(np.abs(batch.tlen[proper]), max_insert_size),
+                                   minlength=max_insert_size+1)
+    return (sample_idx, counters, mapq_hist, insert_hist, time.time()-started)
+#}}}
+
+def histMedian(hist): #{{{
+    """Median of values counted by histogram 'hist' (value i has hist[i] occurrences)."""
+    total = hist.sum()
+    if total==0:
+        return 0
+    return int(np.searchsorted(np.cumsum(hist), (total+1)//2))
+#}}}
+
+def samMetrics(counters, mapq_hist, insert_hist): #{{{
+    """OrderedDict(name --> value) of SAM metrics from summed results of 'samStats'."""
+    metrics = OrderedDict(zip(sam_metric_names, counters.tolist()))
+    for (name, lo, hi) in zip(mapq_metric_names, mapq_bounds[:-1], mapq_bounds[1:]):
+        metrics[name] = int(mapq_hist[lo:hi].sum())
+    nr_pairs = insert_hist.sum()
+    sizes = np.arange(len(insert_hist))
+    metrics["SAM insert size median"] = histMedian(insert_hist)
+    metrics["SAM insert size mean"] = round(float((sizes*insert_hist).sum())/nr_pairs, 1) \
+                                      if nr_pairs > 0 else 0.0
+    return metrics
+#}}}
+
+def summarizeSamples(samples, log_filenames, sam_filenames=None, nr_workers=None,
+                     chunk_size=default_chunk_size): #{{{
+    """Alignment metrics of 'samples' (list of names): OrderedDict(sample --> OrderedDict(name
+    --> value)).  'log_filenames' are STAR "Log.final.out" files of samples; missing files are
+    reported and give no STAR metrics.  If 'sam_filenames' are given, their statistics are
+    computed by a pool of 'nr_workers' processes (default: number of CPUs), and metrics
+    "SAM pass time (s)" (time of the pass, summed over ranges) are added.
+    """
+    summary = OrderedDict([ (_sn, OrderedDict()) for _sn in samples ])
+    for (sn, log_fn) in zip(samples, log_filenames):
+        if os.path.isfile(rw.resolvePath(log_fn)):
+            summary[sn].update(parseStarLog(log_fn))
+        else:
+            p.vprint(0, "WARNING: STAR log not found: %s" % log_fn)
+    if sam_filenames is None:
+        return summary
+
+    tasks = []
+    for (i, sam_fn) in enumerate(sam_filenames):
+        sam_path = rw.resolvePath(sam_fn)
+        if not os.path.isfile(sam_path):
+            p.vprint(0, "WARNING: SAM file not found: %s" % sam_path)
+            continue
+        tasks.extend([ (i, sam_path, _s, _e) for (_s, _e) in rw.samChunks(sam_path, chunk_size) ])
+    results = [ [ np.zeros(len(sam_counters), dtype=np.int64), np.zeros(256, dtype=np.int64),
+                  np.zeros(max_insert_size+1, dtype=np.int64), 0.0 ] for _ in samples ]
+    nr_chunks = [ 0 ] * len(samples)
+    for task in tasks:  nr_chunks[task[0]] += 1
+    p.vprint(1, "Computing statistics of %d SAM files (%d chunks)..." %
+                (len([ _n for _n in nr_chunks if _n > 0 ]), len(tasks)))
+    pool = multiprocessing.Pool(nr_workers)
+    try:
+        for (i, counters, mapq_hist, insert_hist, seconds) in pool.imap_unordered(samStats, tasks):
+            result = results[i]
+            result[0] += counters
+            result[1] += mapq_hist
+            result[2] += insert_hist
+            result[3] += seconds
+            nr_chunks[i] -= 1
+            if nr_chunks[i]==0:
+                summary[samples[i]].update(samMetrics(*result[:3]))
+                summary[samples[i]]["SAM pass time (s)"] = round(result[3], 2)
+                p.vprint(1, "  %s: %d records in %.1f s." % (samples[i], result[0][RECORDS], result[3]))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return summary
+#}}}
+
+def metricNames(summary): #{{{
+    """Names of all metrics of 'summary', in the order of first appearance."""
+    names = OrderedDict()
+    for metrics in summary.values():
+        for name in metrics:
+            names[name] = True
+    return names.keys()
+#}}}
+
+def formatValue(value): #{{{
+    """String of a metric value for TSV (floats by 'repr', which keeps all digits)."""
+    return repr(value) if isinstance(value, float) else str(value)
+#}}}
+
+def saveSummary(summary, tsv_filename=None, json_filename=None, timing=None): #{{{
+    """Write 'summary' (see 'summarizeSamples') as a TSV table (a row per sample, a column per
+    metric; missing metrics are empty) and/or as JSON {"samples": summary, "timing": timing}.
+    Files are written under temporary names and then renamed.
+    """
+    if tsv_filename is not None:
+        names = metricNames(summary)
+        rows = []
+        for (sn, metrics) in summary.items():
+            row = dict([ (_n, formatValue(_v)) for (_n, _v) in metrics.items() ])
+            row["Sample"] = sn
+            rows.append(row)
+        fpath = rw.resolvePath(tsv_filename)
+        tmp_path = "%s.tmp%d" % (fpath, os.getpid())
+        rw.saveCSV(tmp_path, rows, [ "Sample" ] + names)
+        os.rename(tmp_path, fpath)
+    if json_filename is not None:
+        fpath = rw.resolvePath(json_filename)
+        tmp_path = "%s.tmp%d" % (fpath, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(OrderedDict([ ("samples", summary), ("timing", timing or {}) ]), f, indent=1)
+        os.rename(tmp_path, fpath)
+#}}}
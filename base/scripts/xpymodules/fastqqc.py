@@ -0,0 +1,275 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module computes quality control statistics of Fastq files, like FastQC does, in one
+streaming pass over batches of reads ('rwfiles.iterFastqBatches'); all per-read work is done
+by NumPy on whole batches.
+
+Modules (with FastQC default PASS/WARN/FAIL thresholds and comparisons):
+    Basic Statistics
+    Per base sequence quality       -- WARN: lower quartile < 10 or median < 25 at any position;
+                                       FAIL: lower quartile < 5 or median < 20; values of a group
+                                       of positions are averages of values of its positions
+    Per sequence quality scores     -- WARN: most frequent mean quality <= 27; FAIL: <= 20
+    Per base sequence content       -- WARN: A/T or G/C differ by > 10% at any position; FAIL: > 20%
+    Per sequence GC content         -- WARN: deviation from normal distribution > 15%; FAIL: > 30%
+    Per base N content              -- WARN: N > 5% at any position; FAIL: > 20%
+    Sequence Length Distribution    -- WARN: reads have different lengths; FAIL: empty reads
+Duplication, overrepresented sequences, adapter and k-mer content are not computed.
+
+Results are written in the format of FastQC ('saveReport'): archive "name_fastqc.zip" with
+"name_fastqc/summary.txt" and "name_fastqc/fastqc_data.txt", readable by 'p_fqcsumm.py'.
+"""
+
+import os
+import os.path
+import math
+import zipfile
+
+import numpy as np
+
+import params as p
+import rwfiles as rw
+
+
+max_quality = 94        # quality scores are 0..93 (Phred+33 printable characters)
+base_codes = np.full(256, 4, dtype=np.int64)    # A, C, G, T --> 0..3, anything else --> 4 (N)
+for (code, base) in enumerate("ACGT"):
+    base_codes[ord(base)] = base_codes[ord(base.lower())] = code
+
+class FastqStats(object): #{{{
+    """Accumulated statistics of Fastq records.
+    Arrays grow with the maximum read length L:
+        qual_counts     -- int64 (L, max_quality): count of each quality score at each position
+        base_counts     -- int64 (L, 5): count of A, C, G, T, N at each position
+        seq_quals       -- int64 (max_quality): count of reads by mean quality (truncated)
+        gc_counts       -- int64 (101): count of reads by GC percentage (rounded)
+        length_counts   -- int64 (L+1): count of reads by length
+    'offset' is the Phred offset (33 or 64), detected from the first batch.
+    """
+    def __init__(self):
+        self.nr_reads = 0
+        self.offset = None
+        self.qual_counts = np.zeros((0, max_quality), dtype=np.int64)
+        self.base_counts = np.zeros((0, 5), dtype=np.int64)
+        self.seq_quals = np.zeros(max_quality, dtype=np.int64)
+        self.gc_counts = np.zeros(101, dtype=np.int64)
+        self.length_counts = np.zeros(1, dtype=np.int64)
+
+    def grow(self, length): #{{{
+        old = len(self.base_counts)
+        if length > old:
+            self.qual_counts = np.vstack([ self.qual_counts,
+                                           np.zeros((length-old, max_quality), dtype=np.int64) ])
+            self.base_counts = np.vstack([ self.base_counts, np.zeros((length-old, 5), dtype=np.int64) ])
+            self.length_counts = np.concatenate([ self.length_counts,
+                                                  np.zeros(length-old, dtype=np.int64) ])
+    #}}}
+
+    def add(self, batch): #{{{
+        """Add records of FastqBatch 'batch'."""
+        n = len(batch)
+        if n==0:  return
+        lengths = batch.lengths
+        self.grow(int(lengths.max()))
+        self.nr_reads += n
+        self.length_counts += np.bincount(lengths, minlength=len(self.length_counts))
+        # Read index and position of each base of the batch
+        total = int(lengths.sum())
+        read_idx = np.repeat(np.arange(n), lengths)
+        firsts = np.cumsum(lengths) - lengths
+        pos = np.arange(total) - np.repeat(firsts, lengths)
+        buf = batch.buffer()
+        quals = buf[np.repeat(batch.qual_starts, lengths) + pos].astype(np.int64)
+        bases = base_codes[buf[np.repeat(batch.seq_starts, lengths) + pos]]
+        if self.offset is None:
+            self.offset = 64 if total > 0 and quals.min() >= 64 else 33
+        quals = np.clip(quals - self.offset, 0, max_quality-1)
+        L = len(self.base_counts)
+        self.qual_counts += np.bincount(pos*max_quality + quals,
+                                        minlength=L*max_quality).reshape(L, max_quality)
+        self.base_counts += np.bincount(pos*5 + bases, minlength=L*5).reshape(L, 5)
+        # Per read: mean quality and GC percentage (empty reads are skipped)
+        nonempty = lengths > 0
+        qual_sums = np.bincount(read_idx, weights=quals, minlength=n)
+        gc = np.bincount(read_idx, weights=((bases==1) | (bases==2)), minlength=n)
+        mean_quals = (qual_sums[nonempty] // lengths[nonempty]).astype(np.int64)
+        self.seq_quals += np.bincount(mean_quals, minlength=max_quality)
+        gc_percent = np.round(100.0 * gc[nonempty] / lengths[nonempty]).astype(np.int64)
+        self.gc_counts += np.bincount(gc_percent, minlength=101)
+    #}}}
+
+    def merge(self, other): #{{{
+        """Add statistics of another FastqStats object (for example, of another part of a file)."""
+        self.grow(len(other.base_counts))
+        other.grow(len(self.base_counts))
+        self.nr_reads += other.nr_reads
+        self.offset = self.offset or other.offset
+        for an in [ "qual_counts", "base_counts", "seq_quals", "gc_counts", "length_counts" ]:
+            setattr(self, an, getattr(self, an) + getattr(other, an))
+    #}}}
+#}}}
+
+def fastqStats(filename, batch_size=rw.io_buffer_size): #{{{
+    """FastqStats of (possibly gzipped) Fastq file."""
+    stats = FastqStats()
+    for batch in rw.iterFastqBatches(filename, batch_size):
+        stats.add(batch)
+    return stats
+#}}}
+
+# Report {{{
+def baseGroups(length): #{{{
+    """List of (first, last) 1-based positions reported as one row, like FastQC groups them:
+    positions 1-9 one by one, then groups of equal width, so that there are less than 75 rows.
+    """
+    if length <= 75:
+        return [ (_i, _i) for _i in range(1, length+1) ]
+    interval = None
+    multiplier = 1
+    while interval is None:
+        for b in [ 2, 5, 10 ]:
+            nr_groups = 9 + (length-9) // (b*multiplier) + (1 if (length-9) % (b*multiplier) else 0)
+            if nr_groups < 75:
+                interval = b*multiplier
+                break
+        multiplier *= 10
+    groups = [ (_i, _i) for _i in range(1, 10) ]
+    for start in range(10, length+1, interval):
+        groups.append( (start, min(start+interval-1, length)) )
+    return groups
+#}}}
+
+def groupName(group): #{{{
+    return str(group[0]) if group[0]==group[1] else "%d-%d" % group
+#}}}
+
+def percentile(counts, percent): #{{{
+    """Quality at 'percent' of distribution 'counts' (like FastQC's QualityCount)."""
+    cum = np.cumsum(counts)
+    return int(np.searchsorted(cum, cum[-1]*percent/100.0)) if cum[-1] > 0 else 0
+#}}}
+
+def status(value, warn, fail, higher_is_worse=True, inclusive=False): #{{{
+    """"fail", "warn" or "pass": 'value' beyond 'fail' or 'warn' (or equal to it if 'inclusive')."""
+    if not higher_is_worse:
+        (value, warn, fail) = (-value, -warn, -fail)
+    if inclusive:
+        return "fail" if value >= fail else "warn" if value >= warn else "pass"
+    return "fail" if value > fail else "warn" if value > warn else "pass"
+#}}}
+
+def moduleTables(stats, filename): #{{{
+    """List of (module name, status, header lines, rows) of FastQC report."""
+    modules = []
+    L = len(stats.base_counts)
+    groups = baseGroups(L)
+    qualities = np.arange(max_quality)
+    encoding = "Sanger / Illumina 1.9" if stats.offset!=64 else "Illumina 1.5"
+    nonzero_lengths = np.flatnonzero(stats.length_counts)
+    if len(nonzero_lengths)==0:
+        nonzero_lengths = np.zeros(1, dtype=np.int64)
+    (min_len, max_len) = (int(nonzero_lengths[0]), int(nonzero_lengths[-1]))
+    acgt = stats.base_counts[:,:4].sum()
+    gc_total = stats.base_counts[:,1:3].sum()
+
+    rows = [ ["Filename", os.path.basename(filename)],
+             ["File type", "Conventional base calls"],
+             ["Encoding", encoding],
+             ["Total Sequences", str(stats.nr_reads)],
+             ["Sequences flagged as poor quality", "0"],
+             ["Sequence length", str(max_len) if min_len==max_len else "%d-%d" % (min_len, max_len)],
+             ["%GC", str(int(100*gc_total//acgt) if acgt > 0 else 0)] ]
+    modules.append( ("Basic Statistics", "pass", ["#Measure\tValue"], rows) )
+
+    rows = []
+    (worst_lq, worst_median) = (max_quality, max_quality)
+    for group in groups:
+        # Like FastQC: mean and percentiles of each position, averaged over positions of the group
+        values = []
+        for counts in stats.qual_counts[group[0]-1:group[1]]:
+            total = counts.sum()
+            if total > 0:
+                values.append( [ float((counts*qualities).sum()) / total ] +
+                               [ percentile(counts, _p) for _p in [ 50, 25, 75, 10, 90 ] ] )
+        if len(values) > 0:
+            values = np.mean(values, axis=0)
+            worst_lq = min(worst_lq, values[2])
+            worst_median = min(worst_median, values[1])
+        else:
+            values = np.zeros(6)
+        rows.append( [ groupName(group) ] + [ "%.1f" % _v for _v in values ] )
+    st = max(status(worst_lq, 10, 5, False), status(worst_median, 25, 20, False),
+             key=[ "pass", "warn", "fail" ].index)
+    modules.append( ("Per base sequence quality", st,
+                     ["#Base\tMean\tMedian\tLower Quartile\tUpper Quartile\t10th Percentile\t"
+                      "90th Percentile"], rows) )
+
+    observed = np.flatnonzero(stats.seq_quals)
+    rows = [ [ str(_q), "%.1f" % stats.seq_quals[_q] ] for _q in
+             (range(observed[0], observed[-1]+1) if len(observed) > 0 else []) ]
+    mode = int(np.argmax(stats.seq_quals)) if len(observed) > 0 else 0
+    modules.append( ("Per sequence quality scores", status(mode, 27, 20, False, inclusive=True),
+                     ["#Quality\tCount"], rows) )
+
+    rows = []
+    max_diff = 0.0
+    for group in groups:
+        counts = stats.base_counts[group[0]-1:group[1],:4].sum(axis=0).astype(np.float64)
+        pct = 100.0 * counts / max(counts.sum(), 1)      # A, C, G, T
+        max_diff = max(max_diff, abs(pct[0]-pct[3]), abs(pct[1]-pct[2]))
+        rows.append( [ groupName(group) ] + [ "%.2f" % pct[_i] for _i in [ 2, 0, 3, 1 ] ] )
+    modules.append( ("Per base sequence content", status(max_diff, 10, 20),
+                     ["#Base\tG\tA\tT\tC"], rows) )
+
+    gc = stats.gc_counts.astype(np.float64)
+    total = gc.sum()
+    deviation = 0.0
+    if total > 0:
+        gc_mode = int(np.argmax(gc))
+        x = np.arange(101)
+        sd = math.sqrt(((x-gc_mode)**2 * gc).sum() / max(total-1, 1)) or 1.0
+        theoretical = np.exp(-0.5*((x-gc_mode)/sd)**2) / (sd*math.sqrt(2*math.pi)) * total
+        deviation = 100.0 * np.abs(theoretical-gc).sum() / total
+    rows = [ [ str(_i), "%.1f" % gc[_i] ] for _i in range(101) ]
+    modules.append( ("Per sequence GC content", status(deviation, 15, 30),
+                     ["#GC Content\tCount"], rows) )
+
+    rows = []
+    max_n = 0.0
+    for group in groups:
+        counts = stats.base_counts[group[0]-1:group[1]].sum(axis=0)
+        n_pct = 100.0 * counts[4] / max(counts.sum(), 1)
+        max_n = max(max_n, n_pct)
+        rows.append( [ groupName(group), "%.2f" % n_pct ] )
+    modules.append( ("Per base N content", status(max_n, 5, 20), ["#Base\tN-Count"], rows) )
+
+    rows = [ [ str(_l), "%.1f" % stats.length_counts[_l] ] for _l in range(min_len, max_len+1) ]
+    st = "fail" if stats.length_counts[0] > 0 else "warn" if min_len!=max_len else "pass"
+    modules.append( ("Sequence Length Distribution", st, ["#Length\tCount"], rows) )
+    return modules
+#}}}
+
+def saveReport(stats, filename, out_dir): #{{{
+    """Write FastQC-like report of 'stats' of Fastq file 'filename' to out_dir/name_fastqc.zip,
+    where 'name' is the base name of 'filename'.  Returns the path of the archive.
+    """
+    name = os.path.basename(filename) + "_fastqc"
+    modules = moduleTables(stats, filename)
+    data = [ "##FastQC\t0.11.9" ]
+    summary = []
+    for (module, st, header, rows) in modules:
+        data.append(">>%s\t%s" % (module, st))
+        data += header
+        data += [ "\t".join(_r) for _r in rows ]
+        data.append(">>END_MODULE")
+        summary.append("%s\t%s\t%s" % (st.upper(), module, os.path.basename(filename)))
+    zip_path = os.path.join(rw.resolvePath(out_dir), name+".zip")
+    tmp_path = "%s.tmp%d" % (zip_path, os.getpid())
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(name+"/summary.txt", "\n".join(summary)+"\n")
+        zf.writestr(name+"/fastqc_data.txt", "\n".join(data)+"\n")
+    os.rename(tmp_path, zip_path)
+    return zip_path
+#}}}
+#}}}
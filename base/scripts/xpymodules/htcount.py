@@ -0,0 +1,305 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module counts aligned reads per gene, like 'htseq-count' in "union" mode.
+
+A read (or a pair of mates) is assigned to a gene if all features overlapped by its aligned
+blocks (CIGAR operations M, =, X) belong to this gene; otherwise it is counted as one of
+special counters:
+    __no_feature            -- no feature is overlapped
+    __ambiguous             -- features of more than one gene are overlapped
+    __too_low_aQual         -- mapping quality is below 'minaqual'
+    __not_aligned           -- the read (both mates) is not aligned
+    __alignment_not_unique  -- NH tag is greater than 1
+Options mirror those of htseq-count: 'stranded' ("yes", "no", "reverse"), feature type
+('gfftype', like "exon") and the attribute naming genes ('name_attr', like "gene_id").
+
+The annotation index ('intervals.annotationIndex') is built once and shared (mapped to memory)
+by a pool of worker processes.  Each SAM file is split into byte ranges, which never separate
+alignments of the same read; all ranges of all samples are processed by one pool, and each range
+is read in batches of NumPy arrays ('rwfiles.iterSamBatches').
+Mates are expected to be on adjacent lines, as STAR writes them.
+
+Count files of all samples are merged into a gene x sample matrix by 'buildCountMatrix';
+'CountMatrix' objects are saved as '.npy' files, which are loaded (mapped to memory) instantly.
+"""
+
+import os
+import os.path
+import shutil
+import hashlib
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import params as p
+import rwfiles as rw
+import intervals as iv
+
+
+special_counters = [ "__no_feature", "__ambiguous", "__too_low_aQual", "__not_aligned",
+                     "__alignment_not_unique" ]
+(NO_FEATURE, AMBIGUOUS, TOO_LOW_AQUAL, NOT_ALIGNED, NOT_UNIQUE) = range(len(special_counters))
+stranded_values = [ "yes", "no", "reverse" ]
+default_chunk_size = 64*1024*1024
+
+def readUnits(batch): #{{{
+    """Counted units (reads, or pairs of mates) of records of SamBatch 'batch'.
+    Records of a read are consecutive; if its first record is paired (flag 0x1), the i-th first
+    mate (flag 0x40) and the i-th second mate form a unit, otherwise each record is a unit.
+    Returns (unit index of each record, number of units).
+    """
+    n = len(batch)
+    qnames = np.array(batch.qnames)
+    new_read = np.ones(n, dtype=np.bool_)
+    new_read[1:] = qnames[1:]!=qnames[:-1]
+    reads = np.cumsum(new_read) - 1
+    first = np.flatnonzero(new_read)
+    paired = (batch.flags[first] & 0x1)[reads]!=0
+    mate = np.where(paired & ((batch.flags & 0x40)==0), 1, 0)
+    # Rank of a record among records of the same read and mate; single-end records of a read
+    # get distinct ranks
+    key = reads*2 + mate
+    order = np.argsort(key, kind='mergesort')
+    sorted_key = key[order]
+    run_start = np.ones(n, dtype=np.bool_)
+    run_start[1:] = sorted_key[1:]!=sorted_key[:-1]
+    run_first = np.flatnonzero(run_start)
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[order] = np.arange(n) - np.repeat(run_first, np.diff(np.append(run_first, n)))
+    (_, units) = np.unique(reads*(ranks.max()+1) + ranks, return_inverse=True)
+    return (units, units.max()+1 if n > 0 else 0)
+#}}}
+
+global worker_index     # IntervalIndex used by worker processes
+def countChunk(task): #{{{
+    """Count reads of one byte range of SAM file.
+    'task' is (sample_idx, sam_path, start, end, stranded, minaqual).
+    Returns (sample_idx, counts), where 'counts' is a NumPy array with a counter for each
+    name of 'worker_index', followed by special counters.
+    """
+    (sample_idx, sam_path, start, end, stranded, minaqual) = task
+    index = worker_index
+    nr_features = len(index.names)
+    counts = np.zeros(nr_features+len(special_counters), dtype=np.int64)
+    special = counts[nr_features:]
+    # Aligned blocks of counted units: (refids, starts, ends, units, required feature strands)
+    blocks = []
+    refnames = []
+    nr_units = 0
+    for batch in rw.iterSamBatches(sam_path, start, end):
+        refnames = batch.refnames
+        (units, n) = readUnits(batch)
+        is_aligned = (batch.flags & 0x4)==0
+        nr_aligned = np.bincount(units[is_aligned], minlength=n)
+        # Like htseq-count, check NH and MAPQ also for an unaligned mate
+        max_nh = np.zeros(n, dtype=np.int64)
+        np.maximum.at(max_nh, units, batch.tag("NH", 1))
+        min_mapq = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(min_mapq, units, batch.mapq)
+        not_aligned = nr_aligned==0
+        not_unique = ~not_aligned & (max_nh > 1)
+        low_aqual = ~not_aligned & ~not_unique & (min_mapq < minaqual)
+        special[NOT_ALIGNED] += not_aligned.sum()
+        special[NOT_UNIQUE] += not_unique.sum()
+        special[TOO_LOW_AQUAL] += low_aqual.sum()
+        counted = ~(not_aligned | not_unique | low_aqual)
+        unit_ids = np.cumsum(counted) - 1 + nr_units        # counted units are numbered
+        nr_units += counted.sum()
+        strands = np.zeros(len(batch), dtype=np.int8)
+        if stranded!="no":
+            strands = batch.strands * np.where(batch.flags & 0x80, -1, 1).astype(np.int8)
+            if stranded=="reverse":  strands = -strands
+        records = np.repeat(np.arange(len(batch)), np.diff(batch.block_offsets))
+        selected = (is_aligned & counted[units])[records]
+        records = records[selected]
+        blocks.append( (batch.refids[records], batch.block_starts[selected],
+                        batch.block_ends[selected], unit_ids[units[records]], strands[records]) )
+    # Find (unit, feature) pairs
+    keys = [ np.zeros(0, dtype=np.int64) ]
+    if len(blocks) > 0:
+        (brefids, bstarts, bends, bunits, bstrands) = [ np.concatenate(_a) for _a in zip(*blocks) ]
+        for refid in np.unique(brefids):
+            on_ref = brefids==refid
+            (offsets, hits) = index.query(refnames[refid], bstarts[on_ref], bends[on_ref])
+            nr_hits = np.diff(offsets)
+            units = np.repeat(bunits[on_ref], nr_hits)
+            req_strands = np.repeat(bstrands[on_ref], nr_hits)
+            feat_strands = index.strands[hits]
+            ok = (req_strands==0) | (feat_strands==0) | (feat_strands==req_strands)
+            keys.append( units[ok]*nr_features + index.fids[hits][ok] )
+    keys = np.unique(np.concatenate(keys))
+    (key_units, key_features) = (keys // max(nr_features,1), keys % max(nr_features,1))
+    features_per_unit = np.bincount(key_units, minlength=nr_units)
+    unique = features_per_unit[key_units]==1
+    counts[:nr_features] += np.bincount(key_features[unique], minlength=nr_features)
+    special[NO_FEATURE] += (features_per_unit==0).sum()
+    special[AMBIGUOUS] += (features_per_unit>1).sum()
+    return (sample_idx, counts)
+#}}}
+
+def saveCounts(filename, names, counts): #{{{
+    """Write counts in htseq-count format ("name<TAB>count" lines; names, then special counters).
+    The file is written under a temporary name and then renamed.
+    """
+    fpath = rw.resolvePath(filename)
+    tmp_path = "%s.tmp%d" % (fpath, os.getpid())
+    rw.saveLines(tmp_path, [ "%s\t%d" % (_n,_c)
+                             for (_n,_c) in itertools.izip(names+special_counters, counts) ])
+    os.rename(tmp_path, fpath)
+#}}}
+
+def countSamples(annotation, sam_filenames, count_filenames, stranded="yes", #{{{
+                 gfftype="exon", name_attr="gene_id", minaqual=10,
+                 nr_workers=None, chunk_size=default_chunk_size):
+    """Count reads of SAM files 'sam_filenames' and write results to 'count_filenames'
+    (lists of the same length).
+    'annotation' is GFF3/GTF file; 'stranded', 'gfftype', 'name_attr' and 'minaqual' have
+    the same meaning as htseq-count options -s, -t, -i, and -a.
+    'nr_workers' is the number of worker processes (default: number of CPUs).
+    Returns list of count arrays (features, then special counters) in the order of samples.
+    """
+    global worker_index
+    if stranded not in stranded_values:
+        raise Exception("Invalid value of 'stranded': %s" % stranded)
+    worker_index = iv.annotationIndex(annotation, gfftype, name_attr)
+    names = list(worker_index.names)
+    sam_paths = [ rw.resolvePath(_fn) for _fn in sam_filenames ]
+    tasks = []
+    for (i, sam_path) in enumerate(sam_paths):
+        for (start, end) in rw.samChunks(sam_path, chunk_size):
+            tasks.append( (i, sam_path, start, end, stranded, minaqual) )
+    nr_chunks = [ 0 ] * len(sam_paths)
+    for task in tasks:  nr_chunks[task[0]] += 1
+    results = [ np.zeros(len(names)+len(special_counters), dtype=np.int64) for _ in sam_paths ]
+    p.vprint(1, "Counting %d SAM files (%d chunks) with %d features..."
+                % (len(sam_paths), len(tasks), len(names)))
+    pool = multiprocessing.Pool(nr_workers)
+    try:
+        for (i, counts) in pool.imap_unordered(countChunk, tasks):
+            results[i] += counts
+            nr_chunks[i] -= 1
+            if nr_chunks[i]==0:
+                saveCounts(count_filenames[i], names, results[i])
+                p.vprint(1, "  %s: %d reads assigned to features." %
+                            (count_filenames[i], results[i][:len(names)].sum()))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    p.vprint(1, "Done.")
+    return results
+#}}}
+
+# Count matrix {{{
+class CountMatrix(object): #{{{
+    """Counts of genes (rows) in samples (columns).
+        counts      -- int32 array (genes x samples)
+        qc          -- int64 array (special counters x samples), like "__no_feature"
+        genes, samples, qc_names -- lists of row and column names
+    """
+    def __init__(self, genes, samples, counts, qc_names, qc):
+        self.genes = genes
+        self.samples = samples
+        self.counts = counts
+        self.qc_names = qc_names
+        self.qc = qc
+
+    def column(self, sample): #{{{
+        """Counts of sample (by name) as a 1D array."""
+        return self.counts[:, self.samples.index(sample)]
+    #}}}
+
+    def save(self, path): #{{{
+        """Save matrix to directory 'path' (resolved by 'rwfiles.resolvePath'): arrays as
+        '.npy' files, names as text files.  The directory is written under a temporary name
+        and then renamed.
+        """
+        apath = rw.resolvePath(path)
+        tmp_path = "%s.tmp%d" % (apath, os.getpid())
+        if os.path.exists(tmp_path):  shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "counts.npy"), self.counts)
+        np.save(os.path.join(tmp_path, "qc.npy"), self.qc)
+        rw.saveLines(os.path.join(tmp_path, "genes.txt"), self.genes)
+        rw.saveLines(os.path.join(tmp_path, "samples.txt"), self.samples)
+        rw.saveLines(os.path.join(tmp_path, "qc_names.txt"), self.qc_names)
+        if os.path.exists(apath):  shutil.rmtree(apath)
+        os.rename(tmp_path, apath)
+    #}}}
+
+    @staticmethod
+    def load(path, mmap=True): #{{{
+        """Load matrix saved by 'save'; if 'mmap' is True, arrays are mapped to memory (read-only)."""
+        apath = rw.resolvePath(path)
+        mmap_mode = 'r' if mmap else None
+        return CountMatrix( rw.loadLines(os.path.join(apath, "genes.txt")),
+                            rw.loadLines(os.path.join(apath, "samples.txt")),
+                            np.load(os.path.join(apath, "counts.npy"), mmap_mode=mmap_mode),
+                            rw.loadLines(os.path.join(apath, "qc_names.txt")),
+                            np.load(os.path.join(apath, "qc.npy"), mmap_mode=mmap_mode) )
+    #}}}
+
+    def saveTSV(self, filename, qc=False): #{{{
+        """Write counts (or QC counters, if 'qc') as TSV table: header "gene<TAB>samples...",
+        then a row per gene (counter).
+        """
+        (names, counts) = (self.qc_names, self.qc) if qc else (self.genes, self.counts)
+        lines = [ "\t".join([ "gene" ] + self.samples) ]
+        lines += [ _n + "\t" + "\t".join(map(str, _row))
+                   for (_n,_row) in itertools.izip(names, counts.tolist()) ]
+        rw.saveLines(filename, lines)
+    #}}}
+#}}}
+
+def loadCounts(filename): #{{{
+    """Read htseq-count output; returns (names, counts) -- list and int64 array."""
+    with open(rw.resolvePath(filename)) as f:
+        pairs = [ _l.rstrip('\n').split('\t') for _l in f if _l.strip()!="" ]
+    return ( [ _p[0] for _p in pairs ], np.array([ int(_p[1]) for _p in pairs ], dtype=np.int64) )
+#}}}
+
+def loadCountsTask(task): #{{{
+    """Worker of 'buildCountMatrix': returns (index, checksum of names, names or None, counts);
+    names are returned only for the first file.
+    """
+    (i, filename) = task
+    (names, counts) = loadCounts(filename)
+    checksum = hashlib.md5("\n".join(names)).hexdigest()
+    return (i, checksum, names if i==0 else None, counts)
+#}}}
+
+def buildCountMatrix(count_filenames, samples, nr_workers=None): #{{{
+    """Build CountMatrix from htseq-count outputs 'count_filenames' of 'samples' (same order),
+    read by a pool of 'nr_workers' processes (default: number of CPUs).
+    Rows whose names start with "__" go to the QC part.
+    Raises Exception if there are no files, or if genes (or their order) differ between files.
+    """
+    if len(count_filenames)==0:
+        raise Exception("No count files to build the count matrix from.")
+    p.vprint(1, "Reading %d count files..." % len(count_filenames))
+    tasks = list(enumerate([ rw.resolvePath(_fn) for _fn in count_filenames ]))
+    pool = multiprocessing.Pool(nr_workers)
+    try:
+        results = sorted(pool.map(loadCountsTask, tasks))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    names = results[0][2]
+    differing = [ samples[_r[0]] for _r in results if _r[1]!=results[0][1] ]
+    if len(differing) > 0:
+        raise Exception("Genes differ from those of %s in %d samples: %s"
+                        % (samples[0], len(differing), ", ".join(differing[:5])))
+    is_qc = np.array([ _n.startswith("__") for _n in names ], dtype=np.bool_)
+    all_counts = np.column_stack([ _r[3] for _r in results ])
+    if all_counts[~is_qc].size > 0 and all_counts[~is_qc].max() > np.iinfo(np.int32).max:
+        raise Exception("Counts do not fit into int32.")
+    matrix = CountMatrix( [ _n for (_n,_q) in zip(names, is_qc) if not _q ], list(samples),
+                          all_counts[~is_qc].astype(np.int32),
+                          [ _n for (_n,_q) in zip(names, is_qc) if _q ], all_counts[is_qc] )
+    p.vprint(1, "Done, %d genes x %d samples." % (len(matrix.genes), len(matrix.samples)))
+    return matrix
+#}}}
+#}}}
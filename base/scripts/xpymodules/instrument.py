@@ -0,0 +1,253 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module measures resources used by commands (jobs) and keeps them in a run log.
+
+For each command, a record is made of
+    wall time, user and system CPU time, peak RSS    -- from 'os.wait4' (rusage of the process
+                                                        and of its waited-for descendants)
+    bytes read and written (rchar/wchar: all I/O,   -- from "/proc/pid/io", read while the
+    read_bytes/write_bytes: storage I/O)               process runs and once more when it
+                                                        has exited but is not yet reaped
+    exit status
+and appended to the run log, a JSON-lines file ('runlog_filename', "processedData/runlog.jsonl"
+by default, or environment variable RUNLOG), under a lock, so that jobs of concurrent stages can
+write to it.  Records of one run share field 'run' (environment variable RUN_ID, set by xprep.sh
+for a stage script and everything it runs; otherwise one run per process).
+'Monitor' waits for processes started by the caller ('jobs.JobRunner' uses it, so p_runjobs.py
+and p_starjobs.py log every sample); 'runCommand' runs one command, as p_instrument.py does from
+stage scripts and from 'xvpy' (with environment variable INSTRUMENT=stage-name).
+
+'loadRunLog' reads records back; 'stageSummary', 'slowest' and 'regressions' analyse them for
+the report of p_instrument.py.  Where /proc is not available, I/O is estimated from rusage
+block counts.
+"""
+
+import os
+import os.path
+import time
+import json
+import fcntl
+import socket
+import pipes
+import signal
+import subprocess
+
+import params as p
+import rwfiles as rw
+
+
+runlog_filename = os.getenv("RUNLOG", os.path.join("processedData", "runlog.jsonl"))
+run_id = os.getenv("RUN_ID", "%s-%d" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+io_fields = [ "rchar", "wchar", "read_bytes", "write_bytes" ]
+min_interval = 0.05         # seconds between polls of running processes, doubled up to
+max_interval = 0.5          # max_interval
+
+def procState(pid): #{{{
+    """State letter of process 'pid' from /proc/pid/stat ('Z' for exited, not reaped), or None."""
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            data = f.read()
+        return data[data.rindex(')')+2]
+    except (IOError, ValueError, IndexError):
+        return None
+#}}}
+
+def procIO(pid): #{{{
+    """Dict of I/O counters ('io_fields') of process 'pid' from /proc/pid/io, or None.
+    The counters include I/O of reaped children of the process.
+    """
+    try:
+        with open("/proc/%d/io" % pid) as f:
+            counters = dict([ _l.split(':', 1) for _l in f if ':' in _l ])
+        return dict([ (_n, int(counters[_n])) for _n in io_fields ])
+    except (IOError, ValueError, KeyError):
+        return None
+#}}}
+
+class Monitor(object): #{{{
+    """Waits for child processes and collects their I/O counters and rusage.
+    Usage:
+        mon = Monitor()
+        mon.add(proc.pid)
+        (pid, status, rusage, io) = mon.wait()
+    While processes run, their /proc/pid/io is polled; a process which has exited is reaped only
+    after its final counters are read.  Without /proc, 'wait' blocks in 'os.wait4' and 'io' is None.
+    """
+    def __init__(self):
+        self.io = dict()            # pid --> last I/O counters (None if not read yet)
+        self.use_proc = os.path.isdir("/proc/self")
+
+    def add(self, pid):
+        self.io[pid] = None
+
+    def wait(self): #{{{
+        """Wait for any added process to exit; returns (pid, status, rusage, io)."""
+        if not self.use_proc:
+            while True:
+                (pid, status, rusage) = os.wait4(-1, 0)
+                if pid in self.io:
+                    return (pid, status, rusage, self.io.pop(pid))
+        # SIGCHLD interrupts the sleep between polls, so that the exit of a process is noticed
+        # at once (not possible outside of the main thread)
+        try:
+            previous = signal.signal(signal.SIGCHLD, lambda _sig, _frame: None)
+        except ValueError:
+            previous = None
+        try:
+            interval = min_interval
+            while True:
+                for pid in self.io.keys():
+                    state = procState(pid)
+                    io = procIO(pid)
+                    if io is not None:
+                        self.io[pid] = io
+                    if state=='Z' or state is None:
+                        (_, status, rusage) = os.wait4(pid, 0)
+                        return (pid, status, rusage, self.io.pop(pid))
+                time.sleep(interval)
+                interval = min(interval*2, max_interval)
+        finally:
+            if previous is not None:
+                signal.signal(signal.SIGCHLD, previous)
+    #}}}
+#}}}
+
+def makeRecord(stage, name, command, start_time, end_time, rc, rusage, io): #{{{
+    """Record (dict) of one finished command, see module documentation."""
+    if io is None:
+        io = dict(rchar=None, wchar=None, read_bytes=rusage.ru_inblock*512,
+                  write_bytes=rusage.ru_oublock*512)
+    record = dict(run=run_id, host=socket.gethostname(), stage=stage, name=name,
+                  command=command, rc=rc,
+                  start=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time)),
+                  wall_s=round(end_time-start_time, 3),
+                  user_s=round(rusage.ru_utime, 3), sys_s=round(rusage.ru_stime, 3),
+                  max_rss_mb=round(rusage.ru_maxrss/1024.0, 1))
+    record.update(io)
+    return record
+#}}}
+
+def appendRunLog(records, filename=None): #{{{
+    """Append records (dicts) to the run log as JSON lines, holding an exclusive lock."""
+    fpath = rw.resolvePath(filename or runlog_filename)
+    rw.makePath(os.path.dirname(fpath))
+    with open(fpath, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+#}}}
+
+def runCommand(command, stage, name=None, log_path=None, runlog=None): #{{{
+    """Run 'command' (string, executed by 'bash -c', or list of arguments, executed directly),
+    measure it and append its record to run log 'runlog' (default: 'runlog_filename').
+    Output goes to 'log_path' (default: inherited stdout and stderr).  Returns the record.
+    """
+    log = open(log_path, 'w') if log_path is not None else None
+    argv = [ "/bin/bash", "-c", command ] if isinstance(command, basestring) else command
+    start_time = time.time()
+    proc = subprocess.Popen(argv, stdout=log, stderr=subprocess.STDOUT if log else None,
+                            close_fds=True)
+    if log is not None:
+        log.close()
+    monitor = Monitor()
+    monitor.add(proc.pid)
+    (_, status, rusage, io) = monitor.wait()
+    proc.returncode = exitStatus(status)    # the process is already reaped
+    cmd_string = command if isinstance(command, basestring) else " ".join(map(pipes.quote, command))
+    record = makeRecord(stage, name or stage, cmd_string, start_time, time.time(),
+                        proc.returncode, rusage, io)
+    appendRunLog([ record ], runlog)
+    return record
+#}}}
+
+def exitStatus(status): #{{{
+    """Convert status returned by 'os.wait' to exit code (-N if killed by signal N)."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+#}}}
+
+# Analysis of the run log {{{
+def loadRunLog(filename=None): #{{{
+    """List of records of the run log, in the order of writing (malformed lines are skipped)."""
+    fpath = rw.resolvePath(filename or runlog_filename)
+    records = []
+    if not os.path.isfile(fpath):
+        return records
+    with open(fpath) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                p.vprint(1, "Malformed line in %s skipped." % fpath)
+    return records
+#}}}
+
+def latestRuns(records): #{{{
+    """Records of the latest run of each stage (records of one run share 'run')."""
+    last_run = dict()
+    for record in records:
+        last_run[record["stage"]] = record["run"]
+    return [ _r for _r in records if last_run[_r["stage"]]==_r["run"] ]
+#}}}
+
+def stageSummary(records): #{{{
+    """Per stage (in the order of first appearance): dict with 'stage', 'run', 'start', number of
+    records 'n', 'failed', totals 'wall_s' (sum over records), 'cpu_s', 'read_bytes',
+    'write_bytes', the longest record 'max_wall_s' and 'max_rss_mb'.
+    """
+    stages = []
+    summary = dict()
+    for record in records:
+        stage = record["stage"]
+        if stage not in summary:
+            stages.append(stage)
+            summary[stage] = dict(stage=stage, run=record["run"], start=record["start"], n=0,
+                                  failed=0, wall_s=0.0, cpu_s=0.0, read_bytes=0, write_bytes=0,
+                                  max_wall_s=0.0, max_rss_mb=0.0)
+        s = summary[stage]
+        s["n"] += 1
+        s["failed"] += record["rc"]!=0
+        s["wall_s"] += record["wall_s"]
+        s["cpu_s"] += record["user_s"] + record["sys_s"]
+        s["read_bytes"] += record.get("read_bytes") or 0
+        s["write_bytes"] += record.get("write_bytes") or 0
+        s["max_wall_s"] = max(s["max_wall_s"], record["wall_s"])
+        s["max_rss_mb"] = max(s["max_rss_mb"], record["max_rss_mb"])
+    return [ summary[_s] for _s in stages ]
+#}}}
+
+def slowest(records, n=10): #{{{
+    """'n' records with the longest wall time."""
+    return sorted(records, key=lambda _r: _r["wall_s"], reverse=True)[:n]
+#}}}
+
+def regressions(records, threshold=1.25, min_seconds=5.0): #{{{
+    """Commands (same stage and name) which got slower: the last successful record is compared
+    with the previous successful one.  Returns list of (previous, last) record pairs where wall
+    time or peak RSS grew by factor 'threshold' or more (wall time also by 'min_seconds'),
+    the largest slow-downs first.
+    """
+    history = dict()
+    for record in records:
+        if record["rc"]==0:
+            history.setdefault((record["stage"], record["name"]), []).append(record)
+    pairs = []
+    for runs in history.values():
+        if len(runs) < 2:
+            continue
+        (prev, last) = runs[-2:]
+        slower = last["wall_s"] >= prev["wall_s"]*threshold and \
+                 last["wall_s"] - prev["wall_s"] >= min_seconds
+        larger = last["max_rss_mb"] >= prev["max_rss_mb"]*threshold and prev["max_rss_mb"] > 0
+        if slower or larger:
+            pairs.append( (prev, last) )
+    pairs.sort(key=lambda _pl: _pl[1]["wall_s"]/max(_pl[0]["wall_s"], 0.001), reverse=True)
+    return pairs
+#}}}
+#}}}
@@ -0,0 +1,176 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module provides an interval index over annotation features: which features (exons,
+genes, ...) overlap given positions or intervals.
+
+Features are read by 'rwfiles.iterGff' and stored in a few NumPy arrays, sorted by chromosome
+and start.  All coordinates here are 0-based, with excluded end (GFF "start..end" becomes
+"start-1, end").
+
+An index is saved as a directory of '.npy' files, which are mapped to memory when loaded,
+so that multiple processes share one copy.  'annotationIndex' keeps indices in a cache
+directory, keyed on the checksum of the annotation file, and builds them only once.
+"""
+
+import os
+import os.path
+import shutil
+
+import numpy as np
+
+import params as p
+import rwfiles as rw
+
+
+strand_codes = dict([ ("+",1), ("-",-1) ])     # other strands (like '.') are coded by 0
+array_names = [ "starts", "ends", "maxends", "fids", "strands" ]
+
+class IntervalIndex(object): #{{{
+    """Index of intervals, each having a feature name and a strand.
+    Arrays (concatenated over chromosomes, sorted by chromosome and start):
+        starts, ends    -- int64, 0-based start and excluded end
+        maxends         -- int64, running maximum of 'ends' within chromosome
+        fids            -- int32, index of the feature name in 'names'
+        strands         -- int8, +1, -1, or 0 (unknown)
+    'chroms' maps chromosome name to (first, last+1) index in arrays.
+    'names' is the sorted list of feature names.
+    """
+    def __init__(self, arrays, chroms, names):
+        for an in array_names:
+            setattr(self, an, arrays[an])
+        self.chroms = chroms
+        self.names = names
+
+    def __len__(self):
+        return len(self.starts)
+
+    @staticmethod
+    def fromGff(records, name_attr="gene_id"): #{{{
+        """Build index from GffRecord objects (for example, 'rwfiles.iterGff' generator).
+        'name_attr' is the attribute used as the feature name; records without it are skipped.
+        """
+        p.vprint(1, "Building interval index...")
+        chrom_ids = dict()
+        (cids, starts, ends, strands, fnames) = ([], [], [], [], [])
+        nr_skipped = 0
+        for rec in records:
+            fname = rec.attr(name_attr)
+            if fname is None:
+                nr_skipped += 1
+                continue
+            cids.append( chrom_ids.setdefault(rec.seqid, len(chrom_ids)) )
+            starts.append(rec.start-1)
+            ends.append(rec.end)
+            strands.append(strand_codes.get(rec.strand,0))
+            fnames.append(fname)
+        names = sorted(set(fnames))
+        name_ids = dict([ (_n,_i) for (_i,_n) in enumerate(names) ])
+        cids = np.array(cids, dtype=np.int32)
+        starts = np.array(starts, dtype=np.int64)
+        order = np.lexsort((starts, cids))
+        arrays = dict([ ("starts", starts[order]),
+                        ("ends", np.array(ends, dtype=np.int64)[order]),
+                        ("fids", np.array([ name_ids[_n] for _n in fnames ], dtype=np.int32)[order]),
+                        ("strands", np.array(strands, dtype=np.int8)[order]) ])
+        cids = cids[order]
+        chroms = dict()
+        maxends = np.empty_like(arrays["ends"])
+        for (chrom, cid) in chrom_ids.iteritems():
+            (lo, hi) = np.searchsorted(cids, [cid, cid+1])
+            chroms[chrom] = (int(lo), int(hi))
+            maxends[lo:hi] = np.maximum.accumulate(arrays["ends"][lo:hi])
+        arrays["maxends"] = maxends
+        p.vprint(1, "Done, %d intervals of %d features on %d chromosomes (%d records skipped)."
+                    % (len(starts), len(names), len(chroms), nr_skipped))
+        return IntervalIndex(arrays, chroms, names)
+    #}}}
+
+    def query(self, chrom, qstarts, qends): #{{{
+        """Find intervals overlapping each of query intervals [qstarts[i], qends[i]) on 'chrom'.
+        Returns (offsets, hits): 'hits[offsets[i]:offsets[i+1]]' are indices (in the index
+        arrays) of intervals overlapping i-th query; use 'fids[hits]', 'strands[hits]', etc.
+        """
+        qstarts = np.asarray(qstarts, dtype=np.int64)
+        qends = np.asarray(qends, dtype=np.int64)
+        nq = len(qstarts)
+        offsets = np.zeros(nq+1, dtype=np.int64)
+        if chrom not in self.chroms or nq==0:
+            return (offsets, np.zeros(0, dtype=np.int64))
+        (first, last) = self.chroms[chrom]
+        # Candidates of i-th query: intervals from the first one with maxend>qstart
+        # to the last one with start<qend
+        lo = np.searchsorted(self.maxends[first:last], qstarts, 'right')
+        hi = np.searchsorted(self.starts[first:last], qends, 'left')
+        counts = np.maximum(hi-lo, 0)
+        qidx = np.repeat(np.arange(nq), counts)
+        cand = ( np.arange(counts.sum(), dtype=np.int64)
+                 - np.repeat(np.cumsum(counts)-counts, counts) + np.repeat(lo, counts) + first )
+        keep = self.ends[cand] > qstarts[qidx]
+        offsets[1:] = np.cumsum(np.bincount(qidx[keep], minlength=nq))
+        return (offsets, cand[keep])
+    #}}}
+
+    def overlaps(self, chrom, start, end): #{{{
+        """Sorted list of names of features overlapping [start, end) on 'chrom'."""
+        (_, hits) = self.query(chrom, [start], [end])
+        return [ self.names[_f] for _f in np.unique(self.fids[hits]) ]
+    #}}}
+
+    def save(self, path): #{{{
+        """Save index to directory 'path' (resolved by 'rwfiles.resolvePath').
+        The directory is written under a temporary name and then renamed, so that a partially
+        written index is never loaded.
+        """
+        apath = rw.resolvePath(path)
+        tmp_path = "%s.tmp%d" % (apath, os.getpid())
+        if os.path.exists(tmp_path):  shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        for an in array_names:
+            np.save(os.path.join(tmp_path, an+".npy"), getattr(self, an))
+        rw.saveLines(os.path.join(tmp_path, "chroms.txt"),
+                     [ "%s\t%d\t%d" % (_c,_b[0],_b[1]) for (_c,_b) in sorted(self.chroms.items()) ])
+        rw.saveLines(os.path.join(tmp_path, "names.txt"), self.names)
+        if os.path.exists(apath):  shutil.rmtree(apath)
+        os.rename(tmp_path, apath)
+    #}}}
+
+    @staticmethod
+    def load(path, mmap=True): #{{{
+        """Load index saved by 'save'; if 'mmap' is True, arrays are mapped to memory (read-only)."""
+        apath = rw.resolvePath(path)
+        mmap_mode = 'r' if mmap else None
+        arrays = dict([ (_an, np.load(os.path.join(apath, _an+".npy"), mmap_mode=mmap_mode))
+                        for _an in array_names ])
+        chroms = dict()
+        for line in rw.loadLines(os.path.join(apath, "chroms.txt")):
+            if line!="":
+                (chrom, lo, hi) = line.split('\t')
+                chroms[chrom] = (int(lo), int(hi))
+        names = rw.loadLines(os.path.join(apath, "names.txt"))
+        return IntervalIndex(arrays, chroms, names)
+    #}}}
+#}}}
+
+def annotationIndex(annotation, gfftype="exon", name_attr="gene_id", index_dir=None): #{{{
+    """Interval index of 'gfftype' features of GFF3/GTF file 'annotation', named by 'name_attr'.
+    The index is loaded (mapped to memory) from 'index_dir' if it was built before for the file
+    with the same checksum; otherwise it is built and saved there.
+    'index_dir' defaults to the cache directory of rwfiles ("processedData/cache" in the project
+                directory).
+    """
+    apath = rw.resolvePath(annotation)
+    if index_dir is None:
+        index_dir = rw.cache_dir
+    index_path = os.path.join( rw.makePath(index_dir), "%s.%s.%s.%s.idx" %
+                               (os.path.basename(apath), rw.fileChecksum(apath), gfftype, name_attr) )
+    if os.path.isdir(index_path):
+        p.vprint(1, "Loading interval index %s..." % index_path)
+        index = IntervalIndex.load(index_path)
+        p.vprint(1, "Done, %d intervals." % len(index))
+    else:
+        index = IntervalIndex.fromGff(rw.iterGff(apath, [gfftype]), name_attr)
+        index.save(index_path)
+        index = IntervalIndex.load(index_path)
+    return index
+#}}}
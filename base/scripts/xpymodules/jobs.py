@@ -0,0 +1,184 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module runs shell commands (jobs) in parallel within budgets of CPU cores, threads
+and memory.
+
+Each job declares how many cores, threads and megabytes of memory it needs; a job is started
+only when it fits into what is left of the budgets.  Larger jobs (by 'size', usually the total
+size of input files) are started first, smaller ones fill the remaining room.  A job which
+needs more than a whole budget is run when nothing else is running.
+Output of each job goes to its own log file; exit statuses are collected, and resources used
+by each job are measured by 'instrument.Monitor' (and appended to the run log if the runner
+has a stage name).
+'threadSplits' lists ways to split cores among concurrent multi-threaded jobs (like STAR runs
+sharing one genome, see p_starjobs.py), to be compared by calibration.
+"""
+
+import os
+import os.path
+import glob
+import time
+import subprocess
+import multiprocessing
+
+import params as p
+import instrument
+
+
+class Job(object): #{{{
+    """Shell command with declared resources.
+    'name'      -- name used in messages (usually sample name)
+    'command'   -- string, executed by 'bash -c'
+    'size'      -- priority; larger jobs are started first
+    'cores', 'threads', 'mem' -- required CPU cores, threads and memory (MB)
+    'log_path'  -- file for stdout and stderr of the command (None: /dev/null)
+    After running: 'rc' (exit status; negative number -N means killed by signal N),
+    'start_time' and 'end_time' (seconds since epoch), 'record' (resources used, see
+    'instrument.makeRecord').
+    """
+    def __init__(self, name, command, size=0, cores=1, threads=1, mem=0, log_path=None):
+        self.name = name
+        self.command = command
+        self.size = size
+        self.cores = cores
+        self.threads = threads
+        self.mem = mem
+        self.log_path = log_path
+        self.rc = None
+        self.start_time = None
+        self.end_time = None
+        self.record = None
+        self.proc = None
+    def elapsed(self):
+        if self.start_time is None:  return 0.0
+        return (self.end_time or time.time()) - self.start_time
+#}}}
+
+def totalMemory(): #{{{
+    """Total memory of the node in MB (from /proc/meminfo), or None if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    return None
+#}}}
+
+class JobRunner(object): #{{{
+    """Runs jobs within budgets.
+    'max_cores'   -- number of cores (default: number of CPUs)
+    'max_threads' -- number of threads (None: no limit); for example, 1000 keeps jobs under
+                     the limit of 1024 threads per user
+    'max_mem'     -- memory in MB (None: no limit)
+    'stage'       -- if given, records of finished jobs are appended to the run log 'runlog'
+                     (default: instrument.runlog_filename) with this stage name
+    Usage:
+        runner = JobRunner(max_cores=32, max_mem=200000, stage="star")
+        runner.run([ Job(...), ... ])
+    """
+    def __init__(self, max_cores=None, max_threads=None, max_mem=None, stage=None, runlog=None):
+        self.max_cores = max_cores or multiprocessing.cpu_count()
+        self.max_threads = max_threads
+        self.max_mem = max_mem
+        self.free_cores = self.max_cores
+        self.free_threads = max_threads
+        self.free_mem = max_mem
+        self.running = dict()   # pid --> Job
+        self.monitor = instrument.Monitor()
+        self.stage = stage
+        self.runlog = runlog
+
+    def fits(self, job): #{{{
+        if len(self.running)==0:
+            return True     # even if job exceeds the budgets
+        return ( job.cores <= self.free_cores and
+                 (self.free_threads is None or job.threads <= self.free_threads) and
+                 (self.free_mem is None or job.mem <= self.free_mem) )
+    #}}}
+
+    def start(self, job): #{{{
+        log = open(job.log_path if job.log_path is not None else os.devnull, 'w')
+        job.start_time = time.time()
+        job.proc = subprocess.Popen(["/bin/bash", "-c", job.command],
+                                    stdout=log, stderr=subprocess.STDOUT, close_fds=True)
+        log.close()
+        self.running[job.proc.pid] = job
+        self.monitor.add(job.proc.pid)
+        self.free_cores -= job.cores
+        if self.free_threads is not None:  self.free_threads -= job.threads
+        if self.free_mem is not None:  self.free_mem -= job.mem
+        p.vprint(2, "  Started %s (pid %d)." % (job.name, job.proc.pid))
+    #}}}
+
+    def waitOne(self): #{{{
+        """Wait for any running job to finish; returns (job, rusage)."""
+        (pid, status, rusage, io) = self.monitor.wait()
+        job = self.running.pop(pid)
+        job.end_time = time.time()
+        job.rc = instrument.exitStatus(status)
+        job.proc.returncode = job.rc    # the process is already reaped
+        job.record = instrument.makeRecord(self.stage, job.name, job.command, job.start_time,
+                                           job.end_time, job.rc, rusage, io)
+        if self.stage is not None:
+            instrument.appendRunLog([ job.record ], self.runlog)
+        self.free_cores += job.cores
+        if self.free_threads is not None:  self.free_threads += job.threads
+        if self.free_mem is not None:  self.free_mem += job.mem
+        p.vprint(2, "  Finished %s: exit status %d, %.1f s." % (job.name, job.rc, job.elapsed()))
+        return (job, rusage)
+    #}}}
+
+    def run(self, jobs, on_finish=None): #{{{
+        """Run all jobs, larger first; returns the list of jobs (with 'rc' set).
+        'on_finish(job)', if given, is called as soon as each job finishes.
+        """
+        pending = sorted(jobs, key=lambda _j: _j.size, reverse=True)
+        p.vprint(1, "Running %d jobs (budgets: %d cores, %s threads, %s MB)..." %
+                    (len(jobs), self.max_cores, self.max_threads or "unlimited",
+                     self.max_mem or "unlimited"))
+        while len(pending) > 0 or len(self.running) > 0:
+            for job in list(pending):
+                if self.fits(job):
+                    self.start(job)
+                    pending.remove(job)
+            if len(self.running) > 0:
+                (job, _) = self.waitOne()
+                if on_finish is not None:
+                    on_finish(job)
+        p.vprint(1, "Done, %d jobs failed." % len([ _j for _j in jobs if _j.rc!=0 ]))
+        return jobs
+    #}}}
+#}}}
+
+def printReport(level, jobs): #{{{
+    """Print name, exit status, elapsed time, CPU time, peak RSS and log file of each job;
+    failed jobs are printed with 'level', others with 'level'+1.
+    """
+    width = max([ len(_j.name) for _j in jobs ] + [4])
+    for job in jobs:
+        r = job.record or dict(user_s=0.0, sys_s=0.0, max_rss_mb=0.0)
+        p.vprint(level if job.rc!=0 else level+1, "  %-*s  %s  %8.1f s  %8.1f s CPU  %8.1f MB  %s" %
+                 (width, job.name, "OK    " if job.rc==0 else "FAILED", job.elapsed(),
+                  r["user_s"]+r["sys_s"], r["max_rss_mb"], job.log_path or ""))
+#}}}
+
+def threadSplits(cores, min_threads=4): #{{{
+    """Ways to split 'cores' among concurrent jobs of a multi-threaded program: list of
+    (concurrency, threads per job), from one job with all cores to jobs with 'min_threads'
+    threads; concurrencies giving the same number of threads per job are left out.
+    """
+    splits = []
+    for concurrency in range(1, max(cores // min_threads, 1) + 1):
+        threads = cores // concurrency
+        if len(splits)==0 or threads!=splits[-1][1]:
+            splits.append( (concurrency, threads) )
+    return splits
+#}}}
+
+def inputSize(pattern): #{{{
+    """Total size (bytes) of files matching glob 'pattern'; used as job size."""
+    return sum([ os.path.getsize(_fn) for _fn in glob.glob(pattern) if os.path.isfile(_fn) ])
+#}}}
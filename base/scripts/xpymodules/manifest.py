@@ -0,0 +1,138 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module keeps a manifest of a stage: what each sample was computed from.
+
+For each sample, the manifest records
+    inputs      -- size, modification time (and optionally MD5 checksum) of each input file
+    params      -- a string describing settings (usually the command line)
+    versions    -- checksum of scripts/a_software_versions.sh (versions of tools)
+    outputs     -- size of each output file, relative to the stage directory
+A sample is up to date if all of these are the same as recorded and all outputs still exist
+with the recorded sizes; only samples which are not up to date need to be recomputed.
+
+The manifest is a JSON file in the stage directory ('.manifest.json'), written under
+a temporary name and renamed, so it is never left half-written.  Outputs of a sample should be
+written to a temporary directory ('tmpDir') and moved to the stage directory only when the sample
+succeeds ('commitOutputs'); then partial files of failed or interrupted jobs are never trusted.
+"""
+
+import os
+import os.path
+import json
+import shutil
+
+import rwfiles as rw
+
+
+manifest_filename = ".manifest.json"
+tmp_dirname = ".tmp"
+versions_filename = os.path.join("scripts", "a_software_versions.sh")
+
+def fileSignature(path, use_hash=False): #{{{
+    """[ size, mtime, md5 ] of file 'path' (md5 is None unless 'use_hash' and it is a regular
+    file; named pipes change their mtime whenever they are created); None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    use_hash = use_hash and os.path.isfile(path)
+    return [ st.st_size, int(st.st_mtime), rw.fileChecksum(path) if use_hash else None ]
+#}}}
+
+def versionsChecksum(): #{{{
+    """Checksum of scripts/a_software_versions.sh of the project (None if absent)."""
+    vpath = rw.resolvePath(versions_filename)
+    return rw.fileChecksum(vpath) if os.path.isfile(vpath) else None
+#}}}
+
+class Manifest(object): #{{{
+    """Manifest of stage directory 'stage_dir' (see module documentation).
+    Usage:
+        mf = Manifest(stage_dir)
+        sig = mf.signature(input_paths, params)
+        if not mf.isUpToDate(sn, sig):
+            ... run the job, writing to mf.tmpDir(sn) ...
+            mf.commitOutputs(sn)
+            mf.record(sn, sig)
+    """
+    def __init__(self, stage_dir, use_hash=False):
+        self.stage_dir = rw.resolvePath(stage_dir)
+        self.path = os.path.join(self.stage_dir, manifest_filename)
+        self.use_hash = use_hash
+        self.versions = versionsChecksum()
+        self.entries = dict()   # sample --> dict(inputs, params, versions, outputs)
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def signature(self, input_paths, params): #{{{
+        """Signature of a sample computed from files 'input_paths' with settings 'params'."""
+        return dict( inputs=dict([ (_ip, fileSignature(_ip, self.use_hash)) for _ip in input_paths ]),
+                     params=params,
+                     versions=self.versions )
+    #}}}
+
+    def isUpToDate(self, sn, signature): #{{{
+        entry = self.entries.get(sn)
+        if entry is None:
+            return False
+        for key in signature:
+            if entry.get(key)!=signature[key]:
+                return False
+        for (rel_path, size) in entry.get("outputs", dict()).iteritems():
+            opath = os.path.join(self.stage_dir, rel_path)
+            if not os.path.isfile(opath) or os.path.getsize(opath)!=size:
+                return False
+        return True
+    #}}}
+
+    def tmpDir(self, sn): #{{{
+        """Empty temporary directory for outputs of sample 'sn'."""
+        tpath = os.path.join(self.stage_dir, tmp_dirname, sn)
+        if os.path.exists(tpath):
+            shutil.rmtree(tpath)
+        os.makedirs(tpath)
+        return tpath
+    #}}}
+
+    def commitOutputs(self, sn): #{{{
+        """Move files from the temporary directory of sample 'sn' to the stage directory
+        (keeping subdirectories); returns dict: path relative to stage directory --> size.
+        """
+        tpath = os.path.join(self.stage_dir, tmp_dirname, sn)
+        outputs = dict()
+        for (dirpath, _, filenames) in os.walk(tpath):
+            rel_dir = os.path.relpath(dirpath, tpath)
+            dst_dir = rw.makePath(os.path.join(self.stage_dir, rel_dir))
+            for fn in filenames:
+                dst = os.path.join(dst_dir, fn)
+                os.rename(os.path.join(dirpath, fn), dst)
+                outputs[os.path.normpath(os.path.join(rel_dir, fn))] = os.path.getsize(dst)
+        shutil.rmtree(tpath)
+        return outputs
+    #}}}
+
+    def record(self, sn, signature, outputs=None): #{{{
+        """Record that sample 'sn' was computed with 'signature', producing 'outputs'
+        (dict: path relative to stage directory --> size); the manifest is saved immediately.
+        """
+        entry = dict(signature)
+        entry["outputs"] = outputs or dict()
+        self.entries[sn] = entry
+        self.save()
+    #}}}
+
+    def save(self): #{{{
+        tmp_path = "%s.tmp%d" % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+    #}}}
+#}}}
+
+def outputSizes(stage_dir, filenames): #{{{
+    """Dict: filename --> size for files (relative to 'stage_dir') written without 'tmpDir'."""
+    spath = rw.resolvePath(stage_dir)
+    return dict([ (_fn, os.path.getsize(os.path.join(spath,_fn))) for _fn in filenames ])
+#}}}
@@ -11,11 +11,29 @@ The path to a file may be given in tree ways:
 
 import os
 import os.path
+import re
+import io
+import gzip
+import mmap
+import hashlib
+import functools
+import cPickle
+import itertools
+import tempfile
+import zipfile
+import xml.sax.saxutils
+import multiprocessing
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import urllib
 from collections import namedtuple
 
 import xlrd
 import xlwt
 import csv
+import numpy as np
 
 import params as p
 
@@ -79,18 +97,23 @@ def stringify(rows): #{{{
     Moreover, Excel does not distinguish integers and floats.
     This function converts everything to strings; float values equal to integers
     are first converted to integers.
+    'rows' is a list of maps, or Table (then Table with string columns is returned).
     """
     import numbers
+    def strValue(v):
+        if isinstance(v, numbers.Number):
+            if int(v)==float(v):
+                v = int(v)
+            v = str(v)
+        return unicode(v.strip())
+    if isinstance(rows, Table):
+        return Table.fromColumns([ map(strValue, _cl) for _cl in rows.columnLists() ],
+                                 rows.colnames, typed=False)
     rrows = []
     for row in rows:
         rrow = dict()
         for (k,v) in row.iteritems():
-            if isinstance(v, numbers.Number):
-                if int(v)==float(v):
-                    v = int(v)
-                v = str(v)
-            v = v.strip()
-            rrow[k] = unicode(v)
+            rrow[k] = strValue(v)
         rrows.append(rrow)
     return rrows
 #}}}
@@ -119,8 +142,387 @@ def makePath(path): #{{{
     return apath
 #}}}
 
-def loadExcel(filename, colnames=None, expected_colnames=None, skip_first=0, worksheet=0): #{{{
-    """Read sheet(s) from Excel workbook.
+io_buffer_size = 4*1024*1024    # Buffer size for streaming readers and writers
+def isGzipped(filename): #{{{
+    """Returns True if the file starts with gzip magic bytes.
+    'filename' is resolved by 'resolvePath'.
+    """
+    with open(resolvePath(filename), 'rb') as f:
+        return f.read(2)=='\x1f\x8b'
+#}}}
+def openFile(filename, mode='r', buffer_size=io_buffer_size): #{{{
+    """Open (possibly gzipped) file with a large buffer.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+    'mode' is either 'r' (or 'rb'), 'w' (or 'wb'), or 'a' (or 'ab').
+    When reading, gzip compression is detected by magic bytes (multi-member gzip files,
+    like concatenated lanes, are read completely); when writing, the file is gzipped
+    if its name ends with '.gz'.
+    Returns a file-like object; it should be used as a context manager or closed explicitly.
+    """
+    fpath = resolvePath(filename)
+    bmode = mode[0] + 'b'
+    if mode[0]=='r' and isGzipped(fpath):
+        return io.BufferedReader(gzip.GzipFile(fpath, bmode), buffer_size)
+    elif mode[0]!='r' and fpath.endswith(".gz"):
+        return io.BufferedWriter(gzip.GzipFile(fpath, bmode, compresslevel=6), buffer_size)
+    else:
+        return open(fpath, bmode, buffer_size)
+#}}}
+
+def fileChecksum(filename): #{{{
+    """MD5 checksum (hex string) of file contents."""
+    md5 = hashlib.md5()
+    with open(resolvePath(filename), 'rb') as f:
+        for chunk in iter(lambda: f.read(io_buffer_size), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+#}}}
+
+# Cache of parsed files {{{
+# Results of loaders decorated by 'cached' are pickled to 'cache_dir' and reused while the file has
+# the same size and modification time (and, if 'cache_hash' is set, the same MD5 checksum), and the
+# loader is called with the same arguments. Files smaller than 'cache_min_size' are not cached, nor
+# results whose pickle would be larger than 'cache_max_size' (nor files larger than that).
+# Least recently used entries are removed when the cache grows over 'cache_max_size'.
+# 'loadLines' is not cached: it is not slower than unpickling, and it reads files of caches.
+# Environment variables:
+#   RWFILES_CACHE=0         -- do not use the cache
+#   RWFILES_CACHE_HASH=1    -- compare checksums of files, not only sizes and times
+#   RWFILES_CACHE_MB=N      -- maximum size of the cache (default: 2048 MB)
+cache_dir = "processedData/cache"   # relative to p.projdir, shared with other caches (see intervals)
+cache_enabled = os.getenv('RWFILES_CACHE', '1')!='0'
+cache_hash = os.getenv('RWFILES_CACHE_HASH', '0')=='1'
+cache_max_size = int(os.getenv('RWFILES_CACHE_MB', '2048'))*1024*1024
+cache_min_size = 64*1024            # bytes
+cache_version = 1                   # increment when results of cached loaders change
+
+def cacheEntries(): #{{{
+    """List of (path, size, time of last use) of cache entries, the least recently used first."""
+    if p.projdir is None or not os.path.isdir(resolvePath(cache_dir)):
+        return []
+    cpath = resolvePath(cache_dir)
+    entries = []
+    for name in os.listdir(cpath):
+        if name.endswith(".pkl"):
+            try:
+                st = os.stat(os.path.join(cpath, name))
+                entries.append( (os.path.join(cpath, name), st.st_size, st.st_mtime) )
+            except OSError:     # removed by another process
+                pass
+    return sorted(entries, key=lambda _e: _e[2])
+#}}}
+
+def evictCache(max_size=None): #{{{
+    """Remove least recently used cache entries until the cache is not larger than 'max_size'
+    (default: 'cache_max_size'); clearCache() is evictCache(0)."""
+    if max_size is None:
+        max_size = cache_max_size
+    entries = cacheEntries()
+    total_size = sum([ _s for (_path, _s, _t) in entries ])
+    for (path, size, atime) in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+#}}}
+
+def clearCache(): #{{{
+    evictCache(0)
+#}}}
+
+def cacheKey(fpath, loader_name, args, kwargs): #{{{
+    """Name of the cache entry of result of 'loader_name'(fpath, *args, **kwargs)."""
+    st = os.stat(fpath)
+    key = repr( (cache_version, fpath, st.st_size, st.st_mtime, loader_name, args,
+                 sorted(kwargs.items())) )
+    if cache_hash:
+        key += fileChecksum(fpath)
+    return "%s.%s.%s.pkl" % (os.path.basename(fpath), loader_name, hashlib.md5(key).hexdigest())
+#}}}
+
+def cached(loader): #{{{
+    """Decorator of loaders 'loader(filename, ...)': see "Cache of parsed files" above.
+    The loader is called directly if 'filename' is not a string (parsers accept lines, too),
+    if the file does not exist, is small or larger than the cache, or if the cache is disabled or
+    cannot be used.
+    """
+    @functools.wraps(loader)
+    def cachedLoader(filename, *args, **kwargs):
+        if not (cache_enabled and p.projdir is not None and isinstance(filename, basestring)):
+            return loader(filename, *args, **kwargs)
+        fpath = resolvePath(filename)
+        size = os.path.getsize(fpath) if os.path.isfile(fpath) else None
+        if size is None or not cache_min_size <= size <= cache_max_size:
+            return loader(filename, *args, **kwargs)
+        entry_path = os.path.join(resolvePath(cache_dir), cacheKey(fpath, loader.__name__, args, kwargs))
+        if os.path.isfile(entry_path):
+            try:
+                with open(entry_path, 'rb') as f:
+                    result = cPickle.load(f)
+                os.utime(entry_path, None)      # time of last use
+                p.vprint(1, "Loaded %s from cache %s." % (fpath, entry_path))
+                return result
+            except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+                p.vprint(1, "WARNING: cannot read cache entry %s." % entry_path)
+        result = loader(filename, *args, **kwargs)
+        try:
+            makePath(cache_dir)
+            tmp_path = "%s.tmp%d" % (entry_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                cPickle.dump(result, f, cPickle.HIGHEST_PROTOCOL)
+            if os.path.getsize(tmp_path) > cache_max_size:
+                os.remove(tmp_path)     # would be evicted at once
+                p.vprint(1, "Result of %s too large for the cache." % fpath)
+                return result
+            os.rename(tmp_path, entry_path)
+            evictCache()
+        except (IOError, OSError, cPickle.PicklingError) as e:
+            p.vprint(1, "WARNING: cannot save cache entry %s: %s" % (entry_path, e))
+        return result
+    return cachedLoader
+#}}}
+#}}}
+
+# Table {{{
+# Column-oriented alternative to the list of rows (maps colname --> value) returned by loaders:
+# one NumPy array per column, rows are light-weight views created on demand.
+def columnArray(values, typed=True): #{{{
+    """NumPy array of 'values' (list).
+    If 'typed', a column of integers (or of strings which are exactly integers, like "12" but not
+    "007") becomes int64, a column of floats (or of strings which are exactly floats, like "1.5"
+    but not "1.50" or "12") becomes float64; other columns, and all columns if not 'typed', are
+    object arrays.  Values of typed columns are written back as they were read: a column mixing
+    "12" and "3.25" stays an object array, as float64 would save "12" as "12.0".
+    """
+    def isExactInt(v):
+        try:
+            return isinstance(v, (int, long)) or str(int(v))==v
+        except (ValueError, TypeError):
+            return False
+    def isExactFloat(v):
+        try:
+            return isinstance(v, float) or (isinstance(v, basestring) and str(float(v))==v)
+        except (ValueError, TypeError):
+            return False
+    if typed and len(values) > 0:
+        try:
+            if all(isExactInt(_v) for _v in values):
+                return np.array([ int(_v) for _v in values ], dtype=np.int64)
+        except OverflowError:
+            pass
+        if all(isExactFloat(_v) for _v in values):
+            return np.array([ float(_v) for _v in values ], dtype=np.float64)
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+#}}}
+
+class TableRow(object): #{{{
+    """View of one row of Table; behaves like a read-only dict (colname --> value)."""
+    __slots__ = ("table", "i")
+    def __init__(self, table, i):
+        self.table = table
+        self.i = i
+    def __getitem__(self, colname):
+        v = self.table.columns[colname][self.i]
+        return v.item() if isinstance(v, np.generic) else v
+    def __contains__(self, colname):
+        return colname in self.table.columns
+    def get(self, colname, default=None):
+        return self[colname] if colname in self.table.columns else default
+    def keys(self):
+        return list(self.table.colnames)
+    def asDict(self):
+        return dict([ (_cn, self[_cn]) for _cn in self.table.colnames ])
+#}}}
+
+class Table(object): #{{{
+    """Column-oriented table.
+    'colnames' is the list of column names, 'columns' maps colname --> NumPy array (all arrays
+    have the same length).
+    Usage:
+        t = Table.fromRows(rows, colnames)      # or loadCSV(..., as_table=True), ...
+        t["Score"]                              # column as array
+        t.filter(t["Score"] > 10)               # rows by boolean mask or index array
+        t.select(["Name", "Score"])             # some columns
+        for row in t:  row["Name"]              # TableRow views
+        t.rows()                                # list of dicts, as returned by loaders
+    """
+    def __init__(self, columns, colnames):
+        self.columns = columns
+        self.colnames = list(colnames)
+
+    @staticmethod
+    def fromColumns(column_lists, colnames, typed=True): #{{{
+        """Table from lists of values, one list per column (see 'columnArray' for 'typed')."""
+        return Table( dict([ (_cn, columnArray(_cl, typed))
+                             for (_cn,_cl) in zip(colnames, column_lists) ]), colnames )
+    #}}}
+
+    @staticmethod
+    def fromRows(rows, colnames, typed=True, restval=''): #{{{
+        """Table from a list of maps colname --> value (missing values are 'restval')."""
+        return Table.fromColumns([ [ _r.get(_cn, restval) for _r in rows ] for _cn in colnames ],
+                                 colnames, typed)
+    #}}}
+
+    def __len__(self):
+        return len(self.columns[self.colnames[0]]) if len(self.colnames) > 0 else 0
+    def __getitem__(self, colname):
+        return self.columns[colname]
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield TableRow(self, i)
+    def row(self, i):
+        return TableRow(self, i)
+
+    def rows(self): #{{{
+        """List of maps colname --> value (the format returned by loaders by default)."""
+        col_lists = [ self.columns[_cn].tolist() for _cn in self.colnames ]
+        return [ dict(zip(self.colnames, _vals)) for _vals in zip(*col_lists) ]
+    #}}}
+
+    def columnLists(self, colnames=None, restval=''): #{{{
+        """List of lists of Python values, one per column of 'colnames' (default: all);
+        absent columns are filled with 'restval'.
+        """
+        return [ self.columns[_cn].tolist() if _cn in self.columns else [restval]*len(self)
+                 for _cn in (colnames or self.colnames) ]
+    #}}}
+
+    def select(self, colnames): #{{{
+        """Table with columns 'colnames' (arrays are shared, not copied)."""
+        return Table(dict([ (_cn, self.columns[_cn]) for _cn in colnames ]), colnames)
+    #}}}
+
+    def filter(self, selected): #{{{
+        """Table with rows 'selected' by a boolean mask or an array of indices."""
+        return Table(dict([ (_cn, _col[selected]) for (_cn,_col) in self.columns.iteritems() ]),
+                     self.colnames)
+    #}}}
+
+    def addColumn(self, colname, values, typed=True): #{{{
+        self.columns[colname] = values if isinstance(values, np.ndarray) else columnArray(values, typed)
+        if colname not in self.colnames:
+            self.colnames.append(colname)
+    #}}}
+#}}}
+#}}}
+
+# Streaming XLSX reader {{{
+# xlrd (since 2.0) reads only .xls workbooks; .xlsx worksheets are parsed here by iterparse, row by row,
+# with parsed rows removed from the tree. Values are returned like xlrd does: numbers (and dates) as
+# floats, booleans as 1/0, strings as unicode, empty cells as ''.
+xlsx_ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+xlsx_rel_ns = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+xlsx_cell_ref = re.compile(r'[A-Z]+')
+
+def xlsxColumnIndex(ref): #{{{
+    """Column index (0-based) of cell 'ref' (like "AB12")."""
+    icol = 0
+    for c in xlsx_cell_ref.match(ref).group():
+        icol = icol*26 + ord(c) - ord('A') + 1
+    return icol - 1
+#}}}
+
+def xlsxText(elem): #{{{
+    """Text of string item 'elem' (<si> or <is>): plain text, or runs of rich text;
+    phonetic hints are skipped."""
+    (t_tag, r_tag) = (xlsx_ns+"t", xlsx_ns+"r")
+    parts = []
+    for e in elem:
+        if e.tag==t_tag:
+            parts.append(e.text or u'')
+        elif e.tag==r_tag:
+            parts.extend([ _t.text or u'' for _t in e if _t.tag==t_tag ])
+    return u''.join(parts)
+#}}}
+
+def xlsxSheets(zf): #{{{
+    """List of (worksheet name, name of XML file in the archive) of opened .xlsx zip-file 'zf'."""
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = dict([ (_r.get("Id"), _r.get("Target")) for _r in rels ])
+    wb = ET.fromstring(zf.read("xl/workbook.xml"))
+    sheets = []
+    for sheet in wb.iter(xlsx_ns+"sheet"):
+        target = targets[sheet.get(xlsx_rel_ns+"id")]
+        sheets.append( (sheet.get("name"), target[1:] if target.startswith('/') else "xl/"+target) )
+    return sheets
+#}}}
+
+def xlsxSharedStrings(zf): #{{{
+    """List of shared strings of opened .xlsx zip-file 'zf'."""
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    strings = []
+    with zf.open("xl/sharedStrings.xml") as f:
+        for (event, elem) in ET.iterparse(f):
+            if elem.tag==xlsx_ns+"si":
+                strings.append(xlsxText(elem))
+                elem.clear()
+    return strings
+#}}}
+
+def iterXlsxRows(zf, sheet_path, shared_strings): #{{{
+    """Generator of rows (lists of values) of worksheet 'sheet_path' of opened .xlsx zip-file 'zf'.
+    Missing rows are yielded as empty lists; rows are not padded to the same length.
+    """
+    (v_tag, is_tag, row_tag) = (xlsx_ns+"v", xlsx_ns+"is", xlsx_ns+"row")
+    col_indexes = {}                # column name --> index
+    irow = 0
+    with zf.open(sheet_path) as f:
+        for (event, elem) in ET.iterparse(f):
+            if elem.tag!=row_tag:
+                continue
+            r = elem.get("r")
+            if r is not None:
+                while irow < int(r)-1:
+                    irow += 1
+                    yield []
+            irow += 1
+            row = []
+            for c in elem:
+                ref = c.get("r")
+                if ref is not None:
+                    col = ref.rstrip("0123456789")
+                    if col not in col_indexes:
+                        col_indexes[col] = xlsxColumnIndex(col)
+                    icol = col_indexes[col]
+                    if icol > len(row):
+                        row.extend( ['']*(icol-len(row)) )
+                t = c.get("t")
+                v = None
+                for child in c:
+                    if child.tag==v_tag:
+                        v = child.text
+                    elif child.tag==is_tag:
+                        v = xlsxText(child)
+                if v is None:
+                    value = ''
+                elif t is None or t=="n":
+                    value = float(v)
+                elif t=="s":
+                    value = shared_strings[int(v)]
+                elif t=="b":
+                    value = int(v)
+                else:
+                    value = v           # "inlineStr", "str", "e"
+                row.append(value)
+            yield row
+            # Parsed rows are not needed any more
+            elem.clear()
+#}}}
+#}}}
+
+@cached
+def loadExcel(filename, colnames=None, expected_colnames=None, skip_first=0, worksheet=0, #{{{
+              as_table=False):
+    """Read sheet(s) from Excel workbook (.xls, or .xlsx; the format is detected by contents).
     'filename'  "/path/to/file"     -- absolute,
                 "path/to/file"      -- relative to p.projdir,
                 "./path/to/file"    -- relative to the current directory
@@ -133,21 +535,35 @@ def loadExcel(filename, colnames=None, expected_colnames=None, skip_first=0, wor
                 Also, it can be a list of such object -- multiple worksheets will be read.
                 If is None, worksheet names are returned.
     
+    'as_table' -- return Table objects instead of lists of rows.
+    
     Result: either (list of rows, list of colnames), or [ (list of rows, list of colnames), ... ],
             or [ worksheet_name ] -- depending on the type of 'worksheet' argument.
     Each row in the list of rows is a map(colname --> value).
     
     The numbers of rows and columns in a worksheet are determined by 'nrows' and 'ncols' properties
-    of xlrd.Sheet object.
+    of xlrd.Sheet object (for .xlsx -- by the last row and the longest row).
+    Only requested worksheets are loaded (worksheet names are read without loading any); .xlsx
+    worksheets are parsed row by row (see iterXlsxRows), .xls ones are read a row at a time.
     
     If colnames is None, ther first (after skipping 'skip_first' rows) row is expected
     to contain column names. If there are repeated colnames, a warning is printed.
     """
     fn = resolvePath(filename)
     p.vprint(1, "Loading workbook %s..." % fn)
-    wb = xlrd.open_workbook(fn)
+    is_xlsx = zipfile.is_zipfile(fn)
+    if is_xlsx:
+        wb = zipfile.ZipFile(fn)
+        sheets = xlsxSheets(wb)
+        sheet_names = [ _n for (_n, _path) in sheets ]
+        shared_strings = None
+    else:
+        wb = xlrd.open_workbook(fn, on_demand=True)
+        sheet_names = wb.sheet_names()
     if worksheet is None:
-        return wb.sheet_names()
+        if is_xlsx: wb.close()
+        else: wb.release_resources()
+        return sheet_names
     elif isinstance(worksheet, (list, tuple, set, frozenset)):
         worksheets = list(worksheet)
     else:
@@ -155,33 +571,66 @@ def loadExcel(filename, colnames=None, expected_colnames=None, skip_first=0, wor
     results = []
     for ws_name in worksheets:
         p.vprint(1, "  Reading worksheet %s..." % ws_name)
-        if ws_name in range(wb.nsheets):
-            ws = wb.sheet_by_index(ws_name)
-        elif str(ws_name) in wb.sheet_names():
-            ws = wb.sheet_by_name(str(ws_name))
+        if ws_name in range(len(sheet_names)):
+            ws_index = ws_name
+        elif str(ws_name) in sheet_names:
+            ws_index = sheet_names.index(str(ws_name))
         else:
             p.vprint(0, "WARNING: worksheet %s is not found." % ws_name)
-            ws = None
-        if ws is not None:
-            #p.vprint(1, "Worksheet %s: %d rows, %d columns" % (ws_name,ws.nrows,ws.ncols))
-            first_row = skip_first
-            if colnames is not None:
-                ws_colnames = colnames[:ws.ncols]
+            continue
+        if is_xlsx:
+            if shared_strings is None:
+                shared_strings = xlsxSharedStrings(wb)
+            rows = iterXlsxRows(wb, sheets[ws_index][1], shared_strings)
+        else:
+            ws = wb.sheet_by_index(ws_index)
+            rows = ( ws.row_values(_i) for _i in xrange(ws.nrows) )
+        for i in range(skip_first): next(rows, None)
+        if colnames is None:
+            # Read colnames from the first row
+            header = next(rows, [])
+        # The number of columns of .xlsx is known only when all rows are read: rows are streamed,
+        # and columns (with empty names) are added when a longer row comes, with empty values
+        # in rows read before
+        ncols = ws.ncols if not is_xlsx else len(header) if colnames is None else 0
+        if colnames is not None:
+            ws_colnames = colnames[:ncols]
+        else:
+            ws_colnames = header + ['']*(ncols-len(header))
+        max_nc = len(colnames) if colnames is not None else None
+        nc = len(ws_colnames)
+        columns = [ [] for _ in ws_colnames ]
+        table_data = []
+        nr_rows = 0
+        for r in rows:
+            if len(r) > nc and (max_nc is None or nc < max_nc):
+                new_nc = len(r) if max_nc is None else min(len(r), max_nc)
+                new_colnames = colnames[nc:new_nc] if colnames is not None else ['']*(new_nc-nc)
+                ws_colnames = ws_colnames + new_colnames
+                if as_table:
+                    columns += [ ['']*nr_rows for _ in new_colnames ]
+                else:
+                    for row in table_data:
+                        row.update([ (_cn, '') for _cn in new_colnames ])
+                nc = new_nc
+            if len(r)!=nc:
+                r = (r+['']*nc)[:nc]
+            if as_table:
+                for (column, value) in zip(columns, r):
+                    column.append(value)
             else:
-                # Read colnames from the first row
-                ws_colnames = [ ws.cell_value(skip_first,i) for i in range(ws.ncols) ]
-                first_row += 1
-            #p.vprint(1, "Colnames: %s" % ws_colnames)
-            checkColnames(expected_colnames, ws_colnames, fn)
-            table_data = []
-            for i in range(first_row, ws.nrows):
-                row = dict()
-                for j in range(len(ws_colnames)):
-                    row[ws_colnames[j]] = ws.cell_value(i,j)
-                table_data.append(row)
-            p.vprint(1, "  Done, %d columns and %d rows." % (len(ws_colnames), len(table_data)))
-            results.append( (table_data, ws_colnames) )
-            
+                table_data.append(dict(zip(ws_colnames, r)))
+            nr_rows += 1
+        #p.vprint(1, "Colnames: %s" % ws_colnames)
+        checkColnames(expected_colnames, ws_colnames, fn)
+        if as_table:
+            table_data = Table.fromColumns(columns, ws_colnames)
+        if not is_xlsx:
+            wb.unload_sheet(ws_index)
+        p.vprint(1, "  Done, %d columns and %d rows." % (len(ws_colnames), nr_rows))
+        results.append( (table_data, ws_colnames) )
+    if is_xlsx: wb.close()
+    else: wb.release_resources()
     p.vprint(1, "Done with workbook.")
     # Return either list of tables or single table depending on type of 'worksheet' argument
     if isinstance(worksheet, (list, tuple, set, frozenset)):
@@ -190,39 +639,50 @@ def loadExcel(filename, colnames=None, expected_colnames=None, skip_first=0, wor
         return results[0]
 #}}}
 
+def loadExcelTask(args): #{{{
+    (filename, kwargs) = args
+    return loadExcel(filename, **kwargs)
+#}}}
+
+def loadExcelFiles(filenames, nr_workers=None, **kwargs): #{{{
+    """Read many Excel workbooks by a pool of 'nr_workers' processes (default: number of CPUs).
+    'kwargs' are arguments of loadExcel, the same for all workbooks.
+    Returns the list of results of loadExcel, in the order of 'filenames'.
+    """
+    if len(filenames) < 2 or nr_workers==1:
+        return [ loadExcel(_fn, **kwargs) for _fn in filenames ]
+    pool = multiprocessing.Pool(min(nr_workers or multiprocessing.cpu_count(), len(filenames)))
+    results = pool.map(loadExcelTask, [ (_fn, kwargs) for _fn in filenames ], 1)
+    pool.close()
+    pool.join()
+    return results
+#}}}
+
 def saveExcel(filename, rows, colnames, #{{{
               col_align=None, col_fmts=None, col_xfs=None, col_width=None):
     """Write Excel spreadsheet.
-    If 'rows' contains more than 65000 elements, it is stored in multiple worksheets.
+    If 'filename' ends with '.xlsx', Excel 2007+ workbook is written with streaming (see XlsxWorkbook),
+    up to 'xlsx_max_rows' rows per worksheet; otherwise, Excel 97 workbook is written with xlwt,
+    65000 rows per worksheet. If 'rows' contains more rows, it is stored in multiple worksheets.
     'filename'  "/path/to/file"     -- absolute,
                 "path/to/file"      -- relative to p.projdir,
                 "./path/to/file"    -- relative to the current directory
-    'rows' is a list of map(colname --> value).
+    'rows' is a list of map(colname --> value), or Table (for '.xlsx', any iterable of maps).
            If a row does not have an entry for a colname, empty cell is stored.
-    'colnames' is a list of strings; only columns listed in 'colnames' are written to file
-               (excessive entries in rows are ignored).
-    'col_align' is useful if only alignment formatting is needed; it is ignored if either
-                'col_fmts' or 'col_xfs' is not None.
-                It is a list of the same length as 'colnames'; possible values:
-                -1: left alignment, with 10 pt indent;
-                 0: center alignment;
-                 1: right alignment;
-                any other value (None, for example): general alignment.
-    'col_fmts' is a list (of the same length as 'colnames') of strings, which are used as
-               arguments for xlwt.easyfx function.
-               It is ignored if 'col_xfs' is not None.
-    'col_xfs' is a list (of the same length as 'colnames') of xlwt.Style objects (produced
-              by xlwt.easyfx function or created in a more sophisticated way).
-    'col_width' is a list (of the same length as 'colnames') of integers, width in characters.
+    Other arguments are described in addExcelWorksheet.
     """
-    wb = createExcelWorkbook()
+    wb = createExcelWorkbook(xlsx=filename.endswith(".xlsx"))
     addExcelWorksheet(wb, "Sheet", rows, colnames, col_align, col_fmts, col_xfs, col_width)
-    saveExcelWorkbook(wb, filename)
+    saveExcelWorkbook(filename, wb)
 #}}}
 
 # Interface to save multi-sheet Excel tables {{{
-def createExcelWorkbook(): #{{{
-    return xlwt.Workbook()
+# Format strings of alignment values of 'col_align' argument
+excel_align_fmts = { -1: 'align: horiz left, indent 1', 0: 'align: horiz center', 1: 'align: horiz right' }
+
+def createExcelWorkbook(xlsx=False): #{{{
+    """New empty workbook: XlsxWorkbook if 'xlsx', xlwt.Workbook otherwise."""
+    return XlsxWorkbook() if xlsx else xlwt.Workbook()
 #}}}
 
 def openExcelWorkbook(filename): #{{{
@@ -236,13 +696,16 @@ def openExcelWorkbook(filename): #{{{
 def addExcelWorksheet(workbook, worksheet_name, rows, colnames, #{{{
               col_align=None, col_fmts=None, col_xfs=None, col_width=None):
     """Add worksheet to Excel workbook.
-    If 'rows' contains more than 65000 elements, it is stored in multiple worksheets,
-    with names "worksheet_name (1)", ...
+    If 'rows' contains more than 65000 elements (or 'xlsx_max_rows' for XlsxWorkbook),
+    it is stored in multiple worksheets, with names "worksheet_name (0)", "worksheet_name (1)", ...
+    (for XlsxWorkbook: "worksheet_name", "worksheet_name (1)", ...).
     No check whether worksheet name already exists is made.
     'workbook' is a workbook object returned by 'createExcelWorkbook', or 'openExcelWorkbook',
                or this function.
+               XlsxWorkbook is written row by row, without keeping rows in memory;
+               'rows' may be any iterable (a generator, for example).
     'worksheet_name' is a string to name added worksheet(s).
-    'rows' is a list of map(colname --> value).
+    'rows' is a list of map(colname --> value), or Table.
            If a row does not have an entry for a colname, empty cell is stored.
     'colnames' is a list of strings; only columns listed in 'colnames' are written to file
                (excessive entries in rows are ignored).
@@ -254,27 +717,51 @@ def addExcelWorksheet(workbook, worksheet_name, rows, colnames, #{{{
                  1: right alignment;
                 any other value (None, for example): general alignment.
     'col_fmts' is a list (of the same length as 'colnames') of strings, which are used as
-               arguments for xlwt.easyfx function.
+               arguments for xlwt.easyfx function (for XlsxWorkbook, see xlsxStyleKey).
                It is ignored if 'col_xfs' is not None.
     'col_xfs' is a list (of the same length as 'colnames') of xlwt.Style objects (produced
-              by xlwt.easyfx function or created in a more sophisticated way).
+              by xlwt.easyfx function or created in a more sophisticated way);
+              not supported by XlsxWorkbook.
     'col_width' is a list (of the same length as 'colnames') of integers, width in characters.
     """
     p.vprint(1, "Adding worksheet '%s' to Excel workbook..." % worksheet_name)
-    ezxf = xlwt.easyxf
+    if col_fmts is None and col_align is not None:
+        col_fmts = [ excel_align_fmts.get(_a, '') for _a in col_align ]
+    if isinstance(workbook, XlsxWorkbook):
+        if col_xfs is not None:
+            p.vprint(0, "Warning: 'col_xfs' is not supported in .xlsx workbooks, ignored.")
+        if isinstance(rows, Table):
+            rows = itertools.izip(*rows.columnLists(colnames))
+        else:
+            rows = ( [ _r.get(_cn,'') for _cn in colnames ] for _r in rows )
+        (nr_rows, nr_sheets) = (0, 0)
+        while True:
+            sheet_name = worksheet_name if nr_sheets==0 else "%s (%d)" % (worksheet_name, nr_sheets)
+            n = workbook.addSheet(sheet_name, rows, colnames, col_fmts, col_width)
+            if n==0 and nr_sheets>0:
+                os.remove(workbook.sheets.pop()[1])
+                break
+            nr_rows += n
+            nr_sheets += 1
+            if n < xlsx_max_rows:
+                break
+        p.vprint(1,"Done, %d columns and %d rows in %d worksheets." % (len(colnames),nr_rows,nr_sheets))
+        return
+    xf_cache = {}
+    def ezxf(fmt):
+        if fmt not in xf_cache:
+            xf_cache[fmt] = xlwt.easyxf(fmt)
+        return xf_cache[fmt]
     heading_xf = ezxf("""font: bold on, height 240;
                          align: wrap on, vert center, horiz center;
                          pattern: pattern solid, fore_colour ice_blue""")
     if col_xfs is None:
-        col_xfs = [ezxf('')] * len(colnames)
-        if col_fmts is not None:
-            col_xfs = [ ezxf(fmt) for fmt in col_fmts ]
-        elif col_align is not None:
-            col_xfs = [ ezxf('align: horiz left, indent 1')     if align==-1 else
-                        ezxf('align: horiz center')             if align==0  else
-                        ezxf('align: horiz right')              if align==1  else
-                        ezxf('')
-                        for align in col_align ]
+        col_xfs = [ ezxf(fmt or '') for fmt in (col_fmts or [None]*len(colnames)) ]
+    is_table = isinstance(rows, Table)
+    if is_table:
+        rows = zip(*rows.columnLists(colnames))     # tuples of values
+    elif not isinstance(rows, list):
+        rows = list(rows)
     nr_rows = len(rows)
     if len(rows) <= 65000:
         row_subsets = [ rows ]
@@ -303,8 +790,9 @@ def addExcelWorksheet(workbook, worksheet_name, rows, colnames, #{{{
         irow =0
         for row in row_subsets[sh_i]:
             irow += 1
-            for (icol, colname) in enumerate(colnames):
-                sheet.write(irow, icol, row.get(colname,''), col_xfs[icol])
+            values = row if is_table else [ row.get(_cn,'') for _cn in colnames ]
+            for (icol, value) in enumerate(values):
+                sheet.write(irow, icol, value, col_xfs[icol])
         # Set column width if requested
         if col_width is not None:
             for (i, width) in enumerate(col_width):
@@ -313,7 +801,246 @@ def addExcelWorksheet(workbook, worksheet_name, rows, colnames, #{{{
     return 
 #}}}
 
+# Streaming XLSX writer {{{
+# Worksheets are written as XML to temporary files while rows are added (inline strings, no shared
+# string table), and zipped into the workbook by save(); memory use does not depend on the number of
+# rows. Formatting is given by xlwt.easyxf-like strings (see xlsxStyleKey); equal formats share one
+# cell style.
+xlsx_max_rows = 1000000         # data rows per worksheet (Excel limit is 1048576 including header)
+xlsx_tmp_dir = "processedData/tmp_xlsx"     # worksheets being written (relative to p.projdir)
+xlsx_heading_fmt = "font: bold on; align: wrap on, vert center, horiz center; pattern: fore_colour ice_blue"
+xlsx_fill_colours = { 'ice_blue': "FFDAEEF3", 'gray25': "FFC0C0C0", 'light_yellow': "FFFFFF99",
+                      'light_green': "FFCCFFCC", 'light_orange': "FFFFCC99", 'white': "FFFFFFFF" }
+xlsx_invalid_chars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def xlsxColumnName(icol): #{{{
+    """Excel name of column 'icol' (0-based): A, B, ..., Z, AA, ..."""
+    name = ''
+    icol += 1
+    while icol > 0:
+        (icol, r) = divmod(icol-1, 26)
+        name = chr(ord('A')+r) + name
+    return name
+#}}}
+
+def xlsxStyleKey(fmt): #{{{
+    """Parse xlwt.easyxf-like format string 'fmt' into a hashable style key
+    (bold, horiz, vert, indent, wrap, fill colour, number format).
+    Supported: "font: bold on", "align: horiz left|center|right, vert top|center|bottom, indent N,
+    wrap on", "pattern: fore_colour name", and number format given as second argument of easyxf
+    is written here as "num_format_str: 0.00"; other settings are ignored.
+    """
+    style = { 'bold': False, 'horiz': None, 'vert': None, 'indent': 0, 'wrap': False,
+              'fill': None, 'numfmt': None }
+    for part in fmt.split(';'):
+        if ':' not in part: continue
+        (group, settings) = [ _s.strip() for _s in part.split(':', 1) ]
+        if group=='num_format_str':
+            style['numfmt'] = settings
+            continue
+        for setting in settings.split(','):
+            words = setting.split()
+            if len(words)!=2: continue
+            (name, value) = words
+            if group=='font' and name=='bold':
+                style['bold'] = (value=='on')
+            elif group=='align' and name in ('horiz', 'horz', 'horizontal'):
+                style['horiz'] = value
+            elif group=='align' and name in ('vert', 'vertical'):
+                style['vert'] = value
+            elif group=='align' and name=='indent':
+                style['indent'] = int(value)
+            elif group=='align' and name=='wrap':
+                style['wrap'] = (value=='on')
+            elif group=='pattern' and name in ('fore_colour', 'fore_color'):
+                style['fill'] = xlsx_fill_colours.get(value, xlsx_fill_colours['ice_blue'])
+    return tuple(style[_k] for _k in ('bold', 'horiz', 'vert', 'indent', 'wrap', 'fill', 'numfmt'))
+#}}}
+
+class XlsxWorkbook(object): #{{{
+    """Excel 2007+ workbook written with streaming; interface of xlwt.Workbook used by
+    addExcelWorksheet and saveExcelWorkbook:
+        wb = XlsxWorkbook()
+        wb.addSheet(name, rows, colnames, col_fmts, col_width)
+        wb.save(filename)
+    Worksheets are written to temporary files in 'tmp_dir' (default: 'xlsx_tmp_dir' of the
+    project, or the system temporary directory without a project), removed with the workbook
+    or when saving fails.
+    """
+    def __init__(self, tmp_dir=None): #{{{
+        self.tmp_dir = tmp_dir
+        self.sheets = []            # (name, temporary filename)
+        self.styles = {}            # style key --> index of cell style
+        self.style_keys = []
+        self.style('')              # default style has index 0
+    #}}}
+
+    def __del__(self): #{{{
+        self.removeSheetFiles()
+    #}}}
+
+    def removeSheetFiles(self): #{{{
+        for (name, tmpname) in self.sheets:
+            if os.path.exists(tmpname): os.remove(tmpname)
+    #}}}
+
+    def style(self, fmt): #{{{
+        """Index of cell style given by format string 'fmt' (see xlsxStyleKey)."""
+        key = xlsxStyleKey(fmt)
+        if key not in self.styles:
+            self.styles[key] = len(self.style_keys)
+            self.style_keys.append(key)
+        return self.styles[key]
+    #}}}
+
+    def addSheet(self, name, rows, colnames, col_fmts=None, col_width=None): #{{{
+        """Write worksheet 'name' with header row 'colnames', and at most 'xlsx_max_rows' rows
+        taken from iterator 'rows' (each row is a sequence of values of columns).
+        'col_fmts' is a list of format strings of columns, 'col_width' a list of widths in characters.
+        Returns the number of rows written.
+        """
+        if self.tmp_dir is None:
+            self.tmp_dir = makePath(xlsx_tmp_dir) if p.projdir is not None else tempfile.gettempdir()
+        (fd, tmpname) = tempfile.mkstemp(suffix=".xml", prefix="sheet", dir=self.tmp_dir)
+        self.sheets.append((name[:31], tmpname))
+        col_styles = [ self.style(_f or '') for _f in (col_fmts or [None]*len(colnames)) ]
+        col_refs = [ xlsxColumnName(_i) for _i in range(len(colnames)) ]
+        heading = self.style(xlsx_heading_fmt)
+        nr_rows = 0
+        try:
+            with io.open(fd, 'wb', buffering=io_buffer_size) as f:
+                f.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                        'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>')
+                if col_width is not None and any(_w>0 for _w in col_width):
+                    f.write('<cols>' + ''.join('<col min="%d" max="%d" width="%d" customWidth="1"/>' %
+                                               (_i+1, _i+1, _w) for (_i, _w) in enumerate(col_width) if _w>0)
+                            + '</cols>')
+                f.write('<sheetData><row r="1" ht="25.6" customHeight="1">')
+                f.write(''.join(self.cell(_r+"1", _v, heading) for (_r, _v) in zip(col_refs, colnames)))
+                f.write('</row>')
+                for values in itertools.islice(rows, xlsx_max_rows):
+                    nr_rows += 1
+                    irow = str(nr_rows+1)
+                    f.write('<row r="%s">%s</row>' %
+                            (irow, ''.join(self.cell(_r+irow, _v, _s)
+                                           for (_r, _v, _s) in zip(col_refs, values, col_styles))))
+                f.write('</sheetData></worksheet>')
+        except BaseException:
+            # A partly written worksheet is not kept
+            os.remove(tmpname)
+            self.sheets.pop()
+            raise
+        return nr_rows
+    #}}}
+
+    @staticmethod
+    def cell(ref, value, style): #{{{
+        """XML of cell 'ref' (like "B12"); empty string for empty 'value'."""
+        if value is None or value=='':
+            return ''
+        if isinstance(value, (bool, np.bool_)):
+            return '<c r="%s" s="%d" t="b"><v>%d</v></c>' % (ref, style, value)
+        if isinstance(value, (int, long, float, np.number)) and np.isfinite(value):
+            if isinstance(value, np.number): value = value.item()
+            return '<c r="%s" s="%d"><v>%s</v></c>' % (ref, style, repr(value)
+                                                         if isinstance(value, float) else str(value))
+        if not isinstance(value, unicode):
+            value = str(value).decode('utf-8', 'replace')
+        value = xml.sax.saxutils.escape(xlsx_invalid_chars.sub(u'', value))
+        return ('<c r="%s" s="%d" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' %
+                (ref, style, value)).encode('utf-8')
+    #}}}
+
+    def stylesXML(self): #{{{
+        numfmts = sorted(set(_k[6] for _k in self.style_keys if _k[6] is not None))
+        numfmt_ids = dict((_f, 164+_i) for (_i, _f) in enumerate(numfmts))
+        fills = sorted(set(_k[5] for _k in self.style_keys if _k[5] is not None))
+        fill_ids = dict((_c, 2+_i) for (_i, _c) in enumerate(fills))
+        esc = xml.sax.saxutils.quoteattr
+        xfs = []
+        for (bold, horiz, vert, indent, wrap, fill, numfmt) in self.style_keys:
+            align = ''.join([ ' horizontal=%s' % esc(horiz) if horiz else '',
+                              ' vertical=%s' % esc(vert) if vert else '',
+                              ' indent="%d"' % indent if indent else '',
+                              ' wrapText="1"' if wrap else '' ])
+            xfs.append('<xf numFmtId="%d" fontId="%d" fillId="%d" borderId="0" xfId="0"%s%s%s>%s</xf>' %
+                       (numfmt_ids.get(numfmt, 0), int(bold), fill_ids.get(fill, 0),
+                        ' applyNumberFormat="1"' if numfmt else '', ' applyFont="1"' if bold else '',
+                        ' applyAlignment="1"' if align else '',
+                        '<alignment%s/>' % align if align else ''))
+        return ''.join([
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">',
+            '<numFmts count="%d">%s</numFmts>' % (len(numfmts), ''.join(
+                '<numFmt numFmtId="%d" formatCode=%s/>' % (numfmt_ids[_f], esc(_f)) for _f in numfmts))
+                if numfmts else '',
+            '<fonts count="2"><font><sz val="10"/><name val="Arial"/></font>'
+            '<font><b/><sz val="10"/><name val="Arial"/></font></fonts>',
+            '<fills count="%d"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill>%s</fills>' % (2+len(fills), ''.join(
+                '<fill><patternFill patternType="solid"><fgColor rgb="%s"/></patternFill></fill>' % _c
+                for _c in fills)),
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>',
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>',
+            '<cellXfs count="%d">%s</cellXfs>' % (len(xfs), ''.join(xfs)),
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>',
+            '</styleSheet>' ])
+    #}}}
+
+    def save(self, filename): #{{{
+        """Write workbook to 'filename' (full path); it is replaced atomically."""
+        ns = "http://schemas.openxmlformats.org"
+        sheet_ids = range(1, len(self.sheets)+1)
+        tmpname = "%s.tmp%d" % (filename, os.getpid())
+        saved = False
+        try:
+            with zipfile.ZipFile(tmpname, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                zf.writestr('[Content_Types].xml',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<Types xmlns="%s/package/2006/content-types">'
+                    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                    '<Default Extension="xml" ContentType="application/xml"/>'
+                    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                    '%s</Types>' % (ns, ''.join(
+                    '<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' % _i
+                    for _i in sheet_ids)))
+                zf.writestr('_rels/.rels',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<Relationships xmlns="%s/package/2006/relationships">'
+                    '<Relationship Id="rId1" Type="%s/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                    '</Relationships>' % (ns, ns))
+                zf.writestr('xl/workbook.xml',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<workbook xmlns="%s/spreadsheetml/2006/main" xmlns:r="%s/officeDocument/2006/relationships">'
+                    '<sheets>%s</sheets></workbook>' % (ns, ns, ''.join(
+                    '<sheet name=%s sheetId="%d" r:id="rId%d"/>' %
+                    (xml.sax.saxutils.quoteattr(self.sheets[_i-1][0]), _i, _i) for _i in sheet_ids)))
+                zf.writestr('xl/_rels/workbook.xml.rels',
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<Relationships xmlns="%s/package/2006/relationships">%s'
+                    '<Relationship Id="rId%d" Type="%s/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+                    '</Relationships>' % (ns, ''.join(
+                    '<Relationship Id="rId%d" Type="%s/officeDocument/2006/relationships/worksheet" '
+                    'Target="worksheets/sheet%d.xml"/>' % (_i, ns, _i) for _i in sheet_ids),
+                    len(self.sheets)+1, ns))
+                zf.writestr('xl/styles.xml', self.stylesXML())
+                for (i, (name, sheet_tmpname)) in zip(sheet_ids, self.sheets):
+                    zf.write(sheet_tmpname, 'xl/worksheets/sheet%d.xml' % i)
+            os.rename(tmpname, filename)
+            saved = True
+        finally:
+            if not saved:
+                if os.path.exists(tmpname): os.remove(tmpname)
+                self.removeSheetFiles()
+    #}}}
+#}}}
+#}}}
+
 def saveExcelWorkbook(filename, workbook): #{{{
+    """Save 'workbook' (xlwt.Workbook or XlsxWorkbook) to 'filename'."""
     fn = resolvePath(filename)
     p.vprint(1, "Saving %s..." % fn)
     workbook.save(fn)
@@ -321,8 +1048,9 @@ def saveExcelWorkbook(filename, workbook): #{{{
 #}}}
 #}}}
 
-def loadCSV(filename, colnames=None, expected_colnames=None, skip_first=0): # {{{
-    """Read CSV file.
+@cached
+def loadCSV(filename, colnames=None, expected_colnames=None, skip_first=0, as_table=False): # {{{
+    """Read CSV file (possibly gzipped).
     'filename'  "/path/to/file"     -- absolute,
                 "path/to/file"      -- relative to p.projdir,
                 "./path/to/file"    -- relative to the current directory
@@ -331,8 +1059,9 @@ def loadCSV(filename, colnames=None, expected_colnames=None, skip_first=0): # {{
     'expected_colnames' is a list of strings -- names of columns that MUST be present;
                         if table does not have a column from this list, a warning is printed.
     'skip_first' gives a number of rows to be skipped before reading data.
+    'as_table' -- return Table (with typed columns) instead of list of rows.
     
-    Result: (list of rows, list of colnames).
+    Result: (list of rows, list of colnames), or (Table, list of colnames).
     Each row in the list of rows is a map(colname --> value).
     
     The number of rows is determined by the number of lines in the file, and the number of columns
@@ -340,30 +1069,81 @@ def loadCSV(filename, colnames=None, expected_colnames=None, skip_first=0): # {{
     
     If colnames is None, ther first row (after skipping 'skip_first' rows) is expected
     to contain column names. If there are repeated colnames, a warning is printed.
+    Use iterCSV() to read large files in chunks.
     """
     fpath = resolvePath(filename)
     p.vprint(1,"Loading %s..." % fpath)
-    with open(fpath, 'r') as f:
-        # Skip first rows
-        for i in range(skip_first): f.readline()
-        # Create dictionary reader (fieldnames=None is required to read column names from file)
-        csvrdr = csv.DictReader(f, fieldnames=colnames, dialect=csv.excel_tab)
-        # Read rows
-        rows = [ row for row in csvrdr ]
-        colnames = csvrdr.fieldnames
+    with openFile(fpath, 'r') as f:
+        (csvrdr, colnames) = csvReader(f, colnames, skip_first, as_table)
+        if not checkColnames(expected_colnames,colnames,fpath):
+            raise Exception()
+        if as_table:
+            rows = tableChunk(list(csvrdr), colnames)
+        else:
+            rows = [ row for row in csvrdr ]
     p.vprint(1,"Done, %d columns and %d rows." % (len(colnames), len(rows)))
-    if checkColnames(expected_colnames,colnames,fpath):
-        return (rows, colnames)
+    return (rows, colnames)
+#}}}
+
+def csvReader(f, colnames, skip_first, as_table): #{{{
+    """Skip 'skip_first' lines of open file 'f' and create a reader of its rows (see loadCSV).
+    Returns (reader, colnames); the reader yields lists of exactly len(colnames) values
+    if 'as_table', maps(colname --> value) otherwise.
+    """
+    for i in range(skip_first): f.readline()
+    if as_table:
+        csvrdr = csv.reader(f, dialect=csv.excel_tab)
+        if colnames is None:
+            colnames = next(csvrdr, [])
+        ncols = len(colnames)
+        csvrdr = ( _r if len(_r)==ncols else (_r+[None]*ncols)[:ncols] for _r in csvrdr )
     else:
-        raise Exception()
+        # Create dictionary reader (fieldnames=None is required to read column names from file)
+        csvrdr = csv.DictReader(f, fieldnames=colnames, dialect=csv.excel_tab)
+        colnames = csvrdr.fieldnames or []
+    return (csvrdr, colnames)
+#}}}
+
+def tableChunk(lists, colnames): #{{{
+    """Table of rows 'lists' (lists of len(colnames) values)."""
+    return Table.fromColumns(zip(*lists) if len(lists) > 0 else [[]]*len(colnames), colnames)
+#}}}
+
+def iterCSV(filename, colnames=None, expected_colnames=None, skip_first=0, chunk_size=100000,
+            as_table=False): # {{{
+    """Read CSV file (possibly gzipped) in chunks of 'chunk_size' rows.
+    Arguments are the same as in loadCSV().
+    Generator of (chunk, colnames), where chunk is a list of at most 'chunk_size' rows
+    (maps colname --> value) or, if 'as_table', a Table. Only one chunk is held in memory
+    at a time, so files larger than memory can be processed, e.g.:
+        for (rows, colnames) in rw.iterCSV("big.tsv.gz", as_table=True):
+            ...
+    The file is closed when the generator is exhausted or garbage-collected.
+    """
+    fpath = resolvePath(filename)
+    p.vprint(1,"Loading %s in chunks of %d rows..." % (fpath, chunk_size))
+    nr_rows = 0
+    with openFile(fpath, 'r') as f:
+        (csvrdr, colnames) = csvReader(f, colnames, skip_first, as_table)
+        if not checkColnames(expected_colnames,colnames,fpath):
+            raise Exception()
+        while True:
+            chunk = list(itertools.islice(csvrdr, chunk_size))
+            if len(chunk)==0:
+                break
+            nr_rows += len(chunk)
+            yield (tableChunk(chunk, colnames) if as_table else chunk, colnames)
+    p.vprint(1,"Done, %d columns and %d rows." % (len(colnames), nr_rows))
 #}}}
 
 def saveCSV(filename, rows, colnames, restval='', header=True, prefix=[]): # {{{
-    """Save CSV file.
+    """Save CSV file; it is gzipped if its name ends with '.gz'.
     'filename'  "/path/to/file"     -- absolute,
                 "path/to/file"      -- relative to p.projdir,
                 "./path/to/file"    -- relative to the current directory
-    'rows' is a list of map(colname --> value).
+    'rows' is a Table, or any iterable (list, generator, ...) of maps(colname --> value)
+           and/or Tables (chunks, like those yielded by iterCSV()); rows are written as they
+           come, so a generator is never materialised.
            Each row must have entry for each colname in 'colnames'.
     'colnames' is a list of strings; only columns listed in 'colnames' are written to file
                (excessive entries in rows are ignored).
@@ -372,15 +1152,25 @@ def saveCSV(filename, rows, colnames, restval='', header=True, prefix=[]): # {{{
     """
     fpath = resolvePath(filename)
     p.vprint(1, "Saving %s..." % fpath)
-    with open(fpath, 'w') as f:
+    if isinstance(rows, Table):
+        rows = [rows]
+    nr_rows = 0
+    with openFile(fpath, 'w') as f:
         # Write prefix if needed
         for line in prefix: f.write(line+'\n')
         # in version 2.6, csv has no method 'writeheader' -- we have to do it manually
         if header: f.write( '\t'.join(colnames) + '\n' )
-        csvwrt = csv.DictWriter(f, fieldnames=colnames, restval=restval,
-                                dialect=csv.excel_tab, extrasaction='ignore')
-        csvwrt.writerows(rows)
-    p.vprint(1,"Done, %d columns and %d rows." % (len(colnames), len(rows)))
+        csvwrt = csv.writer(f, dialect=csv.excel_tab)
+        dictwrt = csv.DictWriter(f, fieldnames=colnames, restval=restval,
+                                 dialect=csv.excel_tab, extrasaction='ignore')
+        for row in rows:
+            if isinstance(row, Table):
+                csvwrt.writerows(zip(*row.columnLists(colnames, restval)))
+                nr_rows += len(row)
+            else:
+                dictwrt.writerow(row)
+                nr_rows += 1
+    p.vprint(1,"Done, %d columns and %d rows." % (len(colnames), nr_rows))
 #}}}
 
 
@@ -416,39 +1206,94 @@ def saveLines(filename, lines): # {{{
     p.vprint(1, "Done, %d lines." % len(lines))
 #}}}
 
+def loadShellVars(filename): # {{{
+    """Load variables from a simple shell script, like 'scripts/g_filelist.sh'.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+    Recognized are assignments  NAME="value"  (value may be continued on next lines after '\\')
+    and associative arrays  declare -A NAME=( [key]="value" ... ); other lines are ignored.
+    Values are not expanded.
+    Returns map(name --> value), where value is either a string or a map(key --> string).
+    """
+    fpath = resolvePath(filename)
+    p.vprint(1, "Loading shell variables from %s..." % fpath)
+    with open(fpath, 'r') as f:
+        text = f.read().replace('\\\n', '')
+    result = dict()
+    for m in re.finditer(r'^(\w+)="([^"]*)"', text, re.M):
+        result[m.group(1)] = m.group(2)
+    for m in re.finditer(r'^declare -A (\w+)=\((.*?)^\)', text, re.M|re.S):
+        result[m.group(1)] = dict(re.findall(r'\[([^\]]*)\]="([^"]*)"', m.group(2)))
+    p.vprint(1, "Done, %d variables." % len(result))
+    return result
+#}}}
+
 # PARSERS {{{
 # Fasta {{{
 # Converts lines of Fasta file into a list of tuples (header, sequence).
 # The leading '>' is removed from header line.
 # Default length of sequence lines in unparser == 80.
+# 'iterFasta' and 'writeFasta' do the same directly with (possibly gzipped) files, one entry
+# at a time, so that genome-sized files are never loaded as a whole.
 #
 Fasta = namedtuple("Fasta", "header sequence")
+def _fastaEntries(lines, nr_warnings): # Fasta lines ==> generator of Fasta tuples {{{
+    """Common part of 'parseFasta' and 'iterFasta'.
+    'lines' is any iterable of lines without trailing whitespaces.
+    Sequence lines of an entry are collected in a list and joined once.
+    'nr_warnings' is a list with a single integer, it is incremented for each skipped line.
+    """
+    header = None
+    seqlines = []
+    for (i,line) in enumerate(lines):
+        if line.startswith('>'):
+            if header is not None:
+                yield Fasta(header=header, sequence="".join(seqlines))
+            header = line[1:]
+            seqlines = []
+        elif header is None:
+            p.vprint(2, "WARNING: line %d is not a header: %s" % (i,line))
+            nr_warnings[0] += 1
+        else:
+            seqlines.append(line)
+    if header is not None:
+        yield Fasta(header=header, sequence="".join(seqlines))
+#}}}
+@cached
 def parseFasta(lines): # Fasta lines ==> list of Fasta tuples {{{
     """Parse contents of fasta file given by lines.
+    'lines' is a list of lines, or a name of (possibly gzipped) file; parsed files are cached
+            (see 'cached').
     Returns list of  namedtuple("Fasta", "header sequence")
     (header -- fasta header without '>', sequence -- sequence, lines concatenated).
     """
+    if isinstance(lines, basestring):
+        return list(iterFasta(lines))
     p.vprint(1, "Parsing Fasta...")
-    result = []
-    nn = len(lines)
-    i = 0
-    nr_warnings = 0
-    while i < nn:
-        if not lines[i].startswith('>'):
-            p.vprint(2, "WARNING: line %d is not a header: %s" % (i,lines[i]))
-            nr_warnings +=1
-            i += 1
-        else:
-            header = lines[i][1:]
-            sequence = ""
-            i += 1
-            while i<nn and not lines[i].startswith('>'):
-                sequence += lines[i]
-                i += 1
-            result.append( Fasta(header=header, sequence=sequence) )
-    p.vprint(1, "Done, %d entries (%d warnings)." % (len(result),nr_warnings))
+    nr_warnings = [0]
+    result = list(_fastaEntries(lines, nr_warnings))
+    p.vprint(1, "Done, %d entries (%d warnings)." % (len(result),nr_warnings[0]))
     return result
 #}}}
+def iterFasta(filename): # Fasta file ==> generator of Fasta tuples {{{
+    """Read (possibly gzipped) fasta file entry by entry.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+    Yields namedtuple("Fasta", "header sequence"), like elements of 'parseFasta' result.
+    Only the current entry is kept in memory.
+    """
+    fpath = resolvePath(filename)
+    p.vprint(1, "Reading Fasta %s..." % fpath)
+    nr_entries = 0
+    nr_warnings = [0]
+    with openFile(fpath, 'r') as f:
+        for fasta in _fastaEntries((line.strip() for line in f), nr_warnings):
+            nr_entries += 1
+            yield fasta
+    p.vprint(1, "Done, %d entries (%d warnings)." % (nr_entries,nr_warnings[0]))
+#}}}
 def unparseFasta(fasta_tuples, line_length=80): # List of Fasta tuples ==> Fasta lines {{{
     p.vprint(1, "Unparsing Fasta...")
     lines = []
@@ -459,6 +1304,507 @@ def unparseFasta(fasta_tuples, line_length=80): # List of Fasta tuples ==> Fasta
     p.vprint(1, "Done, %d entries ==> %d lines" % (len(fasta_tuples),len(lines)))
     return lines
 #}}}
+def writeFasta(filename, fasta_tuples, line_length=80): # Fasta tuples ==> Fasta file {{{
+    """Write Fasta tuples to (possibly gzipped) file.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+                If it ends with ".gz", the file is gzipped.
+    'fasta_tuples' is any iterable of Fasta tuples (for example, 'iterFasta' generator);
+                   entries are written as they come.
+    Returns the number of written entries.
+    """
+    fpath = resolvePath(filename)
+    p.vprint(1, "Writing Fasta %s..." % fpath)
+    nr_entries = 0
+    with openFile(fpath, 'w') as f:
+        for fasta in fasta_tuples:
+            seq = fasta.sequence
+            f.write('>' + fasta.header + '\n')
+            for i in xrange(0, len(seq), line_length):
+                f.write(seq[i:i+line_length] + '\n')
+            nr_entries += 1
+    p.vprint(1, "Done, %d entries." % nr_entries)
+    return nr_entries
+#}}}
+#}}}
+
+# Indexed Fasta {{{
+# Random access to sequences of an uncompressed fasta file through samtools-compatible index
+# ("file.fa.fai"; one line per entry: name, length, offset, line-bases, line-width).
+# The fasta file is mapped to memory, so fetching a region reads only the pages it covers;
+# the mapping is shared by all processes working with the same file.
+#
+FaiEntry = namedtuple("FaiEntry", "name length offset linebases linewidth")
+def buildFastaIndex(filename, fai_filename=None): # Fasta file ==> .fai file {{{
+    """Build samtools-compatible index of (uncompressed) fasta file.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+    'fai_filename' is the index file; by default, it is 'filename' + ".fai".
+    All sequence lines of an entry, except the last one, must have the same length; empty lines
+    are allowed only before the first and after the last sequence line.
+    Returns the list of FaiEntry tuples.
+    """
+    fpath = resolvePath(filename)
+    fai_path = fpath + ".fai" if fai_filename is None else resolvePath(fai_filename)
+    if isGzipped(fpath):
+        raise Exception("Cannot index gzipped fasta file %s" % fpath)
+    p.vprint(1, "Indexing Fasta %s..." % fpath)
+    entries = []
+    def addEntry():
+        if name is not None:
+            entries.append( FaiEntry(name, length, offset, linebases, linewidth) )
+    name = None
+    pos = 0
+    with open(fpath, 'rb', io_buffer_size) as f:
+        for line in f:
+            if line.startswith('>'):
+                addEntry()
+                name = line[1:].split(None,1)[0] if line[1:].strip() else ""
+                (length, offset, linebases, linewidth) = (0, pos+len(line), 0, 0)
+                last_line = False
+            elif name is not None:
+                nbases = len(line.rstrip('\r\n'))
+                if linebases==0 and nbases==0:
+                    # Empty lines before the first sequence line are not part of the layout
+                    offset = pos+len(line)
+                elif linebases==0:
+                    (linebases, linewidth) = (nbases, len(line))
+                elif last_line or nbases>linebases:
+                    if nbases>0:
+                        raise Exception("Different line lengths in entry '%s' of fasta file %s"
+                                        % (name, fpath))
+                elif nbases<linebases:
+                    last_line = True
+                length += nbases
+            pos += len(line)
+        addEntry()
+    with open(fai_path, 'w') as f:
+        for e in entries:
+            f.write("%s\t%d\t%d\t%d\t%d\n" % e)
+    p.vprint(1, "Done, %d entries." % len(entries))
+    return entries
+#}}}
+def loadFastaIndex(fai_filename): # .fai file ==> list of FaiEntry tuples {{{
+    fields = [ line.split('\t') for line in loadLines(fai_filename) if line!="" ]
+    return [ FaiEntry(_f[0], *map(int, _f[1:5])) for _f in fields ]
+#}}}
+class FastaFile(object): #{{{
+    """Random access to the sequences of (uncompressed) fasta file.
+    The index ('filename' + ".fai") is built if it does not exist or is older than the file.
+    Usage:
+        fa = FastaFile("path/to/genome.fa")
+        fa.fetch("chr1", 1000000, 1000100)  # 100 bases, coordinates are 0-based, end excluded
+    Objects may be passed to worker processes (multiprocessing); each process maps the file
+    to memory on the first 'fetch'.
+    """
+    def __init__(self, filename):
+        self.path = resolvePath(filename)
+        fai_path = self.path + ".fai"
+        if ( not os.path.isfile(fai_path) or
+             os.path.getmtime(fai_path) < os.path.getmtime(self.path) ):
+            entries = buildFastaIndex(self.path, fai_path)
+        else:
+            entries = loadFastaIndex(fai_path)
+        self.names = [ _e.name for _e in entries ]
+        self.index = dict([ (_e.name,_e) for _e in entries ])
+        self._mm = None
+        self._pid = None
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_mm"] = None
+        state["_pid"] = None
+        return state
+    def __contains__(self, seqid):
+        return seqid in self.index
+    def __len__(self):
+        return len(self.names)
+    def length(self, seqid):
+        return self.index[seqid].length
+    def _mmap(self):
+        if self._mm is None or self._pid!=os.getpid():
+            with open(self.path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._pid = os.getpid()
+        return self._mm
+    def fetch(self, seqid, start=0, end=None):
+        """Returns sequence[start:end] of the entry 'seqid' (without line breaks).
+        Like in Python slicing, coordinates are 0-based and 'end' is excluded;
+        'end'==None means the end of the sequence.
+        """
+        e = self.index[seqid]
+        end = e.length if end is None else min(end, e.length)
+        start = max(start, 0)
+        if start >= end:
+            return ""
+        def byteOffset(pos):
+            return e.offset + (pos // e.linebases) * e.linewidth + pos % e.linebases
+        seq = self._mmap()[byteOffset(start):byteOffset(end)]
+        if e.linewidth > e.linebases:
+            seq = seq.replace('\n','').replace('\r','')
+        return seq
+    def close(self):
+        if self._mm is not None and self._pid==os.getpid():
+            self._mm.close()
+        self._mm = None
+#}}}
+#}}}
+
+# Fastq {{{
+# Fastq files are read in batches: a batch keeps a block of complete records as one string
+# and NumPy arrays with offsets of names, sequences and qualities in this string, instead of
+# Python objects for each read.  Records must have 4 lines (no line wrapping), as written by
+# Illumina software.  Names are stored without the leading '@'.
+#
+class FastqBatch(object): #{{{
+    """Batch of Fastq records stored in one string.
+    'data' is the string with complete records;
+    'starts' -- int64 array, offset of each record (its '@') in 'data';
+    'name_ends', 'seq_starts', 'qual_starts' -- int64 arrays of offsets in 'data';
+    'lengths' -- int64 array of sequence lengths (== quality lengths).
+    """
+    __slots__ = ("data", "starts", "name_ends", "seq_starts", "qual_starts", "lengths")
+    def __init__(self, data, newlines=None):
+        """'data' must consist of complete records; 'newlines' (int64 array of positions of
+        all '\\n' in 'data') is computed if not given.
+        """
+        if newlines is None:
+            newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8)==10)
+        if len(newlines) % 4 != 0:
+            raise Exception("Incomplete Fastq record")
+        nl = newlines.reshape(-1, 4)
+        self.data = data
+        self.starts = np.empty(len(nl), dtype=np.int64)
+        self.starts[:1] = 0
+        self.starts[1:] = nl[:-1,3] + 1
+        self.name_ends = nl[:,0].astype(np.int64)
+        self.seq_starts = self.name_ends + 1
+        self.qual_starts = nl[:,2] + 1
+        self.lengths = nl[:,1] - self.seq_starts
+        buf = np.frombuffer(data, dtype=np.uint8)
+        if len(nl) > 0 and ( (buf[self.starts]!=ord('@')).any() or
+                             (buf[nl[:,1]+1]!=ord('+')).any() or
+                             (nl[:,3]-self.qual_starts!=self.lengths).any() ):
+            raise Exception("Invalid Fastq record")
+    def __len__(self):
+        return len(self.starts)
+    def name(self, i):
+        return self.data[self.starts[i]+1:self.name_ends[i]]
+    def seq(self, i):
+        return self.data[self.seq_starts[i]:self.seq_starts[i]+self.lengths[i]]
+    def qual(self, i):
+        return self.data[self.qual_starts[i]:self.qual_starts[i]+self.lengths[i]]
+    def records(self):
+        """Generator of (name, sequence, quality) tuples."""
+        for i in xrange(len(self.starts)):
+            yield (self.name(i), self.seq(i), self.qual(i))
+    def buffer(self):
+        """'data' as NumPy uint8 array (no copy), to be indexed by offset arrays."""
+        return np.frombuffer(self.data, dtype=np.uint8)
+    @staticmethod
+    def fromRecords(records):
+        """Make batch from (name, sequence, quality) tuples."""
+        return FastqBatch("".join([ "@%s\n%s\n+\n%s\n" % _r for _r in records ]))
+#}}}
+def iterFastqBatches(filename, batch_size=io_buffer_size): # Fastq file ==> FastqBatch objects {{{
+    """Read (possibly gzipped) Fastq file in batches of approximately 'batch_size' bytes.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+    Multi-member gzip files (like concatenated lanes) are read completely.
+    Yields FastqBatch objects.
+    """
+    fpath = resolvePath(filename)
+    p.vprint(1, "Reading Fastq %s..." % fpath)
+    nr_records = 0
+    rest = ""
+    with openFile(fpath, 'r') as f:
+        while True:
+            chunk = f.read(batch_size)
+            if chunk=="":
+                break
+            data = rest + chunk
+            newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8)==10)
+            nr_lines = len(newlines) - len(newlines) % 4
+            if nr_lines==0:
+                rest = data
+                continue
+            end = newlines[nr_lines-1] + 1
+            rest = data[end:]
+            batch = FastqBatch(data[:end], newlines[:nr_lines])
+            nr_records += len(batch)
+            yield batch
+    if rest.strip()!="":
+        batch = FastqBatch(rest if rest.endswith('\n') else rest+'\n')
+        nr_records += len(batch)
+        yield batch
+    p.vprint(1, "Done, %d records." % nr_records)
+#}}}
+def iterFastq(filename, batch_size=io_buffer_size): # Fastq file ==> (name, seq, qual) tuples {{{
+    """Read (possibly gzipped) Fastq file record by record.
+    Yields (name, sequence, quality) tuples; see 'iterFastqBatches'.
+    """
+    for batch in iterFastqBatches(filename, batch_size):
+        for record in batch.records():
+            yield record
+#}}}
+class FastqWriter(object): #{{{
+    """Buffered writer of (possibly gzipped) Fastq file.
+    Usage:
+        with FastqWriter("path/to/file.fq.gz") as fw:
+            fw.write(name, seq, qual)       # name without '@'
+            fw.writeBatch(batch)            # whole FastqBatch, or
+            fw.writeBatch(batch, selected)  # records selected by index array or boolean mask
+    The file is gzipped if its name ends with '.gz'.
+    """
+    def __init__(self, filename, buffer_size=io_buffer_size):
+        self.path = resolvePath(filename)
+        self.f = openFile(self.path, 'w', buffer_size)
+        self.nr_records = 0
+    def write(self, name, seq, qual):
+        self.f.write("@%s\n%s\n+\n%s\n" % (name, seq, qual))
+        self.nr_records += 1
+    def writeBatch(self, batch, selected=None):
+        if selected is None:
+            self.f.write(batch.data)
+            self.nr_records += len(batch)
+            return
+        selected = np.asarray(selected)
+        if selected.dtype==np.bool_:
+            selected = np.flatnonzero(selected)
+        ends = batch.qual_starts + batch.lengths + 1
+        data = batch.data
+        self.f.write( "".join([ data[batch.starts[_i]:ends[_i]] for _i in selected ]) )
+        self.nr_records += len(selected)
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+#}}}
+#}}}
+
+# SAM {{{
+# SAM files are read in batches of records ('iterSamBatches'): fields needed by alignment analyses
+# are decoded into NumPy arrays at once, aligned blocks (reference intervals of CIGAR operations
+# M, =, X) are kept in CSR form ('block_offsets' into 'block_starts'/'block_ends'), and optional
+# tags are kept as raw strings and parsed only when requested ('SamBatch.tag').
+# 'samChunks' splits a file into byte ranges for parallel workers; alignments of one read (mates,
+# multiple alignments) are never separated, neither between ranges nor between batches.
+#
+sam_cigar_re = re.compile(r"(\d+)([MIDNSHP=X])")
+sam_cigar_ops = "MIDNSHP=X"
+sam_op_index = np.full(256, -1, dtype=np.int64)                        # letter --> operation
+sam_op_index[np.frombuffer(sam_cigar_ops, dtype=np.uint8)] = np.arange(len(sam_cigar_ops))
+sam_block_ops = np.array([ _op in "M=X" for _op in sam_cigar_ops ])      # aligned blocks
+sam_ref_ops = np.array([ _op in "MDN=X" for _op in sam_cigar_ops ])      # consume reference
+sam_batch_size = 200000
+
+def samReferences(filename): #{{{
+    """List of reference names (@SQ SN:...) from the header of SAM file."""
+    names = []
+    with open(resolvePath(filename), 'rb') as f:
+        for line in f:
+            if not line.startswith('@'):
+                break
+            if line.startswith("@SQ"):
+                for field in line.rstrip('\r\n').split('\t')[1:]:
+                    if field.startswith("SN:"):
+                        names.append(field[3:])
+    return names
+#}}}
+
+def samChunks(filename, chunk_size=64*1024*1024): #{{{
+    """Split SAM file into byte ranges of approximately 'chunk_size' bytes.
+    Each range starts at the beginning of a line, and consecutive lines with the same read name
+    (alignments of one read, mates) are never split between ranges.
+    Returns list of (start, end) tuples.
+    """
+    fpath = resolvePath(filename)
+    size = os.path.getsize(fpath)
+    bounds = [ 0 ]
+    with open(fpath, 'rb') as f:
+        pos = chunk_size
+        while pos < size:
+            # Move to the start of the next line, then to the first line of the next read
+            f.seek(pos-1)
+            f.readline()
+            qname = f.readline().split('\t',1)[0]
+            while True:
+                pos = f.tell()
+                line = f.readline()
+                if line=="" or line.split('\t',1)[0]!=qname:  break
+            if pos >= size:  break
+            bounds.append(pos)
+            pos += chunk_size
+    bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+#}}}
+
+class SamBatch(object): #{{{
+    """Batch of SAM records (header lines excluded).
+    'qnames' -- list of read names;
+    'flags' -- int64 array; 'refids' -- int32 array of indices in 'refnames' (-1 for '*');
+    'pos' -- int64 array, 0-based leftmost position (-1 for unaligned records);
+    'mapq' -- int64 array; 'strands' -- int8 array, -1 if flag 0x10 (reverse) is set, +1 otherwise;
+    'mate_refids' -- int32 array, reference of the mate (RNEXT; -1 for '*');
+    'tlen' -- int64 array, observed template length (TLEN);
+    'cigars' -- list of CIGAR strings;
+    'block_offsets' -- int64 array, blocks of i-th record are [block_offsets[i]:block_offsets[i+1]]
+                       in 'block_starts' and 'block_ends' (int64 arrays, 0-based, end excluded);
+    'refnames' -- list of reference names (shared by all batches of a file).
+    """
+    def __init__(self, lines, refnames, refids): #{{{
+        """'lines' are complete SAM records without '\\n'; 'refids' maps reference name
+        to its index in 'refnames'; unknown names are added to both.
+        """
+        fields = [ _l.split('\t', 11) for _l in lines ]
+        n = len(fields)
+        self.refnames = refnames
+        self.qnames = [ _f[0] for _f in fields ]
+        if n==0:
+            self.flags = self.pos = self.mapq = self.tlen = np.zeros(0, dtype=np.int64)
+            self.refids = self.mate_refids = np.zeros(0, dtype=np.int32)
+            self.strands = np.zeros(0, dtype=np.int8)
+            self.cigars = self.tags_raw = []
+            self.block_offsets = np.zeros(1, dtype=np.int64)
+            self.block_starts = self.block_ends = np.zeros(0, dtype=np.int64)
+            self._tags = {}
+            return
+        # Parse integer fields by NumPy at once: FLAG, POS, MAPQ, TLEN of each record
+        numbers = np.fromstring(" ".join([ " ".join((_f[1], _f[3], _f[4], _f[8])) for _f in fields ]),
+                                dtype=np.int64, sep=' ').reshape(n, 4)
+        self.flags = numbers[:,0].copy()
+        for rname in set([ _f[2] for _f in fields ]) | set([ _f[6] for _f in fields ]):
+            if rname not in refids and rname!='*' and rname!='=':
+                refids[rname] = len(refnames)
+                refnames.append(rname)
+        self.refids = np.array([ refids.get(_f[2], -1) for _f in fields ], dtype=np.int32)
+        self.mate_refids = np.array([ refids.get(_f[6], -2 if _f[6]=='=' else -1) for _f in fields ],
+                                    dtype=np.int32)
+        same_ref = self.mate_refids==-2                                 # RNEXT '='
+        self.mate_refids[same_ref] = self.refids[same_ref]
+        self.pos = numbers[:,1] - 1
+        self.mapq = numbers[:,2].copy()
+        self.tlen = numbers[:,3].copy()
+        self.strands = np.where(self.flags & 0x10, -1, 1).astype(np.int8)
+        self.cigars = [ _f[5] for _f in fields ]
+        self.tags_raw = [ _f[11] if len(_f) > 11 else "" for _f in fields ]
+        self._tags = {}
+        self.decodeCigars()
+    #}}}
+
+    def decodeCigars(self): #{{{
+        """Compute aligned blocks of all records from CIGAR strings at once."""
+        n = len(self.cigars)
+        joined = "".join(self.cigars)
+        ops = sam_cigar_re.findall(joined)
+        # Number of operations of each record: operation letters in its CIGAR string
+        codes = np.frombuffer(joined, dtype=np.uint8)
+        op_ends = np.cumsum(sam_op_index[codes] >= 0)
+        bounds = np.cumsum([ len(_c) for _c in self.cigars ])
+        nr_ops = np.diff(np.concatenate([ [0], op_ends[bounds-1] ]))
+        if len(ops)==0:
+            self.block_offsets = np.zeros(n+1, dtype=np.int64)
+            self.block_starts = self.block_ends = np.zeros(0, dtype=np.int64)
+            return
+        lengths = np.fromstring(" ".join([ _l for (_l, _op) in ops ]), dtype=np.int64, sep=' ')
+        op_codes = sam_op_index[np.frombuffer("".join([ _op for (_l, _op) in ops ]), dtype=np.uint8)]
+        records = np.repeat(np.arange(n), nr_ops)
+        # Reference position of each operation: record position + reference consumed before it
+        consumed = np.where(sam_ref_ops[op_codes], lengths, 0)
+        before = np.cumsum(consumed) - consumed
+        first_op = np.cumsum(nr_ops) - nr_ops
+        op_pos = self.pos[records] + before - np.repeat(before[np.minimum(first_op, len(ops)-1)], nr_ops)
+        is_block = sam_block_ops[op_codes]
+        self.block_starts = op_pos[is_block]
+        self.block_ends = self.block_starts + lengths[is_block]
+        self.block_offsets = np.zeros(n+1, dtype=np.int64)
+        self.block_offsets[1:] = np.cumsum(np.bincount(records[is_block], minlength=n))
+    #}}}
+
+    def __len__(self):
+        return len(self.qnames)
+
+    def blocks(self, i): #{{{
+        """List of (start, end) aligned blocks of i-th record."""
+        (lo, hi) = (self.block_offsets[i], self.block_offsets[i+1])
+        return zip(self.block_starts[lo:hi].tolist(), self.block_ends[lo:hi].tolist())
+    #}}}
+
+    def tag(self, name, default=None): #{{{
+        """Values of optional tag 'name' (like "NH") of all records: int64 array for integer
+        tags (type 'i') if 'default' is an integer, list of strings otherwise; 'default' is used
+        for records without the tag.  Values are parsed on the first request and kept.
+        """
+        key = (name, default)
+        if key not in self._tags:
+            prefix = name + ':'
+            values = []
+            for tags in self.tags_raw:
+                i = tags.find(prefix)
+                while i > 0 and tags[i-1]!='\t':
+                    i = tags.find(prefix, i+1)
+                if i < 0:
+                    values.append(default)
+                else:
+                    j = tags.find('\t', i)
+                    values.append(tags[i+len(prefix)+2:] if j < 0 else tags[i+len(prefix)+2:j])
+            if isinstance(default, (int, long)):
+                parsed = np.fromstring(" ".join(map(str, values)), dtype=np.int64, sep=' ')
+                if len(parsed)!=len(values):   # parsing stops at the first non-integer
+                    raise ValueError("Tag %s has non-integer values in SAM records." % name)
+                values = parsed
+            self._tags[key] = values
+        return self._tags[key]
+    #}}}
+#}}}
+
+def iterSamBatches(filename, start=0, end=None, batch_size=sam_batch_size): # SAM file ==> SamBatch objects {{{
+    """Read SAM file (or byte range [start, end) of it, see 'samChunks') in batches of about
+    'batch_size' records.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+    Header lines are skipped; reference names are taken from the header even when reading
+    a range.  A batch never ends inside a group of consecutive records with the same read name.
+    """
+    fpath = resolvePath(filename)
+    if end is None:
+        end = os.path.getsize(fpath)
+    refnames = samReferences(fpath)
+    refids = dict([ (_n, _i) for (_i, _n) in enumerate(refnames) ])
+    lines = []
+    rest = ""
+    with open(fpath, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            data = f.read(min(io_buffer_size, end-pos))
+            if data=="":
+                break
+            pos += len(data)
+            new_lines = (rest + data).split('\n')
+            rest = new_lines.pop()
+            lines.extend([ _l for _l in new_lines if _l!="" and not _l.startswith('@') ])
+            if len(lines) >= batch_size:
+                # Keep the last group of records with the same read name for the next batch
+                qname = lines[-1].split('\t', 1)[0] + '\t'
+                i = len(lines) - 1
+                while i > 0 and lines[i-1].startswith(qname):
+                    i -= 1
+                if i > 0:
+                    yield SamBatch(lines[:i], refnames, refids)
+                    lines = lines[i:]
+    if rest!="" and not rest.startswith('@'):
+        lines.append(rest)
+    if len(lines) > 0:
+        yield SamBatch(lines, refnames, refids)
+#}}}
 #}}}
 
 # GFF3 (limited) {{{
@@ -483,6 +1829,7 @@ gff_attrs  = 8
 gff_id     = 9
 #}}}
 Gff = namedtuple("Gff", "seqid source gfftype start end score strand phase attrs gffid")
+@cached
 def parseGffGenes(lines): # GFF lines ==> list of gff-genes (==list of Gff tuples) {{{
     """Parse contents of gff file given by lines.
     Works for gff files describing genes:
@@ -491,15 +1838,20 @@ def parseGffGenes(lines): # GFF lines ==> list of gff-genes (==list of Gff tuple
      -- if the source GFF file contains multiple "mRNA" lines in one "gene" section, multiple
         "gff-genes" are created (they have the same "gene" tuple).
      -- warns if the first line(s) is not gff_type=='gene'
+    'lines' is a list of lines, or a name of (possibly gzipped) file; parsed files are cached
+            (see 'cached').
     Returns list of genes, each gene is a list of gff lines, each line is a tuple of 10 strings.
     The 10th string, "id", is extracted from attributes.
     """
+    if isinstance(lines, basestring):
+        with openFile(lines, 'r') as f:
+            return parseGffGenes([ _l.rstrip('\n') for _l in f ])
     p.vprint(1, "Parsing GFF...")
     genes = []
     curr_gene = []
     nr_warnings = 0
     for (i,line) in enumerate(lines):
-        line1 = line.split('#',1)[0].strip()
+        line1 = (line.split('#',1)[0] if '#' in line else line).strip()
         if len(line1) > 0:  # not pure comment
             fields = line1.split('\t')
             if len(fields)!=9:
@@ -509,13 +1861,7 @@ def parseGffGenes(lines): # GFF lines ==> list of gff-genes (==list of Gff tuple
                 p.vprint(2, "WARNING: line %d before the first 'gene': %s" % (i,line))
                 nr_warnings += 1
             else:
-                gffid = ""
-                attrs = map(str.strip, fields[gff_attrs].split(';'))
-                for attr in attrs:
-                    if attr.startswith("ID="):
-                        gffid = attr[3:]
-                        break
-                fields.append(gffid)
+                fields.append( _gffAttr(fields[gff_attrs], "ID", False, "") )
                 fields_tuple = Gff(*fields)
                 if fields_tuple.gfftype=="gene":
                     if len(curr_gene)==1:
@@ -560,4 +1906,133 @@ def unparseGffGenes(gff_genes): # list of gff-genes (==list of Gff tuples) ==> G
     return lines
 #}}}
 #}}}
+
+# GFF3 and GTF, streaming {{{
+# 'iterGff' reads GFF3 or GTF file (possibly gzipped) line by line and yields "GffRecord"
+# objects.  A record keeps 8 first columns (start and end as integers) and the raw attribute
+# string; attributes are extracted only when requested ('attr' method), so that skipping or
+# counting features does not pay for parsing attributes of every line.
+# GTF attributes look like 'gene_id "G1"; transcript_id "T1";', GFF3 ones like 'ID=T1;Parent=G1'.
+#
+def _gffAttr(attrs, name, is_gtf, default=None): # Value of one attribute {{{
+    """Extract value of attribute 'name' from GFF3 ('is_gtf' is False) or GTF ('is_gtf' is True)
+    attribute string, without splitting the whole string.
+    Returns 'default' if the attribute is absent.
+    """
+    key = name + (' ' if is_gtf else '=')
+    i = attrs.find(key)
+    while i >= 0:
+        if i==0 or attrs[i-1] in "; \t":
+            start = i + len(key)
+            if is_gtf:
+                while attrs.startswith(' ', start):  start += 1
+                if attrs.startswith('"', start):
+                    end = attrs.find('"', start+1)
+                    return attrs[start+1:] if end<0 else attrs[start+1:end]
+            end = attrs.find(';', start)
+            value = (attrs[start:] if end<0 else attrs[start:end]).strip()
+            if not is_gtf and '%' in value:
+                value = urllib.unquote(value)
+            return value
+        i = attrs.find(key, i+1)
+    return default
+#}}}
+class GffRecord(object): #{{{
+    """One feature of GFF3 or GTF file.
+    'start' and 'end' are integers, 1-based and inclusive (as in the file);
+    other columns are strings; 'attrs' is the raw attribute column.
+    """
+    __slots__ = ("seqid", "source", "gfftype", "start", "end", "score", "strand", "phase",
+                 "attrs", "is_gtf")
+    def __init__(self, fields, is_gtf):
+        self.seqid = intern(fields[0])
+        self.source = intern(fields[1])
+        self.gfftype = intern(fields[2])
+        self.start = int(fields[3])
+        self.end = int(fields[4])
+        self.score = fields[5]
+        self.strand = intern(fields[6])
+        self.phase = fields[7]
+        self.attrs = fields[8]
+        self.is_gtf = is_gtf
+    def attr(self, name, default=None):
+        """Value of attribute 'name' ('default' if absent)."""
+        return _gffAttr(self.attrs, name, self.is_gtf, default)
+    def attributes(self):
+        """All attributes as map(name --> value); for repeated names the first value is kept."""
+        result = dict()
+        for item in self.attrs.split(';'):
+            item = item.strip()
+            if item=="":  continue
+            if self.is_gtf:
+                (name, _, value) = item.partition(' ')
+                value = value.strip().strip('"')
+            else:
+                (name, _, value) = item.partition('=')
+                if '%' in value:  value = urllib.unquote(value)
+            result.setdefault(name.strip(), value)
+        return result
+    @property
+    def gffid(self):
+        """Feature ID: 'ID' for GFF3; for GTF, 'gene_id' of genes, 'transcript_id' of transcripts,
+        and 'exon_id' (or, if absent, 'transcript_id') of other features.
+        """
+        if not self.is_gtf:
+            return self.attr("ID", "")
+        elif self.gfftype=="gene":
+            return self.attr("gene_id", "")
+        elif self.gfftype=="transcript":
+            return self.attr("transcript_id", "")
+        else:
+            return self.attr("exon_id") or self.attr("transcript_id", "")
+    def toGff(self):
+        """Convert to "Gff" tuple (used by 'parseGffGenes' and 'unparseGffGenes')."""
+        return Gff(self.seqid, self.source, self.gfftype, str(self.start), str(self.end),
+                   self.score, self.strand, self.phase, self.attrs, self.gffid)
+    def __repr__(self):
+        return "GffRecord(%s:%d-%d%s %s)" % (self.seqid, self.start, self.end, self.strand,
+                                            self.gfftype)
+#}}}
+def iterGff(filename, gfftypes=None, is_gtf=None): # GFF3/GTF file ==> generator of GffRecord {{{
+    """Read (possibly gzipped) GFF3 or GTF file feature by feature.
+    'filename'  "/path/to/file"     -- absolute,
+                "path/to/file"      -- relative to p.projdir,
+                "./path/to/file"    -- relative to the current directory
+    'gfftypes' is a collection of feature types (like ["gene","transcript","exon"]) to be yielded;
+               other lines are skipped without creating records. None means all types.
+    'is_gtf' selects attribute syntax; if None, it is detected from the file name extension
+             ('.gtf' or '.gff'/'.gff3', optionally followed by '.gz') or from the first feature.
+    Comments and '##' directives are skipped; reading stops at '##FASTA' directive.
+    """
+    fpath = resolvePath(filename)
+    p.vprint(1, "Reading GFF %s..." % fpath)
+    if is_gtf is None:
+        ext = os.path.splitext(fpath[:-3] if fpath.endswith(".gz") else fpath)[1].lower()
+        is_gtf = True if ext==".gtf" else False if ext in (".gff", ".gff3") else None
+    if gfftypes is not None:
+        gfftypes = frozenset(gfftypes)
+    nr_records = 0
+    nr_warnings = 0
+    with openFile(fpath, 'r') as f:
+        for (i,line) in enumerate(f):
+            if line.startswith('#'):
+                if line.startswith("##FASTA"):  break
+                continue
+            if '#' in line:
+                line = line.split('#',1)[0]
+            fields = line.rstrip().split('\t')
+            if len(fields)!=9:
+                if len(fields)>1 or fields[0]!="":
+                    p.vprint(2, "WARNING: line %d has %d fields: %s" % (i,len(fields),line))
+                    nr_warnings += 1
+                continue
+            if gfftypes is not None and fields[2] not in gfftypes:
+                continue
+            if is_gtf is None:
+                is_gtf = '"' in fields[8] or '=' not in fields[8]
+            nr_records += 1
+            yield GffRecord(fields, is_gtf)
+    p.vprint(1, "Done, %d records (%d warnings)." % (nr_records,nr_warnings))
+#}}}
+#}}}
 #}}}
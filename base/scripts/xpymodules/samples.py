@@ -0,0 +1,207 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module keeps the list of raw files of a project (rows of a file description, like
+"scripts/a_files.txt") together with indexes used by 'p_makefilelists.py':
+    sample name         --> rows of files of the sample
+    base filename       --> rows of files to be concatenated into this file
+Sample names join values of all parameters except special ones ("Batch", "Read", "file");
+base filenames also include "Read".  Both indexes keep the order of first appearance, and all
+operations take time linear in the number of files.
+
+'discoverFiles' makes such rows from names of Fastq files in a raw-data directory, as written by
+bcl2fastq ("Sample_S1_L001_R1_001.fastq.gz"); for such rows "Lane" is special too
+('discovered_special_parnames'), so lanes and chunks of a sample become one base filename.  Directories are listed by a pool of threads, and the listing is cached until
+modification times of directories change.
+"""
+
+import os
+import os.path
+import re
+import hashlib
+import cPickle
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+import params as p
+import rwfiles as rw
+
+
+special_parnames = set([ "Batch", "Read", "file" ])
+nosl_parnames = set([ "Read", "file" ])
+# Discovered files ('discoverFiles') also have "Lane", which a sample is split into
+discovered_special_parnames = special_parnames | set([ "Lane" ])
+discovered_nosl_parnames = nosl_parnames | set([ "Lane" ])
+
+class SampleRegistry(object): #{{{
+    """Rows of files (maps parname --> value) with indexes by sample name and by base filename.
+        reg = SampleRegistry(rows, parnames)
+        reg.addBasenames(".fastq.gz")
+        reg.samplenames, reg.basenames, reg.files(basename), reg.sampleRows(colnames)
+    'special' are parnames not used in sample names (default: 'special_parnames').
+    """
+    def __init__(self, rows, parnames, special=special_parnames): #{{{
+        self.rows = rows
+        self.parnames = parnames
+        self.special = special
+        self.samples = OrderedDict()        # sample name --> [ row ]
+        self.basefiles = OrderedDict()      # base filename --> [ row ]
+    #}}}
+
+    def addBasenames(self, ext): #{{{
+        """Add "SampleName", "Basefilename" and "Affyfilename" (sample name + 'ext') to each row
+        and build indexes.
+        """
+        base_parnames = [ _p for _p in self.parnames if _p not in self.special ]
+        file_parnames = base_parnames + (["Read"] if "Read" in self.parnames else [])
+        self.samples.clear()
+        self.basefiles.clear()
+        for row in self.rows:
+            samplename = '_'.join([ row[_p] for _p in base_parnames ])
+            filename = '_'.join([ row[_p] for _p in file_parnames ])
+            row["SampleName"] = samplename
+            row["Basefilename"] = filename
+            row["Affyfilename"] = samplename + ext
+            self.samples.setdefault(samplename, []).append(row)
+            self.basefiles.setdefault(filename, []).append(row)
+        p.vprint(1, "%d files, %d samples, %d base filenames." %
+                    (len(self.rows), len(self.samples), len(self.basefiles)))
+    #}}}
+
+    @property
+    def samplenames(self):
+        return self.samples.keys()
+    @property
+    def basenames(self):
+        return self.basefiles.keys()
+
+    def files(self, basename): #{{{
+        """Original files of 'basename', in the order of rows."""
+        return [ _r["file"] for _r in self.basefiles[basename] ]
+    #}}}
+
+    def sampleRows(self, colnames): #{{{
+        """Unique rows (maps colname --> value) of values of 'colnames', in the order of rows."""
+        seen = set()
+        result = []
+        for row in self.rows:
+            values = tuple([ row[_cn] for _cn in colnames ])
+            if values not in seen:
+                seen.add(values)
+                result.append( dict(zip(colnames, values)) )
+        return result
+    #}}}
+#}}}
+
+# Discovery of raw files {{{
+fastq_name = re.compile(r'\.(fastq|fq)(\.gz)?$')
+illumina_name = re.compile(r'^(?P<sample>.+?)(_S\d+)?_L(?P<lane>\d{3})_(?P<read>[RI][12])_(?P<chunk>\d{3})'
+                           r'\.(fastq|fq)(\.gz)?$')
+
+def parseIlluminaName(filename): #{{{
+    """Row (map parname --> value) with "file", "Sample", "Lane" and "Read" parsed from the name
+    of 'filename' (path relative to raw-data directory), like "Sample_S1_L001_R1_001.fastq.gz";
+    the sample number (S1) is dropped.  Read is "R1" or "R2", or "I1" or "I2" for index reads.
+    Returns None if the name does not match.
+    """
+    m = illumina_name.match(os.path.basename(filename))
+    if m is None:
+        return None
+    return { "file": filename, "Sample": m.group("sample"), "Lane": m.group("lane"),
+             "Read": m.group("read"), "chunk": m.group("chunk") }
+#}}}
+
+def listDir(path): #{{{
+    """(modification time, [ file name ], [ subdirectory name ]) of directory 'path'."""
+    files = []
+    subdirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            (subdirs if entry.is_dir() else files).append(entry.name)
+    else:
+        for name in os.listdir(path):
+            (subdirs if os.path.isdir(os.path.join(path, name)) else files).append(name)
+    return (os.stat(path).st_mtime, files, subdirs)
+#}}}
+
+def dirMtime(path): #{{{
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+#}}}
+
+def scanDir(raw_dir, nr_threads=16): #{{{
+    """List of all files under 'raw_dir' (paths relative to it, sorted).
+    Directories of each level are listed in parallel by 'nr_threads' threads.  The listing is
+    saved in the cache directory of rwfiles and reused while modification times of all
+    directories are the same (adding or removing a file changes the time of its directory).
+    """
+    raw_dir = rw.resolvePath(raw_dir)
+    cache_path = os.path.join(rw.makePath(rw.cache_dir),
+                              "listing.%s.pkl" % hashlib.md5(raw_dir).hexdigest())
+    pool = ThreadPool(nr_threads)
+    try:
+        if os.path.isfile(cache_path):
+            with open(cache_path, 'rb') as f:
+                (dir_mtimes, filenames) = cPickle.load(f)
+            dirs = sorted(dir_mtimes)
+            if pool.map(dirMtime, [ os.path.join(raw_dir, _d) for _d in dirs ]) == \
+               [ dir_mtimes[_d] for _d in dirs ]:
+                p.vprint(1, "Using cached listing of %s: %d files." % (raw_dir, len(filenames)))
+                return filenames
+        p.vprint(1, "Listing %s..." % raw_dir)
+        dir_mtimes = {}
+        filenames = []
+        level = [ "" ]
+        while len(level) > 0:
+            listings = pool.map(listDir, [ os.path.join(raw_dir, _d) for _d in level ])
+            next_level = []
+            for (d, (mtime, files, subdirs)) in zip(level, listings):
+                dir_mtimes[d] = mtime
+                filenames.extend([ os.path.join(d, _fn) for _fn in files ])
+                next_level.extend([ os.path.join(d, _sd) for _sd in subdirs ])
+            level = next_level
+    finally:
+        pool.close()
+        pool.join()
+    filenames.sort()
+    tmp_path = "%s.tmp%d" % (cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        cPickle.dump((dir_mtimes, filenames), f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, cache_path)
+    p.vprint(1, "Done, %d files in %d directories." % (len(filenames), len(dir_mtimes)))
+    return filenames
+#}}}
+
+def discoverFiles(raw_dir, nr_threads=16): #{{{
+    """Rows of Fastq files under 'raw_dir' with Illumina names (see 'parseIlluminaName'), sorted
+    by sample, read, lane and chunk, and the list of parnames.  Fastq files with other names are
+    skipped with a warning; index reads (I1, I2) and other files are ignored.
+    """
+    rows = []
+    for filename in scanDir(raw_dir, nr_threads):
+        if fastq_name.search(filename) is None:
+            continue
+        row = parseIlluminaName(filename)
+        if row is None:
+            p.vprint(0, "WARNING: not an Illumina file name, skipped: %s" % filename)
+        elif row["Read"].startswith("I"):
+            p.vprint(2, "Index reads skipped: %s" % filename)
+        else:
+            rows.append(row)
+    rows.sort(key=lambda _r: (_r["Sample"], _r["Read"], _r["Lane"], _r["chunk"], _r["file"]))
+    for row in rows:
+        del row["chunk"]
+    p.vprint(1, "Discovered %d Fastq files of %d samples." %
+                (len(rows), len(set([ _r["Sample"] for _r in rows ]))))
+    return (rows, [ "file", "Sample", "Lane", "Read" ])
+#}}}
+#}}}
@@ -0,0 +1,221 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module writes synthetic input files of given sizes for benchmarks (see p_benchmark.py):
+    file descriptions   -- "a_files" in txt (aligned columns), csv (tab-separated), xls and xlsx,
+                           as read by p_makefilelists.py: samples x 4 lanes x 2 reads x chunks
+    Fasta               -- random genome of a given size, split into chromosomes
+    GFF3 and GTF        -- genes (gene, mRNA and exon lines in GFF3; exon lines in GTF) placed
+                           on the chromosomes of the genome
+    Fastq               -- random reads
+    SAM                 -- alignments of reads to the genome (some spliced, some unaligned),
+                           single-end or paired-end, with NH tags, as written by STAR
+All files are deterministic for a given 'seed'.  'generate' writes a complete data set scaled
+by one number; its directory can be used as a project directory (file descriptions are in
+"scripts/", and "processedData/" is created, like in a project).
+"""
+
+import os
+import os.path
+import json
+import random
+
+import numpy as np
+
+import params as p
+import rwfiles as rw
+
+
+bases = np.frombuffer("ACGT", dtype=np.uint8)
+# Sizes of the data set of 'generate' for scale 1
+default_sizes = dict(nr_files=10000, nr_samples=100, genome_size=10000000, nr_chroms=8,
+                     nr_genes=5000, nr_reads=200000, read_length=100)
+xls_max_rows = 65000
+
+def fileListRows(nr_files, nr_samples): #{{{
+    """Rows of a file description like "a_files.txt": samples x lanes x reads x chunks
+    (at most 'nr_files' rows), and the list of parnames.
+    """
+    nr_chunks = max(-(-nr_files // (nr_samples*4*2)), 1)
+    rows = []
+    for i in range(nr_samples):
+        for lane in range(1, 5):
+            for read in ("R1", "R2"):
+                for chunk in range(1, nr_chunks+1):
+                    rows.append({ "file": "Sample_S%d/S%d_L%03d_%s_%03d.fastq.gz" %
+                                          (i, i, lane, read, chunk),
+                                  "Read": read, "Phenotype": "P%d" % (i % 7),
+                                  "Replicate": str(i), "Batch": str(lane) })
+    return (rows[:nr_files], ["file", "Read", "Phenotype", "Replicate", "Batch"])
+#}}}
+
+def writeFileLists(dirname, nr_files, nr_samples): #{{{
+    """Write the same file description ('fileListRows') as "dirname/a_files.txt", ".csv", ".xls"
+    (at most 'xls_max_rows' rows) and ".xlsx".  Returns the list of paths.
+    """
+    (rows, parnames) = fileListRows(nr_files, nr_samples)
+    path = os.path.join(rw.makePath(dirname), "a_files")
+    widths = [ max([ len(_pn) ] + [ len(_r[_pn]) for _r in rows ]) for _pn in parnames ]
+    rw.saveLines(path+".txt",
+                 [ "  ".join([ "%-*s" % (_w, _pn) for (_w, _pn) in zip(widths, parnames) ]).rstrip() ] +
+                 [ "  ".join([ "%-*s" % (_w, _r[_pn]) for (_w, _pn) in zip(widths, parnames) ]).rstrip()
+                   for _r in rows ])
+    rw.saveCSV(path+".csv", rows, parnames)
+    rw.saveExcel(path+".xls", rows[:xls_max_rows], parnames)
+    rw.saveExcel(path+".xlsx", rows, parnames)
+    return [ path+_ext for _ext in (".txt", ".csv", ".xls", ".xlsx") ]
+#}}}
+
+def writeFasta(filename, genome_size, nr_chroms=8, line_length=60, seed=1): #{{{
+    """Write random genome of 'genome_size' bases in 'nr_chroms' chromosomes ("chr1", ...).
+    Returns list of (name, length).
+    """
+    rs = np.random.RandomState(seed)
+    sizes = [ genome_size // nr_chroms ] * nr_chroms
+    sizes[0] += genome_size - sum(sizes)
+    chroms = [ ("chr%d" % (_i+1), _s) for (_i, _s) in enumerate(sizes) ]
+    with open(rw.resolvePath(filename), 'w') as f:
+        for (name, size) in chroms:
+            f.write(">%s synthetic\n" % name)
+            seq = bases[rs.randint(0, 4, size)].tostring()
+            for i in xrange(0, size, line_length):
+                f.write(seq[i:i+line_length])
+                f.write('\n')
+    return chroms
+#}}}
+
+def geneModels(chroms, nr_genes, seed=1): #{{{
+    """Random genes on chromosomes 'chroms' (list of (name, length)): list of
+    (chrom, strand, gene number, [ (exon start, exon end) ]) with 1-based inclusive coordinates,
+    sorted by chromosome and start.
+    """
+    rnd = random.Random(seed)
+    total = sum([ _s for (_, _s) in chroms ])
+    genes = []
+    for g in range(nr_genes):
+        # Chromosomes get genes in proportion to their lengths
+        x = rnd.randint(0, total-1)
+        for (chrom, size) in chroms:
+            if x < size:  break
+            x -= size
+        start = rnd.randint(1, max(size-20000, 1))
+        exons = []
+        pos = start
+        for e in range(rnd.randint(1, 8)):
+            end = min(pos + rnd.randint(50, 500), size)
+            exons.append( (pos, end) )
+            pos = end + rnd.randint(100, 2000)
+            if pos >= size:  break
+        genes.append( (chrom, rnd.choice("+-"), g, exons) )
+    order = dict([ (_n, _i) for (_i, (_n, _)) in enumerate(chroms) ])
+    genes.sort(key=lambda _g: (order[_g[0]], _g[3][0][0]))
+    return genes
+#}}}
+
+def writeGff(filename, genes, gtf=False): #{{{
+    """Write 'genes' (see 'geneModels') as GFF3 (gene, mRNA and exon lines) or as GTF (exon
+    lines with gene_id and transcript_id)."""
+    with open(rw.resolvePath(filename), 'w') as f:
+        if not gtf:
+            f.write("##gff-version 3\n")
+        for (chrom, strand, g, exons) in genes:
+            if gtf:
+                for (start, end) in exons:
+                    f.write('%s\tsynthetic\texon\t%d\t%d\t.\t%s\t.\tgene_id "G%06d"; transcript_id "T%06d";\n'
+                            % (chrom, start, end, strand, g, g))
+                continue
+            (start, end) = (exons[0][0], exons[-1][1])
+            f.write("%s\tsynthetic\tgene\t%d\t%d\t.\t%s\t.\tID=G%06d;Name=G%06d\n" %
+                    (chrom, start, end, strand, g, g))
+            f.write("%s\tsynthetic\tmRNA\t%d\t%d\t.\t%s\t.\tID=T%06d;Parent=G%06d\n" %
+                    (chrom, start, end, strand, g, g))
+            for (i, (es, ee)) in enumerate(exons):
+                f.write("%s\tsynthetic\texon\t%d\t%d\t.\t%s\t.\tID=E%06d.%d;Parent=T%06d\n" %
+                        (chrom, es, ee, strand, g, i+1, g))
+#}}}
+
+def writeFastq(filename, nr_reads, read_length=100, seed=1): #{{{
+    """Write 'nr_reads' random reads of 'read_length' bases with random qualities (Phred+33)."""
+    rs = np.random.RandomState(seed)
+    batch = 10000
+    with open(rw.resolvePath(filename), 'w') as f:
+        for first in xrange(0, nr_reads, batch):
+            n = min(batch, nr_reads-first)
+            seqs = bases[rs.randint(0, 4, n*read_length)].tostring()
+            quals = (rs.randint(2, 41, n*read_length) + 33).astype(np.uint8).tostring()
+            for i in xrange(n):
+                f.write("@read%d\n%s\n+\n%s\n" % (first+i, seqs[i*read_length:(i+1)*read_length],
+                                                  quals[i*read_length:(i+1)*read_length]))
+#}}}
+
+def writeSam(filename, chroms, nr_reads, read_length=100, paired=False, seed=1): #{{{
+    """Write alignments of 'nr_reads' reads (pairs if 'paired') to chromosomes 'chroms' (list of
+    (name, length)), records of a read on adjacent lines as STAR writes them: 5% unaligned,
+    20% spliced, 10% with NH:i:2 and MAPQ 3; mates are 0-400 bases apart.
+    """
+    rnd = random.Random(seed)
+    seq = "A" * read_length
+    qual = "I" * read_length
+    half = read_length // 2
+    def cigar():
+        if rnd.random() < 0.2:
+            return "%dM%dN%dM" % (half, rnd.randint(50, 5000), read_length-half)
+        return "%dM" % read_length
+    with open(rw.resolvePath(filename), 'w') as f:
+        f.write("@HD\tVN:1.4\n")
+        for (name, size) in chroms:
+            f.write("@SQ\tSN:%s\tLN:%d\n" % (name, size))
+        for i in xrange(nr_reads):
+            qname = "read%d" % i
+            if rnd.random() < 0.05:
+                for flag in ((77, 141) if paired else (4,)):
+                    f.write("%s\t%d\t*\t0\t0\t*\t*\t0\t0\t%s\t%s\n" % (qname, flag, seq, qual))
+                continue
+            (chrom, size) = chroms[rnd.randint(0, len(chroms)-1)]
+            pos = rnd.randint(1, max(size-10000, 1))
+            (nh, mapq) = (2, 3) if rnd.random() < 0.1 else (1, 255)
+            strand = rnd.randint(0, 1)
+            if not paired:
+                f.write("%s\t%d\t%s\t%d\t%d\t%s\t*\t0\t0\t%s\t%s\tNH:i:%d\n" %
+                        (qname, 16*strand, chrom, pos, mapq, cigar(), seq, qual, nh))
+                continue
+            mpos = pos + rnd.randint(0, 400)
+            tlen = mpos + read_length - pos
+            (flag1, flag2) = (99, 147) if strand==0 else (83, 163)
+            f.write("%s\t%d\t%s\t%d\t%d\t%s\t=\t%d\t%d\t%s\t%s\tNH:i:%d\n" %
+                    (qname, flag1, chrom, pos, mapq, cigar(), mpos, tlen, seq, qual, nh))
+            f.write("%s\t%d\t%s\t%d\t%d\t%s\t=\t%d\t%d\t%s\t%s\tNH:i:%d\n" %
+                    (qname, flag2, chrom, mpos, mapq, cigar(), pos, -tlen, seq, qual, nh))
+#}}}
+
+def generate(data_dir, scale=1.0, seed=1): #{{{
+    """Write a data set of sizes 'default_sizes' multiplied by 'scale' to 'data_dir':
+        scripts/a_files.{txt,csv,xls,xlsx}, genome.fa, genes.gff3, genes.gtf,
+        reads.fq, reads_se.sam, reads_pe.sam, and sizes.json (the sizes used).
+    Returns dict of sizes.
+    """
+    sizes = dict([ (_k, max(int(_v*scale), 1)) for (_k, _v) in default_sizes.items() ])
+    sizes["nr_chroms"] = default_sizes["nr_chroms"]
+    sizes["read_length"] = default_sizes["read_length"]
+    sizes["scale"] = scale
+    data_dir = rw.makePath(data_dir)
+    rw.makePath(os.path.join(data_dir, "processedData"))
+    p.vprint(1, "Generating data set of scale %g in %s..." % (scale, data_dir))
+    p.changeVL(p.vlevel-1)
+    writeFileLists(os.path.join(data_dir, "scripts"), sizes["nr_files"], sizes["nr_samples"])
+    chroms = writeFasta(os.path.join(data_dir, "genome.fa"), sizes["genome_size"],
+                        sizes["nr_chroms"], seed=seed)
+    genes = geneModels(chroms, sizes["nr_genes"], seed)
+    writeGff(os.path.join(data_dir, "genes.gff3"), genes)
+    writeGff(os.path.join(data_dir, "genes.gtf"), genes, gtf=True)
+    writeFastq(os.path.join(data_dir, "reads.fq"), sizes["nr_reads"], sizes["read_length"], seed)
+    writeSam(os.path.join(data_dir, "reads_se.sam"), chroms, sizes["nr_reads"],
+             sizes["read_length"], False, seed)
+    writeSam(os.path.join(data_dir, "reads_pe.sam"), chroms, sizes["nr_reads"] // 2,
+             sizes["read_length"], True, seed)
+    p.restoreVL()
+    with open(os.path.join(data_dir, "sizes.json"), 'w') as f:
+        json.dump(sizes, f, indent=1, sort_keys=True)
+    p.vprint(1, "Done.")
+    return sizes
+#}}}
@@ -0,0 +1,338 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+This module trims reads like TrimGalore (with cutadapt) does by default, working on whole
+FastqBatch objects with NumPy:
+    1. quality trimming of 3' ends (BWA algorithm, Phred score cutoff 20);
+    2. removal of 3' adapter: the leftmost position where the read (rest of it) matches
+       the beginning of the adapter, with at least 'stringency' bases of overlap and at most
+       'error_rate' mismatches per overlapping base (indels are not considered);
+    3. removal of reads (pairs of reads) shorter than 'min_length'.
+The adapter is auto-detected like TrimGalore does: the most frequent of Illumina, Nextera and
+small RNA adapters among the first reads of the (first) file.
+
+'trimFiles' processes one single-end file or a pair of files in one pass: trimmed reads are
+written to files named like TrimGalore names them ("name_trimmed.fq", "name_val_1.fq" and
+"name_val_2.fq"), with TrimGalore-style reports, and optionally FastQC-like QC statistics of
+the written reads are collected on the way ('fastqqc' module).
+"""
+
+import os
+import os.path
+import re
+import copy
+
+import numpy as np
+
+import params as p
+import rwfiles as rw
+import fastqqc
+
+
+# (name, sequence) of adapters detected automatically, in order of preference
+known_adapters = [ ("Illumina TruSeq, Sanger iPCR", "AGATCGGAAGAGC"),
+                   ("Nextera Transposase sequence", "CTGTCTCTTATA"),
+                   ("Illumina small RNA adapter", "TGGAATTCTCGG") ]
+detection_reads = 1000000
+
+class TrimParams(object): #{{{
+    """Trimming settings; defaults are those of TrimGalore."""
+    def __init__(self, quality=20, adapter=None, stringency=1, error_rate=0.1, min_length=20,
+                 phred_offset=33):
+        self.quality = quality
+        self.adapter = adapter          # None: auto-detect
+        self.adapter_name = None
+        self.stringency = stringency
+        self.error_rate = error_rate
+        self.min_length = min_length
+        self.phred_offset = phred_offset
+#}}}
+
+class TrimCounts(object): #{{{
+    """Counters for trimming report of one file."""
+    def __init__(self):
+        self.reads = 0
+        self.with_adapters = 0
+        self.written = 0
+        self.bases = 0
+        self.quality_trimmed = 0
+        self.bases_written = 0
+        self.removed_lengths = np.zeros(0, dtype=np.int64)    # count of removed adapter lengths
+    def addRemovedLengths(self, lengths):
+        counts = np.bincount(lengths)
+        if len(counts) > len(self.removed_lengths):
+            counts[:len(self.removed_lengths)] += self.removed_lengths
+            self.removed_lengths = counts
+        else:
+            self.removed_lengths[:len(counts)] += counts
+#}}}
+
+def detectAdapter(filename): #{{{
+    """(name, sequence) of the known adapter found most often in the first reads of Fastq file;
+    Illumina adapter if none is found.
+    """
+    counts = [ 0 ] * len(known_adapters)
+    nr_reads = 0
+    for batch in rw.iterFastqBatches(filename):
+        for (i, (_, seq)) in enumerate(known_adapters):
+            counts[i] += batch.data.count(seq)
+        nr_reads += len(batch)
+        if nr_reads >= detection_reads:
+            break
+    p.vprint(1, "Adapter counts: %s" % ", ".join([ "%s %d" % (_a[1],_c)
+                                                   for (_a,_c) in zip(known_adapters, counts) ]))
+    best = max(range(len(counts)), key=lambda _i: (counts[_i], -_i))
+    return known_adapters[best]
+#}}}
+
+def paddedMatrix(buf, starts, lengths, pad): #{{{
+    """uint8 matrix (n x max length) of 'lengths' bytes of 'buf' from each of 'starts',
+    padded by 'pad'.
+    """
+    width = int(lengths.max()) if len(lengths) > 0 else 0
+    cols = np.arange(width)
+    valid = cols[np.newaxis,:] < lengths[:,np.newaxis]
+    idx = np.where(valid, starts[:,np.newaxis] + cols[np.newaxis,:], 0)
+    return np.where(valid, buf[idx], pad)
+#}}}
+
+def qualityTrimLengths(batch, params): #{{{
+    """Lengths of reads after quality trimming of 3' ends (like cutadapt's BWA algorithm:
+    remove the suffix maximizing the sum of (cutoff - quality), stopping where it gets negative).
+    """
+    lengths = batch.lengths
+    if len(lengths)==0:
+        return lengths.copy()
+    # Qualities from the last base backwards; padding stops the sums
+    rev_starts = batch.qual_starts + lengths - 1
+    width = int(lengths.max())
+    cols = np.arange(width)
+    valid = cols[np.newaxis,:] < lengths[:,np.newaxis]
+    idx = np.where(valid, rev_starts[:,np.newaxis] - cols[np.newaxis,:], 0)
+    quals = batch.buffer()[idx].astype(np.int64) - params.phred_offset
+    scores = np.where(valid, params.quality - quals, -10**6)
+    sums = np.cumsum(scores, axis=1)
+    negative = sums < 0
+    first_negative = np.where(negative.any(axis=1), negative.argmax(axis=1), width)
+    sums[cols[np.newaxis,:] >= first_negative[:,np.newaxis]] = 0
+    best = sums.argmax(axis=1)
+    trimmed = sums[np.arange(len(lengths)), best] > 0
+    return np.where(trimmed, lengths - 1 - best, lengths)
+#}}}
+
+def adapterPositions(batch, lengths, params): #{{{
+    """Position of adapter in each read (considering only the first 'lengths' bases);
+    equal to the length if no adapter is found.
+    """
+    n = len(lengths)
+    positions = lengths.copy()
+    if n==0 or lengths.max()==0:
+        return positions
+    adapter = np.frombuffer(params.adapter, dtype=np.uint8)
+    alen = len(adapter)
+    seqs = paddedMatrix(batch.buffer(), batch.seq_starts, lengths, 0)
+    seqs = np.hstack([ seqs, np.zeros((n, alen), dtype=np.uint8) ])
+    width = int(lengths.max())
+    found = np.zeros(n, dtype=np.bool_)
+    for pos in xrange(width - params.stringency + 1):
+        overlap = np.minimum(lengths - pos, alen)
+        candidates = ~found & (overlap >= params.stringency)
+        if not candidates.any():
+            continue
+        window = seqs[candidates, pos:pos+alen]
+        ov = overlap[candidates]
+        in_overlap = np.arange(alen)[np.newaxis,:] < ov[:,np.newaxis]
+        mismatches = ((window!=adapter[np.newaxis,:]) & in_overlap).sum(axis=1)
+        matched = mismatches <= np.floor(ov * params.error_rate + 1e-9)
+        idx = np.flatnonzero(candidates)[matched]
+        positions[idx] = pos
+        found[idx] = True
+    return positions
+#}}}
+
+def trimLengths(batch, params, counts): #{{{
+    """Lengths of reads of 'batch' after quality and adapter trimming; updates 'counts'."""
+    qlengths = qualityTrimLengths(batch, params)
+    lengths = adapterPositions(batch, qlengths, params)
+    with_adapter = lengths < qlengths
+    counts.reads += len(batch)
+    counts.bases += int(batch.lengths.sum())
+    counts.quality_trimmed += int((batch.lengths - qlengths).sum())
+    counts.with_adapters += int(with_adapter.sum())
+    counts.addRemovedLengths((qlengths - lengths)[with_adapter])
+    return lengths
+#}}}
+
+def trimmedBatch(batch, lengths, selected): #{{{
+    """New FastqBatch with records 'selected' (index array) of 'batch', sequences and qualities
+    cut to 'lengths'; the '+' line is written without name.
+    """
+    data = batch.data + "\n+\n"
+    (plus_pos, nl_pos) = (len(batch.data), len(batch.data))
+    lens = lengths[selected]
+    name_lens = batch.name_ends[selected] - batch.starts[selected] + 1
+    n = len(selected)
+    # Five segments per record: "@name\n", sequence, "\n+\n", quality, "\n"
+    seg_starts = np.column_stack([ batch.starts[selected], batch.seq_starts[selected],
+                                   np.full(n, plus_pos, dtype=np.int64),
+                                   batch.qual_starts[selected], np.full(n, nl_pos, dtype=np.int64) ])
+    seg_lens = np.column_stack([ name_lens, lens, np.full(n, 3, dtype=np.int64), lens,
+                                 np.ones(n, dtype=np.int64) ])
+    (seg_starts, seg_lens) = (seg_starts.ravel(), seg_lens.ravel())
+    out_offsets = np.cumsum(seg_lens) - seg_lens
+    total = int(seg_lens.sum())
+    idx = np.arange(total) + np.repeat(seg_starts - out_offsets, seg_lens)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    return rw.FastqBatch(buf[idx].tostring())
+#}}}
+
+def pairedBatches(filename1, filename2): #{{{
+    """Generator of (batch1, batch2) with the same number of records from two Fastq files.
+    Raises Exception if the files have different numbers of records, or if read names
+    (without "/1", "/2" and comments) of the first records of batches differ.
+    """
+    def pairName(name):
+        return re.sub(r"/[12]$", "", name.split(None,1)[0]) if name else ""
+    def head(batch, start, k):
+        end = batch.starts[start+k] if start+k < len(batch) else len(batch.data)
+        return rw.FastqBatch(batch.data[batch.starts[start]:end])
+    it1 = rw.iterFastqBatches(filename1)
+    it2 = rw.iterFastqBatches(filename2)
+    (b1, o1, b2, o2) = (None, 0, None, 0)
+    while True:
+        if b1 is None or o1==len(b1):
+            (b1, o1) = (next(it1, None), 0)
+        if b2 is None or o2==len(b2):
+            (b2, o2) = (next(it2, None), 0)
+        if b1 is None or b2 is None:
+            if b1 is not None or b2 is not None:
+                raise Exception("Paired Fastq files have different numbers of reads: %s, %s"
+                                % (filename1, filename2))
+            return
+        k = min(len(b1)-o1, len(b2)-o2)
+        if pairName(b1.name(o1))!=pairName(b2.name(o2)):
+            raise Exception("Reads are not paired: %s and %s" % (b1.name(o1), b2.name(o2)))
+        yield (head(b1, o1, k), head(b2, o2, k))
+        (o1, o2) = (o1+k, o2+k)
+#}}}
+
+def outputName(filename, suffix): #{{{
+    """TrimGalore output name: base name without .gz, .fastq, .fq, followed by 'suffix'."""
+    name = os.path.basename(filename)
+    for ext in [ ".gz", ".fastq", ".fq" ]:
+        if name.endswith(ext):  name = name[:-len(ext)]
+    return name + suffix
+#}}}
+
+def saveReport(filename, input_filename, params, counts, mode, nr_removed, paired_note=False): #{{{
+    """Write TrimGalore-style trimming report."""
+    def pct(a, b):
+        return 100.0 * a / b if b > 0 else 0.0
+    lines = [ "",
+              "SUMMARISING RUN PARAMETERS",
+              "==========================",
+              "Input filename: %s" % os.path.basename(input_filename),
+              "Trimming mode: %s" % mode,
+              "Trim Galore version: p_trimqc.py (TrimGalore defaults)",
+              "Quality Phred score cutoff: %d" % params.quality,
+              "Quality encoding type selected: ASCII+%d" % params.phred_offset,
+              "Adapter sequence: '%s' (%s)" % (params.adapter, params.adapter_name or "user defined"),
+              "Maximum trimming error rate: %g" % params.error_rate,
+              "Minimum required adapter overlap (stringency): %d bp" % params.stringency ]
+    if mode=="paired-end":
+        lines.append("Minimum required sequence length for both reads before a sequence pair "
+                     "gets removed: %d bp" % params.min_length)
+    else:
+        lines.append("Minimum required sequence length before a sequence gets removed: %d bp"
+                     % params.min_length)
+    lines += [ "Output file will not be GZIP compressed",
+               "",
+               "=== Summary ===",
+               "",
+               "Total reads processed:           %12s" % format(counts.reads, ","),
+               "Reads with adapters:             %12s (%.1f%%)" %
+                    (format(counts.with_adapters, ","), pct(counts.with_adapters, counts.reads)),
+               "Reads written (passing filters): %12s (%.1f%%)" %
+                    (format(counts.written, ","), pct(counts.written, counts.reads)),
+               "",
+               "Total basepairs processed:       %12s bp" % format(counts.bases, ","),
+               "Quality-trimmed:                 %12s bp (%.1f%%)" %
+                    (format(counts.quality_trimmed, ","), pct(counts.quality_trimmed, counts.bases)),
+               "Total written (filtered):        %12s bp (%.1f%%)" %
+                    (format(counts.bases_written, ","), pct(counts.bases_written, counts.bases)),
+               "",
+               "=== Adapter ===",
+               "",
+               "Overview of removed sequences",
+               "length\tcount" ]
+    lines += [ "%d\t%d" % (_l,_c) for (_l,_c) in enumerate(counts.removed_lengths) if _c > 0 ]
+    lines.append("")
+    if mode=="paired-end":
+        if paired_note:
+            lines.append("Total number of sequences analysed for the sequence pair length "
+                         "validation: %d" % counts.reads)
+            lines.append("")
+            lines.append("Number of sequence pairs removed because at least one read was shorter "
+                         "than the length cutoff (%d bp): %d (%.2f%%)" %
+                         (params.min_length, nr_removed, pct(nr_removed, counts.reads)))
+    else:
+        lines.append("Sequences removed because they became shorter than the length cutoff of "
+                     "%d bp:\t%d (%.1f%%)" % (params.min_length, nr_removed, pct(nr_removed, counts.reads)))
+    rw.saveLines(filename, lines)
+#}}}
+
+def trimFiles(filenames, out_dir, params, qc_dir=None): #{{{
+    """Trim single-end Fastq file (one of 'filenames') or a pair of files (two 'filenames')
+    into 'out_dir'; if 'qc_dir' is given, FastQC-like reports of written reads are saved there.
+    Outputs are written under temporary names and renamed at the end.
+    Returns list of paths of trimmed files.
+    """
+    out_dir = rw.resolvePath(out_dir)
+    paired = len(filenames)==2
+    if params.adapter is None:
+        # Detected per call: 'params' may be shared by calls for other samples
+        params = copy.copy(params)
+        (params.adapter_name, params.adapter) = detectAdapter(filenames[0])
+        params.adapter_name += "; auto-detected"
+    p.vprint(1, "Trimming %s with adapter %s..." % (", ".join(filenames), params.adapter))
+    if paired:
+        out_paths = [ os.path.join(out_dir, outputName(filenames[0], "_val_1.fq")),
+                      os.path.join(out_dir, outputName(filenames[1], "_val_2.fq")) ]
+        batches = pairedBatches(*filenames)
+    else:
+        out_paths = [ os.path.join(out_dir, outputName(filenames[0], "_trimmed.fq")) ]
+        batches = ( (_b,) for _b in rw.iterFastqBatches(filenames[0]) )
+    tmp_paths = [ "%s.tmp%d" % (_op, os.getpid()) for _op in out_paths ]
+    writers = [ rw.FastqWriter(_tp) for _tp in tmp_paths ]
+    counts = [ TrimCounts() for _ in filenames ]
+    stats = [ fastqqc.FastqStats() for _ in filenames ]
+    nr_removed = 0
+    try:
+        for bs in batches:
+            lengths = [ trimLengths(_b, params, _c) for (_b,_c) in zip(bs, counts) ]
+            keep = np.ones(len(bs[0]), dtype=np.bool_)
+            for ls in lengths:
+                keep &= ls >= params.min_length
+            selected = np.flatnonzero(keep)
+            nr_removed += len(keep) - len(selected)
+            for (b, ls, w, c, st) in zip(bs, lengths, writers, counts, stats):
+                tb = trimmedBatch(b, ls, selected)
+                w.writeBatch(tb)
+                c.written += len(tb)
+                c.bases_written += int(tb.lengths.sum())
+                if qc_dir is not None:
+                    st.add(tb)
+    finally:
+        for w in writers:
+            w.close()
+    for (tp, op) in zip(tmp_paths, out_paths):
+        os.rename(tp, op)
+    for (i, fn) in enumerate(filenames):
+        saveReport(os.path.join(out_dir, os.path.basename(fn)+"_trimming_report.txt"), fn, params,
+                   counts[i], "paired-end" if paired else "single-end", nr_removed,
+                   paired_note=(i==1))
+        if qc_dir is not None:
+            fastqqc.saveReport(stats[i], out_paths[i], qc_dir)
+    p.vprint(1, "Done, %d of %d reads written." % (counts[0].written, counts[0].reads))
+    return out_paths
+#}}}
@@ -0,0 +1,167 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Concatenate source files (lanes) of each base filename into input files.
+See 'printUsage()' function.
+"""
+
+import sys
+import os
+import os.path
+import shutil
+import signal
+import subprocess
+import threading
+import argparse
+from multiprocessing.pool import ThreadPool
+
+import params as p
+import rwfiles as rw
+
+
+copy_buffer_size = 16*1024*1024
+modes = [ "gzip", "unzip", "fifo" ]
+
+global rawdata_dir
+global input_dir
+global bfn_to_fns       # map: base-filename --> [ source path ]
+global primary_ext
+global secondary_ext
+
+def loadFileList(): #{{{
+    global bfn_to_fns, primary_ext, secondary_ext
+    fl = rw.loadShellVars(os.path.join(p.projdir, "scripts", "g_filelist.sh"))
+    primary_ext = fl["PRIMARY_EXT"]
+    secondary_ext = fl["SECONDARY_EXT"]
+    bfn_to_fns = dict()
+    for bfn in fl["BASE_FILENAMES"].split():
+        bfn_to_fns[bfn] = [ os.path.join(rawdata_dir,_fn) for _fn in fl["BFN_TO_FNS"][bfn].split() ]
+#}}}
+
+def copyData(src, dst): #{{{
+    """Copy all data from file object 'src' to file object 'dst' without decompression,
+    by 'os.sendfile' if available, otherwise through a large buffer.
+    """
+    if hasattr(os, "sendfile"):
+        size = os.fstat(src.fileno()).st_size
+        offset = 0
+        while offset < size:
+            offset += os.sendfile(dst.fileno(), src.fileno(), offset, size-offset)
+    else:
+        shutil.copyfileobj(src, dst, copy_buffer_size)
+#}}}
+
+def joinGzipped(bfn): # Gzip members of all sources ==> one gzip file {{{
+    out_path = os.path.join(input_dir, bfn+primary_ext+secondary_ext)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as dst:
+        for src_path in bfn_to_fns[bfn]:
+            with open(src_path, 'rb') as src:
+                copyData(src, dst)
+    os.rename(tmp_path, out_path)
+    return 0
+#}}}
+
+def joinUnzipped(bfn): # Decompressed sources ==> one file {{{
+    out_path = os.path.join(input_dir, bfn+primary_ext)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as dst:
+        rc = subprocess.call(["zcat", "-f"] + bfn_to_fns[bfn], stdout=dst)
+    if rc==0:
+        os.rename(tmp_path, out_path)
+    return rc
+#}}}
+
+def serveFifo(bfn): # Stream decompressed sources to named pipe, each time it is opened {{{
+    fifo_path = os.path.join(input_dir, bfn+primary_ext)
+    while True:
+        with open(fifo_path, 'wb') as fifo:     # blocks until a reader opens the pipe
+            subprocess.call(["zcat", "-f"] + bfn_to_fns[bfn], stdout=fifo)
+#}}}
+
+def runFifoServer(): #{{{
+    """Create named pipes, then continue in a background process that feeds them.
+    Each pipe is served by its own thread and may be read multiple times (TrimGalore reads the
+    beginning of input files to detect adapters); the server runs until it is killed,
+    its PID is stored in 'input-dir/fifo_server.pid'.
+    """
+    for bfn in sorted(bfn_to_fns.keys()):
+        fifo_path = os.path.join(input_dir, bfn+primary_ext)
+        if os.path.exists(fifo_path):  os.remove(fifo_path)
+        os.mkfifo(fifo_path)
+    if os.fork() > 0:
+        return
+    os.setsid()
+    log = open(os.path.join(input_dir, "fifo_server.log"), 'w')
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)   # zcat must terminate if reader quits
+    rw.saveLines(os.path.join(input_dir, "fifo_server.pid"), [ str(os.getpid()) ])
+    threads = [ threading.Thread(target=serveFifo, args=(_bfn,)) for _bfn in bfn_to_fns ]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    signal.pause()
+#}}}
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_concatlanes.py  [-m mode]  [-j nr-jobs]  rawdata-dir  input-dir
+Concatenates source files of each base filename (see BFN_TO_FNS in scripts/g_filelist.sh).
+Modes:
+    gzip  -- (default) if all source files are gzipped, join them as gzip members without
+             decompression into input-dir/base-filename.PRIMARY_EXT.SECONDARY_EXT;
+             otherwise the same as 'unzip'
+    unzip -- decompress and concatenate into input-dir/base-filename.PRIMARY_EXT
+    fifo  -- create named pipes input-dir/base-filename.PRIMARY_EXT and start a background
+             process streaming decompressed source files into them when they are read;
+             the process should be killed when pipes are no longer needed
+             (PID is in input-dir/fifo_server.pid)
+At most nr-jobs (default: 8) files are created simultaneously in 'gzip' and 'unzip' modes.
+""")
+#}}}
+
+def main(): #{{{
+    global rawdata_dir, input_dir
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-m", dest="mode", default="gzip", choices=modes)
+    parser.add_argument("-j", dest="nr_jobs", default=8, type=int)
+    parser.add_argument("rawdata_dir")
+    parser.add_argument("input_dir")
+    if len(sys.argv)<3:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+    rawdata_dir = rw.resolvePath(args.rawdata_dir)
+    input_dir = rw.makePath(args.input_dir)
+    loadFileList()
+
+    mode = args.mode
+    if mode=="gzip":
+        not_gzipped = [ _fn for _fns in bfn_to_fns.values() for _fn in _fns if not rw.isGzipped(_fn) ]
+        if secondary_ext=="" or len(not_gzipped) > 0:
+            p.vprint(1, "Not all source files are gzipped, using 'unzip' mode.")
+            mode = "unzip"
+    p.vprint(1, "Concatenating %d source files to %d files (mode: %s)..."
+                % (sum(map(len, bfn_to_fns.values())), len(bfn_to_fns), mode))
+    if mode=="fifo":
+        runFifoServer()
+    else:
+        # Largest outputs first, so that they do not end up running alone at the end
+        bfns = sorted(bfn_to_fns.keys(), reverse=True,
+                      key=lambda _b: sum(map(os.path.getsize, bfn_to_fns[_b])))
+        pool = ThreadPool(args.nr_jobs)
+        rcs = pool.map(joinGzipped if mode=="gzip" else joinUnzipped, bfns)
+        pool.close()
+        failed = [ _b for (_b,_rc) in zip(bfns, rcs) if _rc!=0 ]
+        if len(failed) > 0:
+            p.printList(0, "ERROR: failed to concatenate %d files", failed)
+            exit(1)
+    p.vprint(1, "Done.")
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
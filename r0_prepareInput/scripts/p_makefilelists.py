@@ -11,16 +11,19 @@ import time
 
 import params as p
 import rwfiles as rw
+import samples
+from samples import SampleRegistry
 
 
-special_parnames = set([ "Batch", "Read", "file" ])
-nosl_parnames = set([ "Read", "file" ])
 must_parnames = [ "file" ]
+special_parnames = samples.special_parnames   # not in sample names (see 'samples' module);
+nosl_parnames = samples.nosl_parnames         # not in sample descriptions; more for --discover
 zip_extensions = set([ ".gz" ])
 
 global input_path   # absolute path for input file
 global parnames     # [ parname ] -- like Phenotype, CellType, ...
 global filelist     # [ map : parname --> parvalue ]
+global registry     # SampleRegistry of 'filelist'
 global unique_samplenames   # [ sample-name ]
 global unique_filenames     # [ file-name ]
 global is_paired_end        # either "T", or "F", or empty string
@@ -28,7 +31,7 @@ global primary_ext          # like ".fastq", ".CEL", ...
 global secondary_ext        # either ".gz" or empty string
 
 # Parsers and related {{{
-def loadTxt(input_path): #{{{
+def loadTxt(input_path, as_table=False): #{{{
     def getSplitPos(line):
         split_pos = []
         state = 1   # 0: waiting for space;  1: waiting for non-space
@@ -59,6 +62,8 @@ def loadTxt(input_path): #{{{
             else: #state==1
                 words = splitByPos(pure_line, split_pos_pairs)
                 rows.append( dict([ (parnames[_i],words[_i]) for _i in range(len(parnames)) ]) )
+    if as_table:
+        return (rw.Table.fromRows(rows, parnames), parnames)
     return (rows,parnames)
 #}}}
 def checkAndFillOmissions(): # Fill omissions in 'filelist' {{{
@@ -124,19 +129,11 @@ def getExtensions(): #{{{
     secondary_ext = min(secexts)
 #}}}
 def addBasenames(): #{{{
-    global unique_samplenames, unique_filenames
-    unique_samplenames = []
-    unique_filenames = []
-    base_parnames = [ _p for _p in parnames if _p not in special_parnames ]
-    file_parnames = base_parnames + (["Read"] if "Read" in parnames else [])
-    for row in filelist:
-        samplename = '_'.join([ row[_p] for _p in base_parnames ])
-        filename = '_'.join([ row[_p] for _p in file_parnames ])
-        row["SampleName"] = samplename
-        row["Basefilename"] = filename
-        row["Affyfilename"] = samplename + primary_ext + secondary_ext
-        if samplename not in unique_samplenames:  unique_samplenames.append(samplename)
-        if filename not in unique_filenames:  unique_filenames.append(filename)
+    global registry, unique_samplenames, unique_filenames
+    registry = SampleRegistry(filelist, parnames, special_parnames)
+    registry.addBasenames(primary_ext + secondary_ext)
+    unique_samplenames = registry.samplenames
+    unique_filenames = registry.basenames
 #}}}
 #}}}
 
@@ -144,7 +141,7 @@ def write_FL_SH(): #{{{
     needs_concat = "F"
     bfn_to_fns = []
     for bfn in unique_filenames:
-        flist = [ _r["file"] for _r in filelist if _r["Basefilename"]==bfn ]
+        flist = registry.files(bfn)
         if len(flist)>1:  needs_concat = "T"
         first_prefix = '    [%s]="' % bfn
         next_prefix = ' ' * len(first_prefix)
@@ -210,10 +207,7 @@ getOrigFiles () {
 
 def write_SD(): #{{{
     sl_parnames = ["SampleName"] + [ _p for _p in parnames if _p not in nosl_parnames ]
-    sl_rows = []
-    for row in filelist:
-        sl_row = dict([ (_p,row[_p]) for _p in sl_parnames ])
-        if sl_row not in sl_rows:  sl_rows.append(sl_row)
+    sl_rows = registry.sampleRows(sl_parnames)
     rw.saveCSV(os.path.join(p.projdir,"processedData","SampleDescription.csv"),sl_rows,sl_parnames)
 #}}}
 
@@ -237,11 +231,16 @@ def printUsage(): #{{{
     p.vprint(0, """\
 Usage:
         scripts/xvpy [-v] makefilelist.py  desciption-file  out-format [out-format...]
+        scripts/xvpy [-v] makefilelist.py  --discover raw-data-dir  out-format [out-format...]
 Description-file should be a simple file name and be located in 'scripts/' directory.
 It must have one of the following extensions:
     txt -- space-separated, with left-justified columns
     csv -- tab-separated
     xls -- Excel spreadsheet (must have file description in the first worksheet)
+With --discover, files are described by their Illumina names instead: Fastq files under
+raw-data-dir (usually $rawdata_dir of scripts/a_dirnames.sh) named like
+"Sample_S1_L001_R1_001.fastq.gz" get parameters Sample, Lane and Read; lanes and chunks of a
+sample are concatenated.  The listing of raw-data-dir is cached until its directories change.
 Currently supported output formats:
     sd      -- processedData/SampleDescription.csv
     affy    -- processedData/Affy_SampleDescription.txt -- for simpleaffy::read.affy(...)
@@ -256,21 +255,27 @@ intype_to_parser = dict([ (".txt", loadTxt),
 outfmt_to_writer = dict([ ("sd", write_SD),
                           ("affy", write_AffySD) ])
 def main(): #{{{
-    global input_path, parnames, filelist
+    global input_path, parnames, filelist, special_parnames, nosl_parnames
     p.vprint(0, "=== Parsing description of input files")
     if len(sys.argv)<3:
         printUsage()
         exit()
     
+    discover = (sys.argv[1]=="--discover")
+    if discover:
+        del sys.argv[1]
+        if len(sys.argv)<3:
+            printUsage()
+            exit()
     input_fn = sys.argv[1]
     _, input_type = os.path.splitext(input_fn)
     out_formats = sys.argv[2:]
     
     p.vprint(1, "Execution parameters:")
-    p.vprint(1, "    Input file:        %s" % input_fn)
+    p.vprint(1, "    %s %s" % ("Raw-data directory:" if discover else "Input file:        ", input_fn))
     p.vprint(1, "    Output formats:    %s" % ", ".join(out_formats))
     
-    if input_type not in intype_to_parser:
+    if not discover and input_type not in intype_to_parser:
         p.vprint(0, "ERROR: unknown input file format: %s" % input_type)
         printUsage()
         exit()
@@ -281,15 +286,25 @@ def main(): #{{{
             printUsage()
             exit()
     
-    input_path = os.path.join(p.projdir, "scripts", input_fn)
-    
-    if not os.path.isfile(input_path):
-        p.vprint(0, "ERROR: input file does not exist: %s" % input_path)
-        printUsage()
-        exit()
-    
-    # Parse
-    (filelist,parnames) = intype_to_parser[input_type](input_path)
+    if discover:
+        input_path = rw.resolvePath(input_fn)
+        if not os.path.isdir(input_path):
+            p.vprint(0, "ERROR: raw-data directory does not exist: %s" % input_path)
+            printUsage()
+            exit()
+        (filelist,parnames) = samples.discoverFiles(input_path)
+        special_parnames = samples.discovered_special_parnames
+        nosl_parnames = samples.discovered_nosl_parnames
+    else:
+        input_path = os.path.join(p.projdir, "scripts", input_fn)
+        
+        if not os.path.isfile(input_path):
+            p.vprint(0, "ERROR: input file does not exist: %s" % input_path)
+            printUsage()
+            exit()
+        
+        # Parse
+        (filelist,parnames) = intype_to_parser[input_type](input_path)
     checkAndFillOmissions()
     getExtensions()
     addBasenames()
@@ -0,0 +1,88 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Trim reads (TrimGalore defaults) and collect FastQC-like statistics of trimmed reads in one pass.
+See 'trimming' and 'fastqqc' modules for details and 'printUsage()' function for usage.
+"""
+
+import sys
+import os
+import os.path
+import argparse
+import multiprocessing
+
+import params as p
+import rwfiles as rw
+import trimming
+
+
+global out_dir, qc_dir, trim_params
+def processSample(filenames): #{{{
+    return trimming.trimFiles(filenames, out_dir, trim_params, qc_dir)
+#}}}
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_trimqc.py  [options]  out-dir  fastq-file...
+Trims 3' ends of reads by quality, removes 3' adapters and short reads, like TrimGalore does
+with default settings (without indels in adapter alignments).  Output files and reports have
+TrimGalore names: "out-dir/name_trimmed.fq" (single-end) or "out-dir/name_val_1.fq" and
+"out-dir/name_val_2.fq" (paired-end), "out-dir/fastq-file_trimming_report.txt".
+Options:
+    --paired            -- fastq-files are pairs: R1 R2 R1 R2 ...; pairs of reads are kept or
+                           removed together
+    --qc-dir dir        -- also write FastQC-like reports of trimmed files to 'dir'
+                           (see p_fastqqc.py)
+    -q quality          -- Phred score cutoff of quality trimming (default: 20)
+    -a adapter          -- adapter sequence (default: auto-detected)
+    --stringency N      -- minimum overlap with adapter (default: 1)
+    -e error-rate       -- maximum rate of mismatches in adapter (default: 0.1)
+    --length N          -- minimum length of trimmed reads (default: 20)
+    -j nr-processes     -- samples processed in parallel (default: number of CPUs)
+""")
+#}}}
+
+def main(): #{{{
+    global out_dir, qc_dir, trim_params
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--paired", action="store_true")
+    parser.add_argument("--qc-dir", dest="qc_dir", default=None)
+    parser.add_argument("-q", dest="quality", default=20, type=int)
+    parser.add_argument("-a", dest="adapter", default=None)
+    parser.add_argument("--stringency", default=1, type=int)
+    parser.add_argument("-e", dest="error_rate", default=0.1, type=float)
+    parser.add_argument("--length", default=20, type=int)
+    parser.add_argument("-j", dest="nr_processes", default=None, type=int)
+    parser.add_argument("out_dir")
+    parser.add_argument("fastq_files", nargs='+')
+    if len(sys.argv)<3:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+    out_dir = rw.makePath(args.out_dir)
+    qc_dir = rw.makePath(args.qc_dir) if args.qc_dir is not None else None
+    trim_params = trimming.TrimParams(args.quality, args.adapter, args.stringency,
+                                      args.error_rate, args.length)
+
+    filenames = [ rw.resolvePath(_fn) for _fn in args.fastq_files ]
+    if args.paired:
+        if len(filenames) % 2 != 0:
+            raise Exception("Odd number of files in paired-end mode.")
+        samples = [ filenames[_i:_i+2] for _i in range(0, len(filenames), 2) ]
+    else:
+        samples = [ [_fn] for _fn in filenames ]
+    samples.sort(key=lambda _s: sum(map(os.path.getsize, _s)), reverse=True)
+    if len(samples)==1:
+        processSample(samples[0])
+    else:
+        pool = multiprocessing.Pool(args.nr_processes)
+        pool.map(processSample, samples, 1)
+        pool.close()
+        pool.join()
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
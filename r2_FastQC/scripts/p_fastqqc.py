@@ -0,0 +1,63 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Quality control of Fastq files by 'fastqqc' module (FastQC-like reports), with a pool of processes.
+See 'printUsage()' function.
+"""
+
+import sys
+import os
+import os.path
+import argparse
+import multiprocessing
+
+import params as p
+import rwfiles as rw
+import fastqqc
+
+
+global out_dir
+def processFile(filename): #{{{
+    """Returns (filename, path of the report, number of reads)."""
+    stats = fastqqc.fastqStats(filename)
+    return (filename, fastqqc.saveReport(stats, filename, out_dir), stats.nr_reads)
+#}}}
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_fastqqc.py  [-j nr-processes]  out-dir  fastq-file...
+For each fastq-file, writes report "out-dir/file-name_fastqc.zip" in the format of FastQC
+(modules: basic statistics, per base and per sequence quality, per base sequence content,
+per sequence GC content, per base N content, sequence length distribution).
+Files are processed by nr-processes processes (default: number of CPUs), larger files first.
+""")
+#}}}
+
+def main(): #{{{
+    global out_dir
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-j", dest="nr_processes", default=None, type=int)
+    parser.add_argument("out_dir")
+    parser.add_argument("fastq_files", nargs='+')
+    if len(sys.argv)<3:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+    out_dir = rw.makePath(args.out_dir)
+
+    filenames = sorted([ rw.resolvePath(_fn) for _fn in args.fastq_files ],
+                       key=os.path.getsize, reverse=True)
+    p.vprint(1, "Processing %d Fastq files..." % len(filenames))
+    pool = multiprocessing.Pool(args.nr_processes)
+    for (filename, zip_path, nr_reads) in pool.imap_unordered(processFile, filenames):
+        p.vprint(1, "  %s: %d reads, report %s" % (filename, nr_reads, zip_path))
+    pool.close()
+    pool.join()
+    p.vprint(1, "Done.")
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
@@ -1,39 +1,46 @@
 #   -*- coding: utf-8 -*-
 
 """\
-This program collects summary files from FastQC folders specified in command line
-and compiles them into a single summary (printed to stdout)
-Usage:
-    scripts/xvpy  scripts/fqcsumm.py  filenames-file  fastqc-dir  [ > result.txt ]
+This program collects FastQC results of all input files and compiles them into a single summary:
+module statuses are printed to stdout as coloured marks, and statuses together with main
+metrics of each module can be written as one table (sample x metric) in TSV and JSON formats.
+Results are read directly from FastQC zip archives (or from extracted directories, if there
+are no archives), by a pool of processes.
+See 'printUsage()' function.
 """
 
 import sys
 import os
 import os.path
+import json
+import zipfile
+import argparse
+import multiprocessing
+from collections import OrderedDict
 from termcolor import colored
 
 import params as p
 import rwfiles as rw
 
-header = """\
-Basic Statistics
-| Per base sequence quality
-| | Per sequence quality scores
-| | | Per base sequence content
-| | | | Per base GC content
-| | | | | Per sequence GC content
-| | | | | | Per base N content
-| | | | | | | Sequence Length Distribution
-| | | | | | | | Sequence Duplication Levels
-| | | | | | | | | Overrepresented sequences
-| | | | | | | | | | Kmer Content
-| | | | | | | | | | |\
-"""
+module_names = [ "Basic Statistics",
+                 "Per base sequence quality",
+                 "Per tile sequence quality",
+                 "Per sequence quality scores",
+                 "Per base sequence content",
+                 "Per base GC content",
+                 "Per sequence GC content",
+                 "Per base N content",
+                 "Sequence Length Distribution",
+                 "Sequence Duplication Levels",
+                 "Overrepresented sequences",
+                 "Adapter Content",
+                 "Kmer Content" ]
 
 marks = dict([
         ("PASS", colored("+",on_color="on_green",attrs=["bold"])),
         ("WARN", colored("?",on_color="on_yellow",attrs=["bold"])),
-        ("FAIL", colored("-",on_color="on_red",attrs=["bold"]))
+        ("FAIL", colored("-",on_color="on_red",attrs=["bold"])),
+        ("",     " ")       # module not run by this version of FastQC
 ])
 
 global is_paired_end
@@ -41,35 +48,212 @@ global basenames    # [ base-filename ]
 global basename_len
 def prepareFileList(): #{{{
     global is_paired_end, basenames, basename_len
-    is_paired_end = os.getenv("IS_PAIRED_END")=="T"
-    basenames = os.getenv("BASE_FILENAMES").split()
+    if os.getenv("BASE_FILENAMES") is not None:
+        is_paired_end = os.getenv("IS_PAIRED_END")=="T"
+        basenames = os.getenv("BASE_FILENAMES").split()
+    else:
+        fl = rw.loadShellVars(os.path.join(p.projdir, "scripts", "g_filelist.sh"))
+        is_paired_end = fl["IS_PAIRED_END"]=="T"
+        basenames = fl["BASE_FILENAMES"].split()
     basename_len = max([ len(_bn) for _bn in basenames ]) + 2
 #}}}
 
-def printHeader(): #{{{
-    for hline in header.split('\n'):
-        p.vprint(0, "%*s %s" % (basename_len, " ", hline))
+def resultName(basename): #{{{
+    """Name of FastQC result (archive without '.zip', or directory) of base filename."""
+    if is_paired_end:
+        return "%s_val_%s.fq_fastqc" % (basename, basename[-1])
+    else:
+        return "%s_trimmed.fq_fastqc" % basename
+#}}}
+
+def readResult(fqc_dir, name): #{{{
+    """Returns (summary.txt, fastqc_data.txt) contents of FastQC result 'name',
+    from archive 'fqc_dir/name.zip' if it exists, otherwise from directory 'fqc_dir/name'.
+    """
+    zip_path = os.path.join(fqc_dir, name+".zip")
+    if os.path.isfile(zip_path):
+        with zipfile.ZipFile(zip_path) as zf:
+            return tuple([ zf.read("%s/%s" % (name,_fn)) for _fn in ["summary.txt","fastqc_data.txt"] ])
+    result = []
+    for fn in [ "summary.txt", "fastqc_data.txt" ]:
+        with open(os.path.join(fqc_dir, name, fn)) as f:
+            result.append(f.read())
+    return tuple(result)
+#}}}
+
+# Parsers {{{
+def parseSummary(text): #{{{
+    """Dict: module name --> status (PASS, WARN, FAIL) from summary.txt contents."""
+    statuses = dict()
+    for line in text.splitlines():
+        fields = line.split('\t')
+        if len(fields) >= 2:
+            statuses[fields[1]] = fields[0]
+    return statuses
 #}}}
 
-def processSamples(fqc_dir): #{{{
-    for basename in basenames:
-        if is_paired_end:
-            fn_suffix = "val_%s.fq_fastqc" % basename[-1]
+def parseFastqcData(text): #{{{
+    """Parse fastqc_data.txt contents.
+    Returns dict: module name --> (status, values, rows), where 'values' maps names of
+    "#Name<TAB>value" lines before the table header to values (like "Total Deduplicated
+    Percentage"), and 'rows' is a list of table rows (lists of strings) without the header.
+    """
+    modules = dict()
+    (name, status, values, rows) = (None, None, None, None)
+    for line in text.splitlines():
+        if line.startswith(">>END_MODULE"):
+            modules[name] = (status, values, rows)
+            name = None
+        elif line.startswith(">>"):
+            (name, status) = (line[2:].split('\t') + [""])[:2]
+            (values, rows) = (dict(), [])
+        elif name is None:
+            continue
+        elif line.startswith('#'):
+            fields = line[1:].split('\t')
+            if len(fields)==2 and len(rows)==0:
+                try:
+                    values[fields[0]] = float(fields[1])
+                except ValueError:
+                    pass
         else:
-            fn_suffix = "trimmed.fq_fastqc"
-        summary_fn = os.path.join(fqc_dir, "%s_%s" % (basename,fn_suffix), "summary.txt")
-        (rows,_) = rw.loadCSV( summary_fn, ["Status","Descr","Name"] )
-        out_line = "%-*s" % (basename_len, basename)
-        for row in rows:
-            out_line += " " + marks[ row["Status"] ]
-        p.vprint(0, out_line)
+            rows.append(line.split('\t'))
+    return modules
+#}}}
+
+def firstNumber(s): #{{{
+    """First number of FastQC position or range ("12" or "10-14")."""
+    return float(s.split('-')[0])
+#}}}
+
+def weightedMean(rows): #{{{
+    """Mean of the first column weighted by the second one."""
+    total = sum([ float(_r[1]) for _r in rows ])
+    if total==0:  return None
+    return sum([ firstNumber(_r[0])*float(_r[1]) for _r in rows ]) / total
+#}}}
+
+def moduleMetrics(modules): #{{{
+    """Main metrics from parsed fastqc_data.txt; returns OrderedDict: metric --> value
+    (None if the module is missing or empty).
+    """
+    def rows(name):
+        return modules[name][2] if name in modules else []
+    def column(name, idx):
+        return [ float(_r[idx]) for _r in rows(name) if len(_r) > idx and _r[idx] not in ("","NaN") ]
+    def maxOf(values):
+        return max(values) if len(values) > 0 else None
+    metrics = OrderedDict()
+    basic = dict([ (_r[0],_r[1]) for _r in rows("Basic Statistics") if len(_r) >= 2 ])
+    metrics["total_sequences"] = int(basic["Total Sequences"]) if "Total Sequences" in basic else None
+    metrics["poor_quality_sequences"] = ( int(basic["Sequences flagged as poor quality"])
+                                          if "Sequences flagged as poor quality" in basic else None )
+    metrics["sequence_length"] = basic.get("Sequence length")
+    metrics["gc_percent"] = float(basic["%GC"]) if "%GC" in basic else None
+    means = column("Per base sequence quality", 1)
+    metrics["mean_base_quality"] = sum(means)/len(means) if len(means) > 0 else None
+    medians = column("Per base sequence quality", 2)
+    metrics["min_median_base_quality"] = min(medians) if len(medians) > 0 else None
+    metrics["mean_sequence_quality"] = weightedMean(rows("Per sequence quality scores"))
+    content = [ [ float(_v) for _v in _r[1:5] ] for _r in rows("Per base sequence content") ]
+    metrics["max_at_difference"] = maxOf([ abs(_c[1]-_c[2]) for _c in content ])
+    metrics["max_gc_difference"] = maxOf([ abs(_c[0]-_c[3]) for _c in content ])
+    metrics["mean_sequence_gc"] = weightedMean(rows("Per sequence GC content"))
+    metrics["max_n_percent"] = maxOf(column("Per base N content", 1))
+    lengths = [ _r for _r in rows("Sequence Length Distribution") if float(_r[1]) > 0 ]
+    metrics["min_length"] = int(firstNumber(lengths[0][0])) if len(lengths) > 0 else None
+    metrics["max_length"] = int(lengths[-1][0].split('-')[-1]) if len(lengths) > 0 else None
+    metrics["deduplicated_percent"] = ( modules["Sequence Duplication Levels"][1]
+                                        .get("Total Deduplicated Percentage")
+                                        if "Sequence Duplication Levels" in modules else None )
+    metrics["overrepresented_sequences"] = ( len(rows("Overrepresented sequences"))
+                                             if "Overrepresented sequences" in modules else None )
+    metrics["max_overrepresented_percent"] = maxOf(column("Overrepresented sequences", 2))
+    adapters = [ float(_v) for _r in rows("Adapter Content") for _v in _r[1:] ]
+    metrics["max_adapter_percent"] = maxOf(adapters)
+    return metrics
+#}}}
+#}}}
+
+global fastqc_dir
+def processSample(basename): #{{{
+    """Returns (basename, statuses, metrics) of one input file."""
+    (summary, data) = readResult(fastqc_dir, resultName(basename))
+    return (basename, parseSummary(summary), moduleMetrics(parseFastqcData(data)))
+#}}}
+
+def printHeader(): #{{{
+    for (i, name) in enumerate(module_names):
+        p.vprint(0, "%*s %s%s" % (basename_len, " ", "| "*i, name))
+    p.vprint(0, "%*s %s" % (basename_len, " ", "| "*len(module_names)))
+#}}}
+
+def printMarks(results): #{{{
+    for (basename, statuses, _) in results:
+        p.vprint(0, "%-*s %s" % (basename_len, basename,
+                                 " ".join([ marks[statuses.get(_m,"")] for _m in module_names ])))
+#}}}
+
+def resultTable(results): #{{{
+    """List of OrderedDict rows: sample, status of each module (blank if missing), metrics."""
+    table = []
+    for (basename, statuses, metrics) in results:
+        row = OrderedDict([ ("sample", basename) ])
+        for name in module_names:
+            row[name] = statuses.get(name, "")
+        row.update(metrics)
+        table.append(row)
+    return table
+#}}}
+
+def saveTSV(filename, table): #{{{
+    def cell(v):
+        if v is None:  return ""
+        if isinstance(v, float):  return "%.4g" % v
+        return str(v)
+    lines = [ "\t".join(table[0].keys()) ]
+    lines += [ "\t".join([ cell(_v) for _v in _row.values() ]) for _row in table ]
+    rw.saveLines(filename, lines)
+#}}}
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy  scripts/p_fqcsumm.py  [-j nr-processes]  [--tsv file]  [--json file]  fastqc-dir
+Prints statuses of FastQC modules for each input file (base filename); files are taken from
+environment variables IS_PAIRED_END and BASE_FILENAMES, or from scripts/g_filelist.sh.
+    --tsv file, --json file -- also write statuses and main metrics of all modules as one table
+                               (row per input file) in TSV / JSON format
+    -j nr-processes         -- number of processes reading results (default: number of CPUs)
+""")
 #}}}
 
 def main(): #{{{
-    fqc_dir = sys.argv[1]
+    global fastqc_dir
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-j", dest="nr_processes", default=None, type=int)
+    parser.add_argument("--tsv", default=None)
+    parser.add_argument("--json", default=None)
+    parser.add_argument("fastqc_dir")
+    if len(sys.argv)<2:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+    fastqc_dir = rw.resolvePath(args.fastqc_dir)
     prepareFileList()
+
+    pool = multiprocessing.Pool(args.nr_processes)
+    results = pool.map(processSample, basenames)
+    pool.close()
     printHeader()
-    processSamples(fqc_dir)
+    printMarks(results)
+
+    table = resultTable(results)
+    if args.tsv is not None:
+        saveTSV(args.tsv, table)
+    if args.json is not None:
+        with open(rw.resolvePath(args.json), 'w') as f:
+            json.dump(table, f, indent=1)
 #}}}
 
 # Start-up code ================================================={{{
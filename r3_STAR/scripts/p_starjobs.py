@@ -0,0 +1,239 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Run STAR alignments of all samples concurrently, splitting cores among the runs.
+See 'jobs' module for details and 'printUsage()' function for usage.
+"""
+
+import sys
+import os
+import os.path
+import glob
+import json
+import time
+import shutil
+import argparse
+import multiprocessing
+
+import params as p
+import rwfiles as rw
+import jobs
+import manifest as mf
+import alignstats
+
+
+default_calibration = os.path.join("processedData", "star_calibration.json")
+throughput_colnames = [ "Sample", "Finished", "Concurrency", "Threads", "Input MB", "Reads",
+                        "Seconds", "Reads per second", "MB per second" ]
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_starjobs.py  [options]  out-dir  --  STAR-command...
+Runs 'STAR-command' (by bash) once for each sample, several runs at a time; "{sn}" is replaced
+by the sample name, "{tmp}" by a temporary directory of the sample (outputs are moved to
+'out-dir' only if STAR succeeds, see p_runjobs.py) and "{threads}" by the number of threads of
+one run.  With '--genomeLoad LoadAndKeep' (genome loaded before), concurrent runs share the
+genome in memory.  Samples are taken from SAMPLENAMES in scripts/g_filelist.sh.
+Options:
+    --cores N           -- cores available to all runs (default: number of CPUs)
+    --concurrency K     -- number of concurrent runs; each gets cores/K threads.  Default: the
+                           best concurrency found by calibration on a node with the same number
+                           of cores, otherwise one run per 8 cores
+    --job-mem GB        -- memory used by one run besides the shared genome (default: 0)
+    --mem GB            -- memory available to all runs (default: memory of the node)
+    --inputs pattern    -- glob pattern of input files of a sample (with "{sn}"), may be repeated
+    --logs dir          -- directory of STAR logs (stdout), one per sample (default: out-dir/logs)
+    --samples "sn..."   -- samples to align instead of SAMPLENAMES
+    --hash, --force     -- as in p_runjobs.py
+Calibration:
+    --calibrate         -- before aligning, map the first 'reads' reads (--readMapNumber) of
+                           samples with each split of cores (1 run with all cores, 2 runs with
+                           half of them, ..., down to 4 threads per run), and save the split
+                           with the highest number of reads per second
+    --calibrate-only    -- calibrate, but do not align
+    --reads N           -- reads mapped by each calibration run (default: 1000000)
+    --calibration file  -- results of calibration (default: %s)
+Throughput of each aligned sample (input size, number of reads from Log.final.out, time, reads
+and MB per second) is appended to "out-dir/throughput.tsv"; resources used by each run are
+appended to the run log with stage name "star" (see p_instrument.py).
+""" % default_calibration)
+#}}}
+
+def loadCalibration(filename, cores): #{{{
+    """Concurrency chosen by calibration saved in 'filename' for 'cores', or None."""
+    fpath = rw.resolvePath(filename)
+    if not os.path.isfile(fpath):
+        return None
+    with open(fpath) as f:
+        calibration = json.load(f)
+    if calibration.get("cores")!=cores:
+        p.vprint(1, "Calibration in %s is for %s cores, not %d; not used." %
+                    (fpath, calibration.get("cores"), cores))
+        return None
+    return calibration["concurrency"]
+#}}}
+
+def calibrate(command, samples, inputs, cores, reads, calib_dir, filename): #{{{
+    """Map 'reads' reads of 'samples' with each split of 'cores' (see jobs.threadSplits):
+    K concurrent runs, of different samples if there are enough of them.  Reads per second of
+    each split are computed from "Number of input reads" of STAR logs and the time of all runs.
+    The results and the best split are saved to 'filename' (JSON); returns the best concurrency.
+    """
+    def sampleSize(sn):
+        return sum([ jobs.inputSize(rw.resolvePath(_pt.replace("{sn}", sn))) for _pt in inputs ])
+    samples = sorted(samples, key=sampleSize, reverse=True)
+    results = []
+    for (concurrency, threads) in jobs.threadSplits(cores):
+        run_dir = os.path.join(calib_dir, "%dx%d" % (concurrency, threads))
+        job_list = []
+        for i in range(concurrency):
+            sn = samples[i % len(samples)]
+            tmp_dir = rw.makePath(os.path.join(run_dir, str(i)))
+            cmd = command.replace("{sn}", sn).replace("{tmp}", tmp_dir).replace("{threads}", str(threads))
+            job_list.append( jobs.Job(sn, "%s --readMapNumber %d" % (cmd, reads),
+                                      cores=threads, threads=threads,
+                                      log_path=os.path.join(tmp_dir, "stdout.log")) )
+        p.vprint(1, "Calibration: %d runs with %d threads..." % (concurrency, threads))
+        started = time.time()
+        jobs.JobRunner(cores).run(job_list)
+        seconds = time.time() - started
+        failed = len([ _j for _j in job_list if _j.rc!=0 ])
+        nr_reads = 0
+        for (i, job) in enumerate(job_list):
+            log_fn = os.path.join(run_dir, str(i), job.name+"_Log.final.out")
+            if job.rc==0 and os.path.isfile(log_fn):
+                nr_reads += alignstats.parseStarLog(log_fn).get("Number of input reads", 0)
+        result = dict(concurrency=concurrency, threads=threads, seconds=round(seconds, 2),
+                      reads=nr_reads, reads_per_s=round(nr_reads/seconds, 1), failed=failed)
+        p.vprint(1, "  %d x %d threads: %d reads in %.1f s, %.0f reads/s%s" %
+                    (concurrency, threads, nr_reads, seconds, result["reads_per_s"],
+                     (", %d runs FAILED" % failed) if failed > 0 else ""))
+        results.append(result)
+        shutil.rmtree(run_dir)
+    shutil.rmtree(calib_dir)
+    ok = [ _r for _r in results if _r["failed"]==0 and _r["reads"] > 0 ]
+    if len(ok)==0:
+        raise Exception("Calibration failed: no split of cores mapped any reads.")
+    best = max(ok, key=lambda _r: _r["reads_per_s"])
+    fpath = rw.resolvePath(filename)
+    rw.makePath(os.path.dirname(fpath))
+    tmp_path = "%s.tmp%d" % (fpath, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(cores=cores, concurrency=best["concurrency"], threads=best["threads"],
+                       reads=reads, results=results), f, indent=1, sort_keys=True)
+    os.rename(tmp_path, fpath)
+    p.vprint(1, "Best: %d runs with %d threads (saved to %s)." %
+                (best["concurrency"], best["threads"], fpath))
+    return best["concurrency"]
+#}}}
+
+def appendThroughput(filename, rows): #{{{
+    """Append rows (maps colname --> value) to TSV file 'filename' (header written if new)."""
+    is_new = not os.path.isfile(filename)
+    with open(filename, 'a') as f:
+        if is_new:
+            f.write('\t'.join(throughput_colnames) + '\n')
+        for row in rows:
+            f.write('\t'.join([ str(row[_cn]) for _cn in throughput_colnames ]) + '\n')
+#}}}
+
+def main(): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--cores", default=None, type=int)
+    parser.add_argument("--concurrency", default=None, type=int)
+    parser.add_argument("--job-mem", dest="job_mem", default=0, type=float)
+    parser.add_argument("--mem", default=None, type=float)
+    parser.add_argument("--inputs", action="append", default=[])
+    parser.add_argument("--logs", default=None)
+    parser.add_argument("--samples", default=None)
+    parser.add_argument("--hash", action="store_true")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--calibrate", action="store_true")
+    parser.add_argument("--calibrate-only", dest="calibrate_only", action="store_true")
+    parser.add_argument("--reads", default=1000000, type=int)
+    parser.add_argument("--calibration", default=default_calibration)
+    parser.add_argument("out_dir")
+    parser.add_argument("command", nargs='+')
+    if len(sys.argv)<3:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+
+    if args.samples is None:
+        fl = rw.loadShellVars(os.path.join(p.projdir, "scripts", "g_filelist.sh"))
+        args.samples = fl["SAMPLENAMES"]
+    samples = args.samples.split()
+    cores = args.cores or multiprocessing.cpu_count()
+    max_mem = int(args.mem*1024) if args.mem is not None else jobs.totalMemory()
+    out_dir = rw.makePath(args.out_dir)
+    log_dir = rw.makePath(args.logs or os.path.join(out_dir, "logs"))
+    command = " ".join(args.command)
+    if "{threads}" not in command:
+        raise Exception("Command does not contain {threads}.")
+
+    concurrency = args.concurrency
+    if args.calibrate or args.calibrate_only:
+        concurrency = calibrate(command, samples, args.inputs, cores, args.reads,
+                                os.path.join(out_dir, mf.tmp_dirname, "calibration"), args.calibration)
+        if args.calibrate_only:
+            return
+    if concurrency is None:
+        concurrency = loadCalibration(args.calibration, cores) or max(cores // 8, 1)
+
+    # Signatures are computed from the command before threads are filled in: the split of
+    # cores does not change results, so a different concurrency does not make samples outdated
+    manifest = mf.Manifest(out_dir, args.hash)
+    (job_list, signatures, sizes, skipped) = ([], dict(), dict(), [])
+    for sn in samples:
+        cmd = command.replace("{sn}", sn)
+        input_paths = sorted([ _ip for _pt in args.inputs
+                               for _ip in glob.glob(rw.resolvePath(_pt.replace("{sn}", sn))) ])
+        signatures[sn] = manifest.signature(input_paths, cmd)
+        if not args.force and manifest.isUpToDate(sn, signatures[sn]):
+            skipped.append(sn)
+            continue
+        sizes[sn] = sum([ os.path.getsize(_ip) for _ip in input_paths if os.path.isfile(_ip) ])
+        job_list.append( jobs.Job(sn, cmd.replace("{tmp}", manifest.tmpDir(sn)), sizes[sn],
+                                  mem=int(args.job_mem*1024),
+                                  log_path=os.path.join(log_dir, sn+".log")) )
+    if len(skipped) > 0:
+        p.printList(1, "Skipping %d samples which are up to date", skipped)
+    if len(job_list)==0:
+        return
+    # With fewer samples than concurrent runs, each run gets more threads
+    concurrency = min(concurrency, len(job_list))
+    threads = max(cores // concurrency, 1)
+    p.vprint(1, "Aligning %d samples, %d at a time with %d threads each..." %
+                (len(job_list), concurrency, threads))
+    for job in job_list:
+        job.command = job.command.replace("{threads}", str(threads))
+        (job.cores, job.threads) = (threads, threads)
+
+    throughput_fn = os.path.join(out_dir, "throughput.tsv")
+    def commitJob(job):
+        if job.rc!=0:
+            return
+        manifest.record(job.name, signatures[job.name], manifest.commitOutputs(job.name))
+        log_fn = os.path.join(out_dir, job.name+"_Log.final.out")
+        nr_reads = alignstats.parseStarLog(log_fn).get("Number of input reads", 0) \
+                   if os.path.isfile(log_fn) else 0
+        seconds = job.elapsed()
+        mbytes = sizes[job.name] / 1048576.0
+        appendThroughput(throughput_fn, [ { "Sample": job.name,
+                        "Finished": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job.end_time)),
+                        "Concurrency": concurrency, "Threads": threads,
+                        "Input MB": "%.1f" % mbytes, "Reads": nr_reads, "Seconds": "%.1f" % seconds,
+                        "Reads per second": "%.1f" % (nr_reads/seconds),
+                        "MB per second": "%.2f" % (mbytes/seconds) } ])
+    runner = jobs.JobRunner(cores, None, max_mem, stage="star")
+    runner.run(job_list, commitJob)
+    jobs.printReport(0, job_list)
+    if len([ _j for _j in job_list if _j.rc!=0 ]) > 0:
+        exit(1)
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
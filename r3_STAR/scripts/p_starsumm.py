@@ -0,0 +1,69 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Collect alignment metrics of all samples (STAR logs, optionally SAM statistics) into one table.
+See 'alignstats' module for details and 'printUsage()' function for usage.
+"""
+
+import sys
+import os
+import os.path
+import time
+import argparse
+
+import params as p
+import rwfiles as rw
+import alignstats
+
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_starsumm.py  [options]  star-dir
+Reads "star-dir/sample-name_Log.final.out" of each sample (default: SAMPLENAMES in
+scripts/g_filelist.sh) and writes a table with a row per sample and a column per metric:
+    star-dir/alignment_summary.tsv
+    star-dir/alignment_summary.json     -- the same metrics, and timing of the summary
+Options:
+    --sam               -- also compute statistics of "star-dir/sample-name_Aligned.out.sam"
+                           (flags, mapping quality, spliced alignments, mates, insert sizes)
+                           in one pass, by a pool of worker processes
+    -j nr-workers       -- number of worker processes (default: number of CPUs)
+    --samples "sn..."   -- samples to summarize instead of SAMPLENAMES
+    --out prefix        -- write "prefix.tsv" and "prefix.json" instead
+""")
+#}}}
+
+def main(): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--sam", action="store_true")
+    parser.add_argument("-j", dest="nr_workers", default=None, type=int)
+    parser.add_argument("--samples", default=None)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("star_dir")
+    if len(sys.argv)<2:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+    started = time.time()
+    if args.samples is None:
+        fl = rw.loadShellVars(os.path.join(p.projdir, "scripts", "g_filelist.sh"))
+        args.samples = fl["SAMPLENAMES"]
+    samples = args.samples.split()
+    star_dir = rw.resolvePath(args.star_dir)
+    out_prefix = args.out or os.path.join(star_dir, "alignment_summary")
+
+    log_filenames = [ os.path.join(star_dir, _sn+"_Log.final.out") for _sn in samples ]
+    sam_filenames = None
+    if args.sam:
+        sam_filenames = [ os.path.join(star_dir, _sn+"_Aligned.out.sam") for _sn in samples ]
+    summary = alignstats.summarizeSamples(samples, log_filenames, sam_filenames, args.nr_workers)
+    timing = { "samples": len(samples), "sam": args.sam, "seconds": round(time.time()-started, 2) }
+    alignstats.saveSummary(summary, out_prefix+".tsv", out_prefix+".json", timing)
+    p.vprint(1, "Done, %d samples in %.1f s." % (len(samples), timing["seconds"]))
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
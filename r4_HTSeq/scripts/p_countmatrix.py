@@ -0,0 +1,57 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Merge htseq-count outputs of all samples into one gene x sample count matrix.
+See 'htcount' module for details and 'printUsage()' function for usage.
+"""
+
+import sys
+import os
+import os.path
+import argparse
+
+import params as p
+import rwfiles as rw
+import htcount
+
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_countmatrix.py  [-j nr-workers]  [--samples "sn..."]  htseq-dir
+Reads "htseq-dir/sample-name_htseq.count" of each sample (default: SAMPLENAMES in
+scripts/g_filelist.sh) and writes:
+    htseq-dir/count_matrix/     -- matrix in binary form (see htcount.CountMatrix.load)
+    htseq-dir/counts.tsv        -- counts of genes, a column per sample
+    htseq-dir/counts_qc.tsv     -- special counters (__no_feature, __ambiguous, ...)
+Files are read by nr-workers processes (default: number of CPUs); genes must be the same,
+in the same order, in all files.
+""")
+#}}}
+
+def main(): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-j", dest="nr_workers", default=None, type=int)
+    parser.add_argument("--samples", default=None)
+    parser.add_argument("htseq_dir")
+    if len(sys.argv)<2:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+    if args.samples is None:
+        fl = rw.loadShellVars(os.path.join(p.projdir, "scripts", "g_filelist.sh"))
+        args.samples = fl["SAMPLENAMES"]
+    samples = args.samples.split()
+    htseq_dir = rw.resolvePath(args.htseq_dir)
+
+    matrix = htcount.buildCountMatrix([ os.path.join(htseq_dir, _sn+"_htseq.count") for _sn in samples ],
+                                      samples, args.nr_workers)
+    matrix.save(os.path.join(htseq_dir, "count_matrix"))
+    matrix.saveTSV(os.path.join(htseq_dir, "counts.tsv"))
+    matrix.saveTSV(os.path.join(htseq_dir, "counts_qc.tsv"), qc=True)
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}
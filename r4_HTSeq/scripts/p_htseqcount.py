@@ -0,0 +1,82 @@
+#   -*- coding: utf-8 -*-
+
+"""\
+Count reads per gene in SAM files (htseq-count "union" mode) with a pool of worker processes.
+See 'htcount' module for details and 'printUsage()' function for usage.
+"""
+
+import sys
+import os
+import os.path
+import argparse
+
+import params as p
+import rwfiles as rw
+import htcount
+import manifest as mf
+
+
+def printUsage(): #{{{
+    p.vprint(0, """\
+Usage:
+        scripts/xvpy [-v] scripts/p_htseqcount.py  [options]  gtf-file  out-dir  sam-file...
+Options:
+    -s yes|no|reverse   -- strand-specific counting (default: yes, like htseq-count)
+    -t feature-type     -- feature type (3rd column of GTF) to count (default: exon)
+    -i attribute        -- attribute used as feature name (default: gene_id)
+    -a min-quality      -- skip alignments with lower mapping quality (default: 10)
+    -j nr-workers       -- number of worker processes (default: number of CPUs)
+    --suffix suffix     -- suffix of SAM file names removed to get sample names
+                           (default: _Aligned.out.sam)
+    --force             -- count all samples; by default, samples already counted from the same
+                           SAM and GTF files with the same options are skipped
+                           (see 'manifest' module; the manifest is kept in out-dir)
+For each sam-file "sample-name + suffix", file "out-dir/sample-name_htseq.count" is written.
+""")
+#}}}
+
+def main(): #{{{
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-s", dest="stranded", default="yes", choices=htcount.stranded_values)
+    parser.add_argument("-t", dest="gfftype", default="exon")
+    parser.add_argument("-i", dest="name_attr", default="gene_id")
+    parser.add_argument("-a", dest="minaqual", default=10, type=int)
+    parser.add_argument("-j", dest="nr_workers", default=None, type=int)
+    parser.add_argument("--suffix", default="_Aligned.out.sam")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("gtf_file")
+    parser.add_argument("out_dir")
+    parser.add_argument("sam_files", nargs='+')
+    if len(sys.argv)<4:
+        printUsage()
+        exit()
+    args = parser.parse_args()
+
+    out_dir = rw.makePath(args.out_dir)
+    manifest = mf.Manifest(out_dir)
+    params = "-s %s -t %s -i %s -a %d" % (args.stranded, args.gfftype, args.name_attr, args.minaqual)
+    (sam_filenames, count_filenames, signatures) = ([], [], [])
+    for sam_fn in args.sam_files:
+        sn = os.path.basename(sam_fn)
+        if sn.endswith(args.suffix):  sn = sn[:-len(args.suffix)]
+        sig = manifest.signature([ rw.resolvePath(sam_fn), rw.resolvePath(args.gtf_file) ], params)
+        if not args.force and manifest.isUpToDate(sn, sig):
+            p.vprint(1, "Skipping %s: up to date." % sn)
+            continue
+        sam_filenames.append(sam_fn)
+        count_filenames.append( os.path.join(out_dir, sn+"_htseq.count") )
+        signatures.append( (sn, sig) )
+    if len(sam_filenames)==0:
+        p.vprint(1, "All samples are up to date.")
+        return
+    htcount.countSamples(args.gtf_file, sam_filenames, count_filenames,
+                         args.stranded, args.gfftype, args.name_attr, args.minaqual,
+                         args.nr_workers)
+    for ((sn, sig), count_fn) in zip(signatures, count_filenames):
+        manifest.record(sn, sig, mf.outputSizes(out_dir, [ os.path.basename(count_fn) ]))
+#}}}
+
+# Start-up code ================================================={{{
+if __name__=="__main__":
+    main()
+#................................................................}}}